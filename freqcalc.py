@@ -16,7 +16,16 @@ import argparse
 from signal import signal, SIGPIPE, SIG_DFL
 import os.path
 import datetime
+import gzip
+import json
+import multiprocessing
+from heapq import merge
+from itertools import chain
 from sys import stderr, exit
+import numpy
+import heterogenesis_bgzf
+import heterogenesis_profile
+import heterogenesis_targets
 
 signal(SIGPIPE, SIG_DFL) # Handle broken pipes
 
@@ -24,15 +33,35 @@ signal(SIGPIPE, SIG_DFL) # Handle broken pipes
 version = {}
 with open(os.path.join(os.path.abspath(os.path.dirname(__file__)), 'version.py')) as f: exec(f.read(), version)
 
-def main():
+workertasks={}  #functions for worker processes to run, set before the pool is started so that forked workers inherit them
+
+def runworkertask(task):
+    try:
+        return workertasks[task[0]](*task[1])
+    except SystemExit as e:    #errors in a worker are returned, so the main process can exit
+        return e
+
+def main(argv=None,proportions=None,profiles=None):
+    #argv is a list of command line options (sys.argv by default). heterogenesis_api passes in clone proportions (a dictionary of
+    #clone : fraction) rather than a clones file, and clone profiles held in memory (a dictionary of clone : MEMORYPROFILE) rather than files
     parser = argparse.ArgumentParser(description="Create random SNVs, indels and CNVs for each subclone in a tumour sample.")
     parser.add_argument('-v', '--version', action='version', version='%(prog)s {0}'.format(version['__version__']))
-    parser.add_argument('-c', '--clones', dest='clonefile', required=True, type=str, help="File with clone proportions in format: 'clone name' \t 'fraction'.")
+    mixtures = parser.add_mutually_exclusive_group(required=proportions==None)
+    mixtures.add_argument('-c', '--clones', dest='clonefile', type=str, help="File with clone proportions in format: 'clone name' \t 'fraction'.")
+    mixtures.add_argument('-s', '--series', dest='seriesfile', type=str, help="File with clone proportions of a series of samples, with a header line: 'Sample' \t 'clone name' \t ..., and a line for each sample: 'sample name' \t 'fraction' \t ... .")
     parser.add_argument('-d', '--directory', dest='directory', required=True, type=str, help='Directory containing VCF and CNV files.')
     parser.add_argument('-p', '--prefix', dest='prefix', required=True, type=str, help='Prefix of VCF and CNV file names.')
-    parser.add_argument('-n', '--name', dest='name', required=True, type=str, help='Output name of tumour sample.')
+    parser.add_argument('-n', '--name', dest='name', type=str, help='Output name of tumour sample (with -c).')
+    parser.add_argument('-i', '--index', dest='index', action='store_true', help='Write vcf and copy number files bgzip compressed, with tabix indexes.')
+    parser.add_argument('-w', '--workers', dest='workers', type=int, default=1, help='Number of processes to use for mixing chromosomes, with per chromosome files from heterogenesis_varincorp -x.')
+    parser.add_argument('-t', '--targets', dest='targets', type=str, help='BED file of target regions. Only copy numbers and variants within targets are written.')
+    parser.add_argument('-g', '--padding', dest='padding', type=int, default=100, help='Bases added to each side of targets (default: 100)')
+    parser.add_argument('-k', '--keepshards', dest='keepshards', action='store_true', help='With per chromosome files from heterogenesis_varincorp -x, write per chromosome outputs rather than joining them.')
 
-    args = parser.parse_args()
+    args = parser.parse_args(argv)
+    if profiles==None:
+        profiles={}
+    targets=heterogenesis_targets.TARGETS(args.targets,None,args.padding) if args.targets!=None else None
 
     def warning(msg):
         print('WARNING: {}'.format(msg), file=stderr)
@@ -41,10 +70,13 @@ def main():
         print('ERROR: {}'.format(msg), file=stderr)
         exit(exit_code)
 
-    def getstart(block):
-        return(block.start)
+    def openvariantfile(filename):  #variant files from heterogenesis_varincorp may be bgzip compressed (with -i)
+        if not os.path.exists(filename) and os.path.exists(filename+'.gz'):
+            return gzip.open(filename+'.gz','rt')
+        return open(filename,'r')
 
     class BLOCK(object):
+        __slots__=('start','end','content','aallele','ballele')
         def __init__(self, start, end, content, aallele, ballele):
             self.start = start
             self.end = end
@@ -54,136 +86,291 @@ def main():
         def includes(self, other):  #self completely includes other
             if (other.start >= self.start) and (other.end <= self.end): return True
             return False
-        def splitby(self,other):    #other start or end in middle of self
-            if (other.start > self.start) and (other.start <= self.end): return True
-            elif (other.end >= self.start) and (other.end < self.end): return True
-            return False
         def __str__(self): return('BLOCK: {}-{}, {}'.format(self.start, self.end, self.content))
 
 
-    def splitblocks(blocks,spblock,newblock):
-        if newblock.start > spblock.start and newblock.end < spblock.end:
-            leftblock=BLOCK(spblock.start,newblock.start-1,spblock.content,spblock.aallele,spblock.ballele)
-            midblock=BLOCK(newblock.start,newblock.end,spblock.content,spblock.aallele,spblock.ballele)
-            rightblock=BLOCK(newblock.end+1,spblock.end,spblock.content,spblock.aallele,spblock.ballele)
-            blocks[blocks.index(spblock):blocks.index(spblock)+1]=[leftblock,midblock,rightblock]
-            return blocks
-        elif newblock.start > spblock.start:
-            leftblock=BLOCK(spblock.start,newblock.start-1,spblock.content,spblock.aallele,spblock.ballele)
-            rightblock=BLOCK(newblock.start,spblock.end,spblock.content,spblock.aallele,spblock.ballele)
-            blocks[blocks.index(spblock):blocks.index(spblock)+1]=[leftblock,rightblock]
-            return blocks
-        elif newblock.end < spblock.end:
-            leftblock=BLOCK(spblock.start,newblock.end,spblock.content,spblock.aallele,spblock.ballele)
-            rightblock=BLOCK(newblock.end+1,spblock.end,spblock.content,spblock.aallele,spblock.ballele)
-            blocks[blocks.index(spblock):blocks.index(spblock)+1]=[leftblock,rightblock]
-            return blocks
-
     def combinecnvs(cnvs):
-        contin=False
-        while contin==False:
-            contin2=False
-            for cnv in cnvs:
-                contin=False
-                if contin2==True:
-                    break
-                for c in cnvs:
-                    if c.splitby(cnv):
-                        cnvs=splitblocks(cnvs,c,cnv)  #split c at cnv start and/or end position
-                        contin2=True   #causes break from first loop
-                        break   #start from beginning of cnvs as cnvs have now changed
-                    else:
-                        contin=True    #break the while loop only if run through all cnvs with no splits
+        #sweep along the chromosome through the starts and ends of all cnvs, finding the cnvs that cover each interval between them.
+        #Returns (start, end, indexes of covering cnvs in the order they were read in) for each covered interval
+        starts={}
+        ends={}
+        for i,c in enumerate(cnvs):
+            if c.end<c.start:   #(empty segments cover no positions)
+                continue
+            starts.setdefault(c.start,[]).append(i)
+            ends.setdefault(c.end+1,[]).append(i)
+        breakpoints=sorted(set(list(starts.keys())+list(ends.keys())))
+        active=set()
         combined=[]
-        recorded={}
-        for c in cnvs:
-            if c.start not in recorded:
-                combined.append(BLOCK(c.start,c.end,sum(s.content for s in cnvs if s.start==c.start),sum(s.aallele for s in cnvs if s.start==c.start),sum(s.ballele for s in cnvs if s.start==c.start)))
-            recorded[c.start]=''
-        combined=sorted(combined,key=getstart)
+        for pos,nextpos in zip(breakpoints,breakpoints[1:]):
+            active.difference_update(ends.get(pos,[]))
+            active.update(starts.get(pos,[]))
+            if active:
+                combined.append((pos,nextpos-1,sorted(active)))
         return combined
 
+    def cnvparts(chro,start,end):  #the parts of a cnv within targets (the whole cnv without targets)
+        return [(start,end)] if targets==None else targets.clip(chro,start,end)
+
+    def mixcopies(covering,values,cloneof):
+        #sums of values (of cnvs or vcf records) x the proportion of their clone in each sample, for each list of indexes in covering.
+        #Returns an array of (len(covering), samples). Values are added in the order of the indexes, a layer at a time, so every
+        #sample's sums are the same as adding them one by one
+        total=numpy.zeros((len(covering),len(samples)))
+        for d in range(max([len(c) for c in covering]+[0])):
+            rows=numpy.array([i for i,c in enumerate(covering) if len(c)>d],dtype=int)
+            indexes=numpy.array([c[d] for c in covering if len(c)>d],dtype=int)
+            total[rows]+=values[indexes][:,None]*proportions[cloneof[indexes]]
+        return total
+
 
-    #Read in clone proportions
-    clones={}
-    with open(args.clonefile,'r') as file:
-        for line in file:
-            c,p=line.strip().split('\t')
-            clones[c]=p
+    #Read in clone proportions of each sample: proportions is an array of (clones, samples)
+    if args.clonefile!=None or proportions!=None:
+        if args.name==None:
+            error('An output name (-n) is needed with -c.')
+        clones={}
+        if proportions!=None:
+            clones=dict(proportions)
+        else:
+            with open(args.clonefile,'r') as file:
+                for line in file:
+                    c,p=line.strip().split('\t')
+                    clones[c]=p
+        clonenames=list(clones.keys())
+        samples=[args.name]
+        rows=[[clones[clo] for clo in clonenames]]
+    else:
+        with open(args.seriesfile,'r') as file:
+            clonenames=file.readline().strip().split('\t')[1:]
+            samples=[]
+            rows=[]
+            for line in file:
+                if line.strip()!='':
+                    row=line.strip().split('\t')
+                    if len(row)!=len(clonenames)+1:
+                        error('Sample '+row[0]+' does not have a proportion for each clone.')
+                    samples.append(row[0])
+                    rows.append(row[1:])
+        if len(set(samples))!=len(samples):
+            error('Sample names in '+args.seriesfile+' are not unique.')
+    proportions=numpy.array([[float(p) for p in row] for row in rows]).T
     #Check proportions add up to 1
-    tot=sum([float(clones[x]) for x in clones])
-    if round(tot,5) != 1:
-        warning('Clone proportions add up to ' + str(tot) + ', not 1.')
+    for sample,row in zip(samples,rows):
+        tot=sum([float(x) for x in row])
+        if round(tot,5) != 1:
+            warning('Clone proportions '+('for '+sample+' ' if args.seriesfile!=None else '')+'add up to ' + str(tot) + ', not 1.')
+    def textrecords(lines):
+        #yield (chromosome, position, ref, alt, total copies, phase) for each line of a clone's vcf
+        for line in lines:
+            var=line.split('\t')
+            fields=var[9].split(':')
+            yield var[0],int(var[1]),var[3],var[4],int(fields[1]),fields[2][0]
+
+    def profilerecords(profile):
+        #yield (chromosome, position, ref, alt, total copies, phase) for each variant of a clone's profile file
+        for chro in profile.chromosomes():
+            for pos,ref,alt,total,haps,copynumber in profile.variants(chro):
+                yield chro,pos,ref,alt,total,haps[0][0][0]
+
+    def readvcf(records,clo,index,chromoorder):
+        #yield (chromosome order, position, clone number, record) for each record of a clone's vcf
+        last=(-1,0)
+        for var in records:
+            if var[0] not in chromoorder:
+                error(var[0]+' in vcf file for '+clo+' but not in copy number files.')
+            key=(chromoorder[var[0]],var[1])
+            if key<last:
+                error('vcf file for '+clo+' is not sorted by position. Sort it, or run heterogenesis_varincorp again.')
+            last=key
+            if targets==None or targets.overlaps(var[0],var[1],var[1]+len(var[2])-1):
+                yield key[0],key[1],index,var
+
+    def findcopynumber(comcnvs,comcopies,chromo,pos,pointer):
+        #copy numbers in each sample of the combined cnv containing pos. pointer is [chromosome, index] of the last cnv found, as variants are looked up in order
+        if pointer[0]!=chromo:
+            pointer[0]=chromo
+            pointer[1]=0
+        cnvs=comcnvs[chromo]
+        while pointer[1]<len(cnvs) and cnvs[pointer[1]][1]<pos:
+            pointer[1]+=1
+        if pointer[1]<len(cnvs) and cnvs[pointer[1]][0]<=pos:
+            return comcopies[chromo][0][pointer[1]]
+        error('No copy number for '+chromo+':'+str(pos)+'.')
+
+    def writevars(files,batch):
+        #batch is a list of combined records: [chromosome, position, ref, alt, phase, copy numbers, clone records of (clone, copies)].
+        #Total copies are worked out for all samples together
+        if batch==[]:
+            return
+        covering=[]
+        records=[]
+        for var in batch:
+            covering.append(list(range(len(records),len(records)+len(var[6]))))
+            records.extend(var[6])
+        totals=mixcopies(covering,numpy.array([r[1] for r in records],dtype=float),numpy.array([r[0] for r in records],dtype=int))
+        copynumbers=numpy.array([b[5] for b in batch])
+        with numpy.errstate(divide='ignore',invalid='ignore'):
+            frequencies=totals/copynumbers
+        for s,file in enumerate(files):
+            for var,tc,cn,af in zip(batch,totals[:,s].tolist(),copynumbers[:,s].tolist(),frequencies[:,s].tolist()):
+                #write: chromosome, position, ., ref base, alternate base, ., ., 1, FORMAT,frequency, total copies, copynumber at position
+                file.writerecord(var[0]+'\t'+str(var[1])+'\t.\t'+str(var[2])+'\t'+str(var[3])+'\t.\t.\tNS=1\tAF:TC:CN:PH\t'+str(round(af,5))+':'+str(round(tc,5))+':'+str(round(cn,5))+':'+str(var[4])+'\n',var[0],int(var[1])-1,int(var[1])-1+len(var[2]))
+
+    def mixfiles(inputs,outputs,compress):
+        #mix the cnv and vcf files of each clone (inputs are their paths without 'cnv.txt'/'.vcf'), writing the files of each sample to outputs.
+        #Profile files from heterogenesis_varincorp -f (or profiles passed in memory) are read instead where they exist
+        clonesprofiles=[profiles[clo] if clo in profiles else (heterogenesis_profile.PROFILE(path + 'profile.bin') if os.path.exists(path + 'profile.bin') else None) for clo,path in zip(clonenames,inputs)]
+        #Get all cnvs from cnv files, with the clone each is from
+        allcnvs={}
+        cnvclones={}
+        for i,clo in enumerate(clonenames):
+            if clonesprofiles[i]!=None:
+                for chro in clonesprofiles[i].chromosomes():
+                    if chro not in allcnvs:
+                        allcnvs[chro]=[]
+                        cnvclones[chro]=[]
+                    for start,end,content,aallele,ballele in clonesprofiles[i].cnvs(chro):
+                        for s,e in cnvparts(chro,start,end):
+                            allcnvs[chro].append(BLOCK(s,e,float(content),float(aallele),float(ballele)))
+                            cnvclones[chro].append(i)
+                continue
+            with openvariantfile(inputs[i] + 'cnv.txt') as file:
+                for line in file:
+                    if not line.startswith('Chromosome'):
+                        cnv=line.strip().split('\t')
+                        if cnv[0] not in allcnvs:
+                            allcnvs[cnv[0]]=[]
+                            cnvclones[cnv[0]]=[]
+                        for s,e in cnvparts(cnv[0],int(cnv[1]),int(cnv[2])):
+                            allcnvs[cnv[0]].append(BLOCK(s,e,float(cnv[3]),float(cnv[4]),float(cnv[5])))
+                            cnvclones[cnv[0]].append(i)
+
+        #combine all cnvs: the intervals of each chromosome, and arrays of (intervals, samples) of copy number, a allele and b allele
+        comcnvs={}
+        comcopies={}
+        for chromo in allcnvs:
+            comcnvs[chromo]=combinecnvs(allcnvs[chromo])
+            covering=[c[2] for c in comcnvs[chromo]]
+            cloneof=numpy.array(cnvclones[chromo],dtype=int)
+            comcopies[chromo]=[mixcopies(covering,numpy.array([getattr(c,v) for c in allcnvs[chromo]]),cloneof) for v in ('content','aallele','ballele')]
+
+        #write files (sorted by position within each chromosome, and with -i bgzip compressed with a tabix index)
+        for s,sample in enumerate(samples):
+            with heterogenesis_bgzf.TABLEWRITER(outputs[s] + 'cnv.txt',compress,skip=1) as file:
+                file.write('Chromosome\tStart\tEnd\tCopy Number\tA Allele\tB Allele\n')
+                for chromo in comcnvs:
+                    content,aallele,ballele=[c[:,s].tolist() for c in comcopies[chromo]]
+                    for j,(start,end,covering) in enumerate(comcnvs[chromo]):
+                        file.writerecord(chromo+'\t'+str(start) +'\t'+str(end)+'\t'+str(content[j])+'\t'+str(aallele[j])+'\t'+str(ballele[j])+'\n',chromo,start-1,end)
+
+        #Merge clone vcf files, which are sorted by position, reading them in step so only the current records are held. Copy numbers are found
+        #(with findcopynumber) and records at the same position combined as the merged records pass, so readvcf stops at any record out of order
+        chromoorder=dict([(chromo,i) for i,chromo in enumerate(comcnvs)])    #chromosomes are in the order of the cnv files (the order of the reference genome)
+        vcffiles=[]
+        streams=[]
+        for i,clo in enumerate(clonenames):
+            if clonesprofiles[i]!=None:
+                reference=clonesprofiles[i].index['reference']
+                streams.append(readvcf(profilerecords(clonesprofiles[i]),clo,i,chromoorder))
+                continue
+            file=openvariantfile(inputs[i] + '.vcf')
+            line=file.readline()
+            while line.startswith('#'):
+                if line.startswith('##reference=file:'):
+                    reference = line[17:].strip('\n')
+                line=file.readline()
+            vcffiles.append(file)
+            streams.append(readvcf(textrecords(chain([line] if line!='' else [],file)),clo,i,chromoorder))
+
+        files=[heterogenesis_bgzf.TABLEWRITER(outputs[s] + '.vcf',compress,format=2,colend=0) for s in range(len(samples))]
+        for sample,file in zip(samples,files):
+            file.write('##fileformat=VCFv4.2'+'\n')
+            file.write('##fileDate='+str(datetime.datetime.today().strftime('%Y%m%d'))+'\n')
+            file.write('##source=heterogenesis_varincorp-'+clo+'\n')
+            file.write('##reference=file:'+reference+'\n')
+            file.write('##INFO=<ID=NS,Number=1,Type=Integer,Description="Number of Samples With Data">\n')
+            file.write('##FORMAT=<ID=AF,Number=A,Type=Float,Description="Alt allele frequency">\n')
+            file.write('##FORMAT=<ID=TC,Number=1,Type=Integer,Description="Total copies of alt allele">\n')
+            file.write('##FORMAT=<ID=CN,Number=2,Type=Integer,Description="Copy number at position">\n')
+            file.write('##FORMAT=<ID=PH,Number=1,Type=Integer,Description="Phase">\n')
+            file.write('#CHROM\tPOS\tID\tREF\tALT\tQUAL\tFILTER\tINFO\tFORMAT\t'+sample+'\n')
+        #records at the same position are combined in clone order, and written in batches
+        pointer=[None,0]
+        batch=[]
+        key=None
+        for order,pos,i,var in merge(*streams):
+            if (order,pos)!=key:
+                if len(batch)>=10000:
+                    writevars(files,batch)
+                    batch=[]
+                key=(order,pos)
+                batch.append([var[0],var[1],var[2],var[3],var[5],findcopynumber(comcnvs,comcopies,var[0],pos,pointer),[]])
+            batch[-1][6].append((i,var[4]))
+        writevars(files,batch)
+        for file in files:
+            file.close()
+        for f in vcffiles:
+            f.close()
+
+    def stitchfiles(shards,output,compress):
+        #join the per chromosome files of a sample (in chromosome order) into one, keeping the header of the first
+        vcf=output.endswith('.vcf')
+        with heterogenesis_bgzf.TABLEWRITER(output,compress,**({'format':2,'colend':0} if vcf else {'skip':1})) as file:
+            for n,shard in enumerate(shards):
+                with open(shard,'r') as infile:
+                    for line in infile:
+                        if line.startswith('#') or line.startswith('Chromosome'):
+                            if n==0:
+                                file.write(line)
+                            continue
+                        record=line.split('\t',5)
+                        if vcf:
+                            file.writerecord(line,record[0],int(record[1])-1,int(record[1])-1+len(record[3]))
+                        else:
+                            file.writerecord(line,record[0],int(record[1])-1,int(record[2]))
+                os.remove(shard)
+
+    def variantfilesexist(path):
+        return path in [args.directory +'/'+ args.prefix + clo for clo in profiles] or os.path.exists(path + 'profile.bin') or os.path.exists(path + 'cnv.txt') or os.path.exists(path + '.vcf') or os.path.exists(path + 'cnv.txt.gz') or os.path.exists(path + '.vcf.gz')
+
+    def chromosomeworker(chro):
+        #mix the per chromosome files (from heterogenesis_varincorp -x) of one chromosome
+        mixfiles([args.directory +'/'+ args.prefix + clo + chro for clo in clonenames],[args.directory +'/'+ args.prefix + sample + chro for sample in samples],args.index and args.keepshards)
+
+    #Find per chromosome files from heterogenesis_varincorp -x, which are used if there are no combined files. The chromosomes are
+    #those in the variants index from heterogenesis_vargen (in the order of the reference genome), and every clone must have files for
+    #each of them, so that a sample is never mixed with chromosomes missing
+    chromosomes=None
+    if not any([variantfilesexist(args.directory +'/'+ args.prefix + clo) for clo in clonenames]) and os.path.exists(args.directory +'/'+ args.prefix + 'variantsindex.json'):
+        with open(args.directory +'/'+ args.prefix + 'variantsindex.json','r') as file:
+            chromosomes=json.load(file)['chromosomes']
+        missing=[clo + chro for chro in chromosomes for clo in clonenames if not variantfilesexist(args.directory +'/'+ args.prefix + clo + chro)]
+        if len(missing)==len(chromosomes)*len(clonenames):   #no per chromosome files at all
+            chromosomes=None
+        elif missing!=[]:
+            error('Variant profiles for '+', '.join(missing)+' do not exist (from heterogenesis_varincorp -x).')
     #check clones exist
-    for clo in clones:
-        if not (os.path.exists(args.directory +'/'+ args.prefix + clo + 'cnv.txt') + os.path.exists(args.directory +'/'+ args.prefix + clo + '.vcf')):
+    for clo in clonenames:
+        if chromosomes==None and not variantfilesexist(args.directory +'/'+ args.prefix + clo):
             error('Variant profiles for '+clo+' do not exist.')
 
-    #Get all cnvs from cnv files
-    allcnvs={}
-    for clo in clones:
-        with open(args.directory +'/'+ args.prefix + clo + 'cnv.txt','r') as file:
-            for line in file:
-                if not line.startswith('Chromosome'):
-                    cnv=line.strip().split('\t')
-                    if cnv[0] not in allcnvs:
-                        allcnvs[cnv[0]]=[]
-                    allcnvs[cnv[0]].append(BLOCK(int(cnv[1]),int(cnv[2]),float(cnv[3])*float(clones[clo]),float(cnv[4])*float(clones[clo]),float(cnv[5])*float(clones[clo])))
-
-    #combine all cnvs
-    comcnvs={}
-    for chromo in allcnvs:
-        comcnvs[chromo]=combinecnvs(allcnvs[chromo])
-
-    #write file
-    with open(args.directory + '/'+ args.prefix + args.name + 'cnv.txt','w') as file:
-        file.write('Chromosome\tStart\tEnd\tCopy Number\tA Allele\tB Allele\n')
-        for chromo in comcnvs:
-            for cnv in comcnvs[chromo]:
-                file.write(chromo+'\t'+str(cnv.start) +'\t'+str(cnv.end)+'\t'+str(cnv.content)+'\t'+str(cnv.aallele)+'\t'+str(cnv.ballele)+'\n')
-
-
-    #Get all vars from vcf files
-    allvars=[]
-    for clo in clones:
-        with open(args.directory +'/'+ args.prefix + clo + '.vcf','r') as file:
-            for line in file:
-                if line.startswith('#'):
-                    if line.startswith('##reference=file:'):
-                        reference = line[17:].strip('\n')
-                    continue
-                var=line.split('\t')
-                allvars.append([var[0],str(var[1]),var[3],var[4],int(var[9].split(':')[1]),int(var[9].split(':')[4]),float(clones[clo]),str(var[9].split(':')[2])])
-
-    #combine all vars
-    comvars={}
-    for var in allvars:
-        if var[0]+':'+var[1] in comvars:
-            comvars[var[0]+':'+var[1]][4]=comvars[var[0]+':'+var[1]][4]+(float(var[4])*float(var[6]))   #add to current value
+    if chromosomes==None:
+        mixfiles([args.directory +'/'+ args.prefix + clo for clo in clonenames],[args.directory +'/'+ args.prefix + sample for sample in samples],args.index)
+    else:
+        #chromosomes never share cnvs or variants, so each is mixed separately, on a pool of forked processes with -w
+        if args.workers>1:
+            workertasks['chromosome']=chromosomeworker
+            with multiprocessing.get_context('fork').Pool(args.workers) as pool:
+                for result in pool.imap_unordered(runworkertask,[('chromosome',(chro,)) for chro in chromosomes]):
+                    if isinstance(result,SystemExit):
+                        exit(result.code)
         else:
-            comvars[var[0]+':'+var[1]]=[var[0],var[1],var[2],var[3],(float(var[4])*float(var[6])),'',var[7][0]]  #multiply number of copies by clone proportion
-    for var in comvars:
-        cn=''
-        for cnv in comcnvs[comvars[var][0]]:
-            if int(comvars[var][1])>=cnv.start and int(comvars[var][1])<=cnv.end:
-                cn=cnv.content
-                break
-        comvars[var][5]=cn  #copy number
-
-    with open(args.directory +'/'+ args.prefix + args.name + '.vcf','w+') as file:
-        file.write('##fileformat=VCFv4.2'+'\n')
-        file.write('##fileDate='+str(datetime.datetime.today().strftime('%Y%m%d'))+'\n')
-        file.write('##source=heterogenesis_varincorp-'+clo+'\n')
-        file.write('##reference=file:'+reference+'\n')
-        file.write('##INFO=<ID=NS,Number=1,Type=Integer,Description="Number of Samples With Data">\n')
-        file.write('##FORMAT=<ID=AF,Number=A,Type=Float,Description="Alt allele frequency">\n')
-        file.write('##FORMAT=<ID=TC,Number=1,Type=Integer,Description="Total copies of alt allele">\n')
-        file.write('##FORMAT=<ID=CN,Number=2,Type=Integer,Description="Copy number at position">\n')
-        file.write('##FORMAT=<ID=PH,Number=1,Type=Integer,Description="Phase">\n')
-        file.write('#CHROM\tPOS\tID\tREF\tALT\tQUAL\tFILTER\tINFO\tFORMAT\t'+args.name+'\n')
-        for v in comvars:
-            #write: chromosome, position, ., ref base, alternate base, ., ., 1, FORMAT,frequency, total copies, copynumber at position
-            file.write(comvars[v][0]+'\t'+str(comvars[v][1])+'\t.\t'+str(comvars[v][2])+'\t'+str(comvars[v][3])+'\t.\t.\tNS=1\tAF:TC:CN:PH\t'+str(round(float(comvars[v][4])/float(comvars[v][5]),5))+':'+str(round(comvars[v][4],5))+':'+str(round(comvars[v][5],5))+':'+str(comvars[v][6])+'\n')
+            for chro in chromosomes:
+                chromosomeworker(chro)
+        if not args.keepshards:
+            for sample in samples:
+                for o in ('cnv.txt','.vcf'):
+                    stitchfiles([args.directory +'/'+ args.prefix + sample + chro + o for chro in chromosomes],args.directory +'/'+ args.prefix + sample + o,args.index)
 
 # If run as main, run main():
 if __name__ == '__main__': main()
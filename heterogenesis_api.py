@@ -0,0 +1,65 @@
+#! /usr/bin/env python3
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+import heterogenesis_query
+import heterogenesis_vargen
+import heterogenesis_varincorp
+import freqcalc
+
+#Functions for running heterogenesis within a python process (eg. from a notebook, or a script running many simulations). The reference
+#genome is read once and shared by every step, and variants and clone profiles are passed between steps in memory rather than through
+#variants.json and the copy number and vcf files. Parameters are a dictionary with the same contents as the json parameters file.
+
+class REFERENCE(object):
+    #reference genome sequences, read using the fai index. Sequences are kept as bytes (as used by heterogenesis_varincorp), and decoded
+    #to text for heterogenesis_vargen the first time they are needed
+    def __init__(self,referencefile,chromosomes=None):
+        self.filename=referencefile
+        self.fai=heterogenesis_query.readfai(referencefile+'.fai')
+        self.sequences={}
+        self.texts={}
+        with open(referencefile,'rb') as ref:
+            for chro in self.fai:
+                if chromosomes==None or chro in chromosomes:
+                    length,offset,linebases,linewidth=self.fai[chro]
+                    ref.seek(offset)
+                    self.sequences[chro]=ref.read((length//linebases)*linewidth+length%linebases).replace(b'\n',b'').replace(b'\r',b'')
+    def __getitem__(self,chro):
+        return self.sequences[chro]
+    def __contains__(self,chro):
+        return chro in self.sequences
+    def text(self,chro):
+        if chro not in self.texts:
+            self.texts[chro]=self.sequences[chro].decode()
+        return self.texts[chro]
+    def wait(self):    #(sequences are all read in when the reference is created)
+        pass
+
+def generatevariants(parameters,reference=None,write=False):
+    #variants of each clone from heterogenesis_vargen, as in variants.json. Output files are only written with write
+    variants={}
+    heterogenesis_vargen.main([],parameters=parameters,reference=reference,results=variants,write=write)
+    return variants
+
+def incorporate(parameters,variants,clone,reference=None,options=['-n']):
+    #profile of a clone from heterogenesis_varincorp, with its copy numbers and variants. options are heterogenesis_varincorp command line
+    #options, by default -n so that no fasta files are written
+    results={}
+    heterogenesis_varincorp.main(['-c',clone]+options,parameters=parameters,variants=variants,reference=reference,results=results)
+    return results[clone]
+
+def mix(genomes,proportions,directory,prefix,name,options=[]):
+    #run freqcalc on profiles from incorporate (a dictionary of clone : profile) mixed in proportions (a dictionary of clone : fraction),
+    #writing {prefix}{name}cnv.txt and {prefix}{name}.vcf to directory. options are freqcalc command line options, eg. ['-i']
+    freqcalc.main(['-d',directory,'-p',prefix,'-n',name]+options,proportions=proportions,profiles=genomes)
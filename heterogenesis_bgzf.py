@@ -0,0 +1,171 @@
+#! /usr/bin/env python3
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+import zlib
+import struct
+from bisect import bisect_right
+from concurrent.futures import ThreadPoolExecutor
+
+#Block gzip (bgzf) files, as written by bgzip, are a series of gzip members of up to 64kb, so they can be read by any gzip reader but
+#also accessed at any block. Blocks are compressed on a thread pool (zlib releases the GIL while compressing) and written in order.
+BLOCKSIZE=65280
+EOF=b'\x1f\x8b\x08\x04\x00\x00\x00\x00\x00\xff\x06\x00BC\x02\x00\x1b\x00\x03\x00\x00\x00\x00\x00\x00\x00\x00\x00'
+
+def compressblock(data,level=6):
+    compressor=zlib.compressobj(level,zlib.DEFLATED,-15)
+    cdata=compressor.compress(data)+compressor.flush()
+    header=struct.pack('<BBBBIBBHBBHH',31,139,8,4,0,0,255,6,66,67,2,len(cdata)+25)  #gzip header with extra BC field holding block size - 1
+    return header+cdata+struct.pack('<II',zlib.crc32(data),len(data))
+
+class BGZFWRITER(object):
+    #file object for writing bgzf files. If gzi is True, a .gzi index of block positions is written on closing, as by bgzip -i
+    def __init__(self,filename,threads=1,level=6,gzi=False):
+        self.filename=filename
+        self.file=open(filename,'wb')
+        self.level=level
+        self.gzi=gzi
+        self.threads=threads
+        self.pool=ThreadPoolExecutor(threads) if threads>1 else None
+        self.buffer=bytearray()
+        self.offset=0   #uncompressed bytes passed to write
+        self.coffset=0  #compressed bytes written to file
+        self.blocks=[]  #(compressed offset, uncompressed offset) of each block after the first
+        self.written=0  #uncompressed bytes written to file
+        self.ustarts=[0]    #uncompressed and compressed start of each block, for virtual offsets
+        self.cstarts=[0]
+    def write(self,data):
+        self.buffer+=data
+        self.offset+=len(data)
+        if len(self.buffer)>=BLOCKSIZE*max(self.threads*4,1):
+            self.flush(False)
+    def tell(self):
+        return self.offset
+    def virtualoffset(self,offset):    #bgzf virtual offset (compressed block position << 16 | position in block) of an uncompressed offset, once it has been flushed
+        if len(self.ustarts)!=len(self.blocks)+1:
+            self.ustarts=[0]+[u for c,u in self.blocks]
+            self.cstarts=[0]+[c for c,u in self.blocks]
+        i=bisect_right(self.ustarts,offset)-1
+        return (self.cstarts[i]<<16)|(offset-self.ustarts[i])
+    def flush(self,final=True):
+        end=len(self.buffer) if final else len(self.buffer)-len(self.buffer)%BLOCKSIZE
+        chunks=[bytes(self.buffer[i:min(i+BLOCKSIZE,end)]) for i in range(0,end,BLOCKSIZE)]
+        del self.buffer[:end]
+        if self.pool!=None:
+            blocks=self.pool.map(compressblock,chunks,[self.level]*len(chunks))
+        else:
+            blocks=[compressblock(c,self.level) for c in chunks]
+        for chunk,block in zip(chunks,blocks):
+            if self.coffset!=0:
+                self.blocks.append((self.coffset,self.written))
+            self.file.write(block)
+            self.coffset+=len(block)
+            self.written+=len(chunk)
+    def close(self):
+        self.flush()
+        self.file.write(EOF)
+        self.file.close()
+        if self.pool!=None:
+            self.pool.shutdown()
+        if self.gzi:
+            with open(self.filename+'.gzi','wb') as file:
+                file.write(struct.pack('<Q',len(self.blocks)))
+                for c,u in self.blocks:
+                    file.write(struct.pack('<QQ',c,u))
+    def __enter__(self):
+        return self
+    def __exit__(self,*args):
+        self.close()
+
+#Tabix indexes (.tbi) hold, for each sequence, a binning index of chunks of the file that contain records in each bin, and a linear index of
+#the first record overlapping each 16kb window, as described in the tabix/SAM specifications. Records must be sorted and grouped by sequence.
+def reg2bin(beg,end):   #smallest bin containing 0 based region beg to end (not included)
+    end-=1
+    if beg>>14==end>>14: return ((1<<15)-1)//7+(beg>>14)
+    if beg>>17==end>>17: return ((1<<12)-1)//7+(beg>>17)
+    if beg>>20==end>>20: return ((1<<9)-1)//7+(beg>>20)
+    if beg>>23==end>>23: return ((1<<6)-1)//7+(beg>>23)
+    if beg>>26==end>>26: return ((1<<3)-1)//7+(beg>>26)
+    return 0
+
+class TABIXINDEX(object):
+    #index built as records are written. Positions of records are uncompressed offsets, which are converted to virtual offsets when written.
+    #format is 0 for generic tables or 2 for vcf, and columns are 1 based
+    def __init__(self,format=0,colseq=1,colbeg=2,colend=3,meta='#',skip=0):
+        self.header=(format,colseq,colbeg,colend,ord(meta),skip)
+        self.names=[]
+        self.bins=[]
+        self.linear=[]
+    def add(self,chro,beg,end,start,stop):  #record covering 0 based beg to end (not included), from uncompressed offset start to stop
+        if self.names==[] or self.names[-1]!=chro:
+            if chro in self.names:
+                raise ValueError('Records for '+chro+' are not together, so cannot be indexed.')
+            self.names.append(chro)
+            self.bins.append({})
+            self.linear.append([])
+        chunks=self.bins[-1].setdefault(reg2bin(beg,max(end,beg+1)),[])
+        if chunks!=[] and chunks[-1][1]==start:    #merge with the last chunk of the bin if it ends where this record starts
+            chunks[-1][1]=stop
+        else:
+            chunks.append([start,stop])
+        linear=self.linear[-1]
+        for w in range(beg>>14,((max(end,beg+1)-1)>>14)+1):
+            if w>=len(linear):
+                linear.extend([None]*(w+1-len(linear)))
+            if linear[w]==None:
+                linear[w]=start
+    def write(self,filename,writer):   #writer is the closed BGZFWRITER the records were written to
+        names=b''.join([n.encode()+b'\0' for n in self.names])
+        data=bytearray(b'TBI\x01'+struct.pack('<7i',len(self.names),*self.header)+struct.pack('<i',len(names))+names)
+        for bins,linear in zip(self.bins,self.linear):
+            data+=struct.pack('<i',len(bins))
+            for b in sorted(bins):
+                data+=struct.pack('<Ii',b,len(bins[b]))
+                for start,stop in bins[b]:
+                    data+=struct.pack('<QQ',writer.virtualoffset(start),writer.virtualoffset(stop))
+            first=next((o for o in linear if o!=None),0)    #windows without records take the offset of the record before them (or the first record)
+            offsets=[]
+            for o in linear:
+                offsets.append(writer.virtualoffset(o) if o!=None else (offsets[-1] if offsets!=[] else writer.virtualoffset(first)))
+            data+=struct.pack('<i',len(offsets))+struct.pack('<'+str(len(offsets))+'Q',*offsets)
+        with BGZFWRITER(filename) as file:
+            file.write(bytes(data))
+
+class TABLEWRITER(object):
+    #text table of records sorted by position, written either uncompressed, or bgzip compressed (to filename+'.gz') with a tabix index
+    def __init__(self,filename,compress=False,threads=1,**tabix):
+        self.compress=compress
+        if compress:
+            self.filename=filename+'.gz'
+            self.file=BGZFWRITER(self.filename,threads)
+            self.index=TABIXINDEX(**tabix)
+        else:
+            self.filename=filename
+            self.file=open(filename,'w')
+    def write(self,text):  #lines that aren't indexed, eg. headers
+        self.file.write(text.encode() if self.compress else text)
+    def writerecord(self,text,chro,beg,end):    #line of a record covering 0 based beg to end (not included)
+        if self.compress:
+            start=self.file.tell()
+            self.file.write(text.encode())
+            self.index.add(chro,beg,end,start,self.file.tell())
+        else:
+            self.file.write(text)
+    def close(self):
+        self.file.close()
+        if self.compress:
+            self.index.write(self.filename+'.tbi',self.file)
+    def __enter__(self):
+        return self
+    def __exit__(self,*args):
+        self.close()
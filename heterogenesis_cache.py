@@ -0,0 +1,125 @@
+#! /usr/bin/env python3
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+import os.path
+import json
+import pickle
+import hashlib
+import threading
+
+version = {}
+with open(os.path.join(os.path.abspath(os.path.dirname(__file__)), 'version.py')) as f: exec(f.read(), version)
+
+#Cache shared between runs for germline variants (from heterogenesis_vargen) and germline haplotypes with those variants incorporated
+#(from heterogenesis_varincorp). Entries are named by a key made from the heterogenesis version, the reference genome's fai index and
+#the checksums of the sequences of its chromosomes, and the germline variants and haplotypes, so a germline is only reused with the
+#reference and version it was made with. The same key is used to check that outputs recorded in a run's manifest were made from the same inputs.
+
+def sequencechecksums(reference):
+    #returns dictionary of chromosome : sha256 checksum of its sequence (without line ends). The checksums are computed once and
+    #kept in {reference}.checksums with the reference's size and modification time, and computed again if the reference changes (they
+    #are only kept in memory if the reference's directory can't be written to)
+    filename=reference+'.checksums'
+    stat=os.stat(reference)
+    if os.path.exists(filename):
+        try:
+            with open(filename,'r') as file:
+                saved=json.load(file)
+            if saved['size']==stat.st_size and saved['mtime']==stat.st_mtime_ns:
+                return saved['checksums']
+        except (ValueError,KeyError):
+            pass
+    checksums={}
+    checksum=None
+    with open(reference,'rb') as file:
+        for line in file:
+            if line.startswith(b'>'):
+                checksum=hashlib.sha256()
+                checksums[line[1:].split()[0].decode()]=checksum
+            elif checksum!=None:
+                checksum.update(line.rstrip(b'\r\n'))
+    checksums=dict([(chro,checksums[chro].hexdigest()) for chro in checksums])
+    temp=filename+'.'+str(os.getpid())+'.tmp'   #(written to a temporary file first, as runs sharing a reference may compute them at once)
+    try:
+        with open(temp,'w') as file:
+            json.dump({'size':stat.st_size,'mtime':stat.st_mtime_ns,'checksums':checksums},file,indent=1)
+        os.replace(temp,filename)
+    except OSError:
+        pass
+    return checksums
+
+def variantskey(reference,clonevariants):    #clonevariants is a clone's entry of the variants file: [variants, haplotypes, ...]
+    key=hashlib.sha256()
+    key.update(version['__version__'].encode())
+    with open(reference+'.fai','rb') as file:
+        key.update(file.read())
+    checksums=sequencechecksums(reference)
+    key.update(json.dumps([checksums.get(chro) for chro in sorted(clonevariants[1])]).encode())   #(the sequences of the chromosomes simulated)
+    key.update(json.dumps([clonevariants[0],clonevariants[1]],sort_keys=True).encode())
+    return key.hexdigest()
+
+def readcache(directory,name):  #returns None if the entry isn't in the cache
+    if not os.path.exists(os.path.join(directory,name)):
+        return None
+    with open(os.path.join(directory,name),'rb') as file:
+        return pickle.load(file)
+
+def writecache(directory,name,data):
+    if not os.path.exists(directory):
+        os.makedirs(directory)
+    temp=os.path.join(directory,name+'.'+str(os.getpid())+'.tmp')    #written to a temporary file first, so that runs sharing the cache never see part of an entry
+    with open(temp,'wb') as file:
+        pickle.dump(data,file,protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(temp,os.path.join(directory,name))
+
+def filechecksum(filename):
+    checksum=hashlib.sha256()
+    with open(filename,'rb') as file:
+        for chunk in iter(lambda: file.read(1048576),b''):
+            checksum.update(chunk)
+    return checksum.hexdigest()
+
+class MANIFEST(object):
+    #record of the output files of a run that are complete, with their sizes, modification times and checksums, so that an interrupted run
+    #can be resumed. Outputs are only taken from an existing manifest if it has the same fingerprint (of the run's inputs and options) and
+    #the files have the same size and modification time, or with verify the same checksum. File names are relative to directory
+    def __init__(self,directory,name,fingerprint,verify=False):
+        self.directory=directory
+        self.filename=os.path.join(directory,name)
+        self.fingerprint=fingerprint
+        self.outputs={}
+        self.lock=threading.Lock()  #outputs can be added from a writer thread
+        if os.path.exists(self.filename):
+            with open(self.filename,'r') as file:
+                manifest=json.load(file)
+            if manifest['fingerprint']==fingerprint:
+                for output,entry in manifest['outputs'].items():
+                    path=os.path.join(directory,output)
+                    if len(entry)==3 and os.path.exists(path) and os.path.getsize(path)==entry[0] and (filechecksum(path)==entry[2] if verify else os.stat(path).st_mtime_ns==entry[1]):
+                        self.outputs[output]=[entry[0],os.stat(path).st_mtime_ns,entry[2]]
+        self.write()
+    def complete(self,output):
+        return output in self.outputs
+    def add(self,output,size,checksum):    #(once the file is closed)
+        with self.lock:
+            self.outputs[output]=[size,os.stat(os.path.join(self.directory,output)).st_mtime_ns,checksum]
+            self.write()
+    def addfile(self,output):
+        path=os.path.join(self.directory,output)
+        self.add(output,os.path.getsize(path),filechecksum(path))
+    def write(self):
+        temp=self.filename+'.'+str(os.getpid())+'.tmp'
+        with open(temp,'w') as file:
+            json.dump({'fingerprint':self.fingerprint,'outputs':self.outputs},file,indent=1)
+        os.replace(temp,self.filename)
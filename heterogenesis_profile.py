@@ -0,0 +1,128 @@
+#! /usr/bin/env python3
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+import os.path
+import json
+import struct
+from array import array
+from sys import byteorder
+import numpy
+
+#Profile files are written by heterogenesis_varincorp with -f, and hold the same copy numbers and variants as its cnv.txt and .vcf files
+#as typed arrays, so that freqcalc can memory map them rather than parsing text. For each chromosome they hold arrays of the cnv
+#segments (1 based start and end, copy number, A allele and B allele copies), arrays of the variants (position, end of the reference and
+#alternate alleles in the allele sequences, total copies, copy number at the position, and end of the variant's haplotypes in the
+#haplotype arrays), arrays of each variant's haplotypes (number in the index's list of haplotype names and copies on the haplotype), and
+#the reference and alternate allele sequences. A json index is written at the end of the file, and the last 8 bytes give its position.
+MAGIC=b'HGPROF01'
+CNVFIELDS=[('start','q'),('end','q'),('content','q'),('aallele','q'),('ballele','q')]
+VARFIELDS=[('pos','q'),('refend','q'),('altend','q'),('total','q'),('copynumber','q'),('hapend','q')]
+HAPFIELDS=[('haplotype','i'),('count','q')]
+
+def writeprofile(filename,reference,clone,chromosomes):
+    #chromosomes is a dictionary of chromosome : [iterable of cnvs (start, end, copy number, A allele, B allele),
+    #iterable of variants (position, ref, alt, total copies, [[haplotype, copies], ...], copy number)], each sorted by position
+    index={'clone':clone,'reference':reference,'byteorder':byteorder,'haplotypes':[],'chromosomes':{}}
+    haplotypes={}
+    with open(filename,'wb') as file:
+        file.write(MAGIC)
+        for chro in chromosomes:
+            cnvs,variants=chromosomes[chro]
+            arrays=dict([(f,array(t)) for f,t in CNVFIELDS+VARFIELDS+HAPFIELDS])
+            for cnv in cnvs:
+                for (f,t),value in zip(CNVFIELDS,cnv):
+                    arrays[f].append(value)
+            ref=bytearray()
+            alt=bytearray()
+            for pos,r,a,total,haps,copynumber in variants:
+                ref+=r.encode()
+                alt+=a.encode()
+                for hap,count in haps:
+                    if hap not in haplotypes:
+                        haplotypes[hap]=len(index['haplotypes'])
+                        index['haplotypes'].append(hap)
+                    arrays['haplotype'].append(haplotypes[hap])
+                    arrays['count'].append(count)
+                for f,value in zip(['pos','refend','altend','total','copynumber','hapend'],[pos,len(ref),len(alt),total,copynumber,len(arrays['haplotype'])]):
+                    arrays[f].append(value)
+            index['chromosomes'][chro]={'offset':file.tell(),'cnvs':len(arrays['start']),'variants':len(arrays['pos']),'haplotypes':len(arrays['haplotype']),'reflength':len(ref),'altlength':len(alt)}
+            for f,t in CNVFIELDS+VARFIELDS+HAPFIELDS:
+                arrays[f].tofile(file)
+            file.write(ref)
+            file.write(alt)
+        indexoffset=file.tell()
+        file.write(json.dumps(index).encode())
+        file.write(struct.pack('<q',indexoffset))
+
+class PROFILE(object):
+    #profile file, with each chromosome's arrays memory mapped as numpy arrays when they are first used
+    def __init__(self,filename):
+        self.filename=filename
+        with open(filename,'rb') as file:
+            if file.read(len(MAGIC))!=MAGIC:
+                raise ValueError(filename+' is not a profile file.')
+            file.seek(-8,2)
+            end=file.tell()
+            indexoffset=struct.unpack('<q',file.read(8))[0]
+            file.seek(indexoffset)
+            self.index=json.loads(file.read(end-indexoffset).decode())
+        self.order='<' if self.index['byteorder']=='little' else '>'
+        self.arrays={}
+    def chromosomes(self):
+        return list(self.index['chromosomes'].keys())
+    def getarrays(self,chro):   #dictionary of field : array for the chromosome, with the allele sequences as 'ref' and 'alt'
+        if chro not in self.arrays:
+            info=self.index['chromosomes'][chro]
+            pos=info['offset']
+            arrays={}
+            for fields,count in ((CNVFIELDS,info['cnvs']),(VARFIELDS,info['variants']),(HAPFIELDS,info['haplotypes'])):
+                for f,t in fields:
+                    dtype=numpy.dtype(self.order+t)
+                    arrays[f]=numpy.memmap(self.filename,dtype=dtype,mode='r',offset=pos,shape=(count,)) if count>0 else numpy.zeros(0,dtype=dtype)
+                    pos+=dtype.itemsize*count
+            for a in ('ref','alt'):
+                with open(self.filename,'rb') as file:
+                    file.seek(pos)
+                    arrays[a]=file.read(info[a+'length']).decode()
+                pos+=info[a+'length']
+            self.arrays[chro]=arrays
+        return self.arrays[chro]
+    def cnvs(self,chro):
+        #list of (start, end, copy number, A allele, B allele) for each cnv, as in the copy number file
+        arrays=self.getarrays(chro)
+        return list(zip(*[arrays[f].tolist() for f,t in CNVFIELDS]))
+    def variants(self,chro):
+        #yield (position, ref, alt, total copies, [[haplotype, copies], ...], copy number) for each variant, as in the vcf file
+        arrays=self.getarrays(chro)
+        pos,refend,altend,total,copynumber,hapend,haplotype,count=[arrays[f].tolist() for f in ('pos','refend','altend','total','copynumber','hapend','haplotype','count')]
+        for i in range(len(pos)):
+            refstart=refend[i-1] if i>0 else 0
+            altstart=altend[i-1] if i>0 else 0
+            hapstart=hapend[i-1] if i>0 else 0
+            haps=[[self.index['haplotypes'][haplotype[h]],count[h]] for h in range(hapstart,hapend[i])]
+            yield pos[i],arrays['ref'][refstart:refend[i]],arrays['alt'][altstart:altend[i]],total[i],haps,copynumber[i]
+
+class MEMORYPROFILE(object):
+    #the same copy numbers and variants held in memory rather than in a file, as passed from heterogenesis_varincorp to freqcalc by heterogenesis_api.
+    #chromosomes is as for writeprofile
+    def __init__(self,clone,reference,chromosomes):
+        self.index={'clone':clone,'reference':reference}
+        self.data=chromosomes
+    def chromosomes(self):
+        return list(self.data.keys())
+    def cnvs(self,chro):
+        return list(self.data[chro][0])
+    def variants(self,chro):
+        for variant in self.data[chro][1]:
+            yield variant
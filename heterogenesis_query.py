@@ -0,0 +1,209 @@
+#! /usr/bin/env python3
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+import argparse
+from signal import signal, SIGPIPE, SIG_DFL
+import os.path
+import json
+import mmap
+import struct
+from array import array
+from bisect import bisect_right
+from sys import stderr, stdout, exit, byteorder
+
+signal(SIGPIPE, SIG_DFL) # Handle broken pipes
+
+
+version = {}
+with open(os.path.join(os.path.abspath(os.path.dirname(__file__)), 'version.py')) as f: exec(f.read(), version)
+
+#Block map files are written by heterogenesis_varincorp with -b. For each haplotype they hold the segments of its sequence in output order,
+#as arrays of output start (0 based), length, reference start and end (1 based), offset into the alternate sequence (-1 for reference
+#sequence) and strand (1 if reverse complemented), followed by the alternate allele sequences. A json index of the haplotypes is written
+#at the end of the file, and the last 8 bytes give the position of the index.
+MAGIC=b'HGBLOCK1'
+FIELDS=[('outstart','q'),('length','q'),('refstart','q'),('refend','q'),('altoffset','q'),('strand','b')]
+
+complement=bytes.maketrans(b'ATCGatcgNnRYryKMkmBVbvDHdhSsWw',b'TAGCtagcNnYRyrMKmkVBvbHDhdSsWw')  #translation table for reverse complementing sequence
+
+def writeblockmap(filename,reference,haplotypes):
+    #haplotypes is a dictionary of haplotype name : [chromosome, iterable of (reference start, reference end, alternate sequence or None, inverted)]
+    index={'reference':os.path.abspath(reference),'byteorder':byteorder,'haplotypes':{}}
+    with open(filename,'wb') as file:
+        file.write(MAGIC)
+        for name in haplotypes:
+            chro,segments=haplotypes[name]
+            arrays=dict([(f,array(t)) for f,t in FIELDS])
+            alt=bytearray()
+            length=0
+            for refstart,refend,content,inverted in segments:
+                if content is None:
+                    seglength=refend-refstart+1
+                    arrays['altoffset'].append(-1)
+                else:
+                    seglength=len(content)
+                    arrays['altoffset'].append(len(alt))
+                    alt+=content
+                arrays['outstart'].append(length)
+                arrays['length'].append(seglength)
+                arrays['refstart'].append(refstart)
+                arrays['refend'].append(refend)
+                arrays['strand'].append(1 if inverted else 0)
+                length+=seglength
+            index['haplotypes'][name]={'chromosome':chro,'offset':file.tell(),'count':len(arrays['outstart']),'length':length,'altlength':len(alt)}
+            for f,t in FIELDS:
+                arrays[f].tofile(file)
+            file.write(alt)
+        indexoffset=file.tell()
+        file.write(json.dumps(index).encode())
+        file.write(struct.pack('<q',indexoffset))
+
+AUTOSOMES=['chr'+str(i) for i in range(1,23)]
+
+def chromosomelist(chromosomes):    #chromosomes to simulate from the chromosomes parameter (as a list), where 'all' means chr1 to chr22
+    return AUTOSOMES if chromosomes==['all'] else chromosomes
+
+def readfai(fai):   #reads fai file into dictionary of chromosome : [length, offset, bases per line, bytes per line]
+    with open(fai,'r') as file:
+        return dict([(line.split('\t')[0],[int(x) for x in line.split('\t')[1:5]]) for line in file if line.strip()!=''])
+
+class REFERENCE(object):
+    #memory mapped fasta file, read using the positions in its fai index
+    def __init__(self,referencefile):
+        self.fai=readfai(referencefile+'.fai')
+        self.file=open(referencefile,'rb')
+        self.map=mmap.mmap(self.file.fileno(),0,access=mmap.ACCESS_READ)
+    def fetch(self,chro,start,end):  #0 based, end not included
+        length,offset,linebases,linewidth=self.fai[chro]
+        start=max(0,min(start,length))
+        end=max(start,min(end,length))
+        first=offset+(start//linebases)*linewidth+start%linebases
+        last=offset+(end//linebases)*linewidth+end%linebases
+        return self.map[first:last].replace(b'\n',b'').replace(b'\r',b'')
+    def close(self):
+        self.map.close()
+        self.file.close()
+
+class BLOCKMAP(object):
+    #block map file, with each haplotype's segments read in when it is first used
+    def __init__(self,filename,referencefile=None):
+        self.file=open(filename,'rb')
+        self.map=mmap.mmap(self.file.fileno(),0,access=mmap.ACCESS_READ)
+        if self.map[:len(MAGIC)]!=MAGIC:
+            raise ValueError(filename+' is not a block map file.')
+        indexoffset=struct.unpack('<q',self.map[-8:])[0]
+        self.index=json.loads(self.map[indexoffset:-8].decode())
+        if referencefile is None:
+            referencefile=self.index['reference']
+        self.reference=REFERENCE(referencefile)
+        self.segments={}
+    def haplotypes(self):
+        return list(self.index['haplotypes'].keys())
+    def length(self,name):
+        return self.index['haplotypes'][name]['length']
+    def getsegments(self,name):
+        if name not in self.segments:
+            info=self.index['haplotypes'][name]
+            pos=info['offset']
+            arrays={}
+            for f,t in FIELDS:
+                arrays[f]=array(t)
+                size=arrays[f].itemsize*info['count']
+                arrays[f].frombytes(self.map[pos:pos+size])
+                if self.index['byteorder']!=byteorder:
+                    arrays[f].byteswap()
+                pos+=size
+            arrays['alt']=self.map[pos:pos+info['altlength']]
+            self.segments[name]=arrays
+        return self.segments[name]
+    def getsequence(self,name,start,end):    #sequence of haplotype between output positions start and end (1 based, inclusive)
+        chro=self.index['haplotypes'][name]['chromosome']
+        seg=self.getsegments(name)
+        start=max(start-1,0)
+        end=min(end,self.length(name))
+        sequence=bytearray()
+        i=max(bisect_right(seg['outstart'],start)-1,0)
+        while i<len(seg['outstart']) and seg['outstart'][i]<end:
+            length=seg['length'][i]
+            lo=max(start-seg['outstart'][i],0)   #part of the segment that is needed
+            hi=min(end-seg['outstart'][i],length)
+            if seg['strand'][i]==1:    #take the mirrored part of the segment, then reverse complement it
+                lo,hi=length-hi,length-lo
+            if seg['altoffset'][i]==-1:
+                piece=self.reference.fetch(chro,seg['refstart'][i]-1+lo,seg['refstart'][i]-1+hi)
+            else:
+                piece=seg['alt'][seg['altoffset'][i]+lo:seg['altoffset'][i]+hi]
+            if seg['strand'][i]==1:
+                piece=piece.translate(complement)[::-1]
+            sequence+=piece
+            i+=1
+        return bytes(sequence)
+    def findposition(self,name,position):    #segments of haplotype that cover a reference position (1 based), with the output position of the base
+        seg=self.getsegments(name)
+        found=[]
+        for i in range(len(seg['outstart'])):
+            if seg['refstart'][i]<=position<=seg['refend'][i]:
+                if seg['altoffset'][i]!=-1:
+                    outpos=seg['outstart'][i]+1  #alternate sequence replaces the reference base, so give the start of the segment
+                elif seg['strand'][i]==1:
+                    outpos=seg['outstart'][i]+seg['length'][i]-(position-seg['refstart'][i])
+                else:
+                    outpos=seg['outstart'][i]+(position-seg['refstart'][i])+1
+                found.append([seg['outstart'][i]+1,seg['outstart'][i]+seg['length'][i],seg['refstart'][i],seg['refend'][i],'-' if seg['strand'][i]==1 else '+','ref' if seg['altoffset'][i]==-1 else 'alt',outpos])
+        return found
+    def close(self):
+        self.segments={}
+        self.map.close()
+        self.file.close()
+        self.reference.close()
+
+def main():
+    parser = argparse.ArgumentParser(description="Get sequence or positions from simulated haplotypes using a block map file from heterogenesis_varincorp.")
+    parser.add_argument('-v', '--version', action='version', version='%(prog)s {0}'.format(version['__version__']))
+    parser.add_argument('-b', '--blocks', dest='blocksfile', required=True, type=str, help='Block map file written by heterogenesis_varincorp with -b.')
+    parser.add_argument('-f', '--reference', dest='reference', type=str, help='Reference genome fasta file, if not at the location used by heterogenesis_varincorp.')
+    parser.add_argument('-g', '--haplotype', dest='haplotype', type=str, help="Haplotype to query, in format: 'clone_chromosome_haplotype'. If not given, haplotypes and their lengths are listed.")
+    parser.add_argument('-r', '--region', dest='region', type=str, help="Region of the haplotype to output as fasta, in format: 'start-end' (1 based, inclusive).")
+    parser.add_argument('-p', '--position', dest='position', type=int, help='Reference position to find in the haplotype.')
+
+    args = parser.parse_args()
+
+    def error(msg, exit_code=1):
+        print('ERROR: {}'.format(msg), file=stderr)
+        exit(exit_code)
+
+    if not os.path.exists(args.blocksfile):
+        error('Block map file not found.')
+    blockmap=BLOCKMAP(args.blocksfile,args.reference)
+    if args.haplotype==None:
+        for name in blockmap.haplotypes():
+            print(name+'\t'+str(blockmap.length(name)))
+    elif args.haplotype not in blockmap.index['haplotypes']:
+        error(args.haplotype+' not in block map file.')
+    elif args.region!=None:
+        start,end=[int(x) for x in args.region.split('-')]
+        sequence=blockmap.getsequence(args.haplotype,start,end)
+        stdout.write('>'+args.haplotype+':'+str(start)+'-'+str(end)+'\n')
+        for i in range(0,len(sequence),80):
+            stdout.write(sequence[i:i+80].decode()+'\n')
+    elif args.position!=None:
+        print('Haplotype\tStart\tEnd\tReference Start\tReference End\tStrand\tSequence\tPosition')
+        for f in blockmap.findposition(args.haplotype,args.position):
+            print(args.haplotype+'\t'+'\t'.join([str(x) for x in f]))
+    else:
+        error('Either a region (-r) or a position (-p) is needed with a haplotype.')
+    blockmap.close()
+
+# If run as main, run main():
+if __name__ == '__main__': main()
@@ -0,0 +1,389 @@
+#! /usr/bin/env python3
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+import argparse
+from signal import signal, SIGPIPE, SIG_DFL
+import os.path
+import json
+import datetime
+import time
+import math
+import shlex
+import subprocess
+from sys import stderr, exit, executable
+import heterogenesis_query
+import heterogenesis_targets
+import heterogenesis_structure
+
+signal(SIGPIPE, SIG_DFL) # Handle broken pipes
+
+
+version = {}
+with open(os.path.join(os.path.abspath(os.path.dirname(__file__)), 'version.py')) as f: exec(f.read(), version)
+
+def main():
+    parser = argparse.ArgumentParser(description="Run heterogenesis_vargen, heterogenesis_varincorp for each clone and chromosome, and freqcalc, skipping steps that are up to date.")
+    parser.add_argument('-v', '--version', action='version', version='%(prog)s {0}'.format(version['__version__']))
+    parser.add_argument('-j', '--json', dest='jsonfile', required=True, type=str, help='Json file with parameters')
+    parser.add_argument('-c', '--clones', dest='clonefile', required=True, type=str, help="File with clone proportions in format: 'clone name' \t 'fraction'.")
+    parser.add_argument('-n', '--name', dest='name', required=True, type=str, help='Output name of tumour sample.')
+    parser.add_argument('-w', '--workers', dest='workers', type=int, default=os.cpu_count(), help='Number of cores to use (default: all)')
+    parser.add_argument('-M', '--memory', dest='memory', type=float, help='Memory to use in GB (default: all physical memory)')
+    parser.add_argument('-a', '--varincorpargs', dest='varincorpargs', type=str, default='', help="Extra options for heterogenesis_varincorp, eg. '-n -b'")
+    parser.add_argument('-f', '--force', dest='force', action='store_true', help='Run every step, even if its outputs are up to date')
+    parser.add_argument('-P', '--plan', dest='plan', action='store_true', help='Only estimate the run time and memory of each step, and recommend how to split or group steps into jobs')
+    parser.add_argument('-m', '--metrics', dest='metrics', type=str, help='File to append the measured run time and peak memory of each step to (also passed to heterogenesis_varincorp), and to calibrate estimates from')
+    parser.add_argument('-J', '--jobminutes', dest='jobminutes', type=float, default=10, help='Shortest job to recommend with -P: shorter varincorp steps of a clone are grouped into jobs of about this length (default: 10)')
+
+    args = parser.parse_args()
+
+    def warning(msg):
+        print('WARNING: {}'.format(msg), file=stderr)
+
+    def error(msg, exit_code=1):
+        print('ERROR: {}'.format(msg), file=stderr)
+        exit(exit_code)
+
+    class TASK(object):
+        #a command to run, with the files it reads and writes, the tasks it needs to finish first, the cores it uses, and the counts its run time
+        #(seconds) and memory (bytes) are estimated from. The command's options (after the python executable and script) are recorded in the
+        #state file, so that a step is run again when they change. Options that don't change its outputs are added to command afterwards
+        def __init__(self,name,command,inputs,outputs,dependencies,cores,features):
+            self.name=name
+            self.command=command
+            self.options=command[2:]
+            self.inputs=inputs
+            self.outputs=outputs
+            self.dependencies=dependencies
+            self.cores=cores
+            self.features=features
+            self.seconds,self.memory=estimate(features)
+
+    with open(args.jsonfile,'r') as file:
+        parameters=json.load(file)
+    if 'reference' not in parameters or not os.path.exists(parameters['reference'] + '.fai'):
+        error('No fai index file for genome.')
+    prefix=parameters.get('prefix','')
+    directory=parameters.get('directory','.')
+    fai=heterogenesis_query.readfai(parameters['reference'] + '.fai')
+    chromosomes=parameters.get('chromosomes','all')
+    chromosomes=heterogenesis_query.chromosomelist(chromosomes if type(chromosomes)==list else [chromosomes])
+    chromosomes=[chro for chro in fai if chro in chromosomes]    #(as heterogenesis_vargen does, in the order of the reference)
+    clones=[]
+    with open(args.clonefile,'r') as file:
+        for line in file:
+            if line.strip()!='':
+                clones.append(line.strip().split('\t')[0])
+    memorylimit=args.memory*1024**3 if args.memory!=None else os.sysconf('SC_PAGE_SIZE')*os.sysconf('SC_PHYS_PAGES')
+
+    #Cost model -------------------------------------------------------------------------------------------------------------------------
+    #Expected numbers of variants of each clone on each chromosome, and of copies of each chromosome, are worked out from the parameters as
+    #heterogenesis_vargen does (with its defaults)
+    def expectedvariants():
+        #returns dictionaries of clone : chromosome : snvs and indels, and clone : expected copies of each chromosome, and the total number
+        #of variants generated
+        lengths=dict([(chro,fai[chro][0]) for chro in chromosomes])
+        variantlengths=lengths
+        if parameters.get('targets','none')!='none':    #(snvs and indels are placed in targets, at rates per targeted base)
+            targets=heterogenesis_targets.TARGETS(parameters['targets'],lengths,int(parameters.get('targetpadding',100)))
+            variantlengths=dict([(chro,targets.length(chro)) for chro in chromosomes])
+        total=max(1,sum(variantlengths.values()))
+        germline=total*(parameters.get('snvgermline',0.0014)+parameters.get('indgermline',0.00014))
+        somatic=total*(parameters.get('snvsomatic',0.00001)+parameters.get('indsomatic',0.000002))
+        aneuploid=parameters.get('aneuploid',2)
+        structure=dict([(clo,(float(distance),parent)) for clo,(distance,parent) in heterogenesis_structure.readstructure(parameters.get('structure',heterogenesis_structure.DEFAULTSTRUCTURE)).items()])
+        distance=sum([d for d,parent in structure.values()])
+        variants={'germline':dict([(chro,germline*variantlengths[chro]/total) for chro in chromosomes])}
+        copies={'germline':2}
+        for clo in structure:
+            lineage=0   #fraction of somatic variants in the clone and its ancestors
+            c=clo
+            while c in structure:
+                lineage+=structure[c][0]/distance
+                c=structure[c][1]
+            variants[clo]=dict([(chro,(germline+somatic*lineage)*variantlengths[chro]/total) for chro in chromosomes])
+            copies[clo]=2*(1+float(parameters.get('wgdprob',0)))**(aneuploid*lineage)   #(single chromosome gains and losses are equally likely, so only whole genome duplications change the expected copies)
+        generated=germline+somatic+sum([parameters.get(p,d) for p,d in (('cnvrepgermline',160),('cnvdelgermline',1000),('cnvrepsomatic',250),('cnvdelsomatic',250))])
+        return variants,copies,generated
+
+    #Estimated run time (seconds) and peak memory (bytes) of each kind of step, from the counts each depends on. The coefficients were measured
+    #on one machine; with -m they are scaled by the ratio of measured to estimated costs of the steps recorded in the metrics file by earlier runs
+    def defaultcost(features):
+        if features['kind']=='vargen':  #time is mostly spent checking each new variant against those already on its chromosome copy
+            return 1+2e-8*features['bases']+1.5e-7*features['variants']**2/features['haplotypes'],64*1024**2+2*features['bases']+300*features['variants']*features['clones']
+        if features['kind']=='varincorp':   #incorporating each variant walks the blocks of its chromosome copy, then each copy's sequence is written
+            return 0.5+1e-7*features['bases']*features['haplotypes']+4.5e-8*features['hapvariants']**2*features['haplotypes'],64*1024**2+2*features['bases']+400*features['hapvariants']*features['haplotypes']
+        return 1+2e-5*features['records'],96*1024**2*features['workers']
+
+    scales=dict([(kind,[1.0,1.0]) for kind in ('vargen','varincorp','freqcalc')])
+    calibrated={}
+    if args.metrics!=None and os.path.exists(args.metrics):
+        measured={}
+        with open(args.metrics,'r') as file:
+            for line in file:
+                record=json.loads(line)
+                if record.get('phase')=='task':
+                    seconds,memory=defaultcost(record)
+                    totals=measured.setdefault(record['kind'],[0,0,0,0])
+                    for i,value in enumerate([record['seconds'],seconds,record['maxrssmb']*1024**2,memory]):
+                        totals[i]+=value
+                    calibrated[record['kind']]=calibrated.get(record['kind'],0)+1
+        for kind in measured:
+            scales[kind]=[measured[kind][0]/measured[kind][1],measured[kind][2]/measured[kind][3]]
+
+    def uncalibratedmemory(features):
+        #conservative memory of a step (a python process with the variants read in, plus sequence held for each chromosome), which the model's
+        #estimate is never taken below until there are measured steps of its kind to calibrate it
+        base=256*1024**2
+        if features['kind']=='vargen':
+            return base+2*features['bases']
+        if features['kind']=='varincorp':
+            return base+6*features['bases']
+        return base*features['workers']
+
+    def estimate(features):
+        seconds,memory=defaultcost(features)
+        memory*=scales[features['kind']][1]
+        if features['kind'] not in calibrated:
+            memory=max(memory,uncalibratedmemory(features))
+        return seconds*scales[features['kind']][0],memory
+
+    def script(module):    #the other heterogenesis programs, which are installed alongside this one
+        return os.path.join(os.path.abspath(os.path.dirname(__file__)),module+'.py')
+
+    def path(name):
+        return os.path.join(directory,prefix+name)
+
+    #Build the task graph -----------------------------------------------------------------------------------------------------------
+    variants,copies,generated=expectedvariants()
+    for clo in clones:
+        if clo not in variants:
+            error(clo+' is not a clone in the structure parameter.')
+    tasks=[]
+    configinputs=[args.jsonfile,parameters['reference']+'.fai']+[parameters[p] for p in ('structure','targets') if os.path.exists(str(parameters.get(p,'')))]
+    vargen=TASK('vargen',[executable,script('heterogenesis_vargen'),'-j',args.jsonfile,'-s'],configinputs,[path('variants.json'),path('variantsindex.json')],[],1,
+        {'kind':'vargen','bases':sum([fai[c][0] for c in chromosomes]),'variants':generated,'haplotypes':2*len(chromosomes),'clones':len(variants)})
+    tasks.append(vargen)
+    #the heterogenesis_varincorp options in -a that decide which files it writes, and how many processes it uses
+    varincorpparser=argparse.ArgumentParser(add_help=False)
+    for option in ('-n','-z','-b','-f','-i'):
+        varincorpparser.add_argument(option,action='store_true')
+    varincorpparser.add_argument('-w',type=int,default=1)
+    varincorpoptions=varincorpparser.parse_known_args(shlex.split(args.varincorpargs))[0]
+    haplotypes={}   #haplotypes of each clone and chromosome, for the names of fasta files, from an earlier heterogenesis_vargen run (if vargen
+    if os.path.exists(path('variantsindex.json')):  #runs again, so does every varincorp, so they aren't needed)
+        with open(path('variantsindex.json'),'r') as file:
+            haplotypes=json.load(file).get('haplotypes',{})
+
+    def varincorpoutputs(clo,chro):
+        #the copy number and vcf files (used by freqcalc), and the other files written with the options given
+        tables=[path(clo+chro+'cnv.txt'),path(clo+chro+'.vcf')]+([path(clo+chro+'profile.bin')] if varincorpoptions.f else [])
+        others=[path(clo+chro+o+'.gz.tbi') for o in ('cnv.txt','.vcf')] if varincorpoptions.i else []
+        if varincorpoptions.b:
+            others.append(path(clo+chro+'blocks.bin'))
+        if varincorpoptions.z and not varincorpoptions.n:
+            others+=[path(clo+chro+o) for o in ('.fasta.gz','.fasta.gz.fai','.fasta.gz.gzi')]
+        elif not varincorpoptions.n:
+            others+=[path(clo+chro+hap+'.fasta') for hap in haplotypes.get(clo,{}).get(chro,[])]
+        return tables,tables+others
+
+    varincorps=[]
+    metricsargs=['-m',args.metrics] if args.metrics!=None else []
+    for clo in clones:
+        for chro in chromosomes:
+            #with -x each varincorp reads only its chromosome's variants and reference sequence. Variants are split between the A and B copies
+            tables,outputs=varincorpoutputs(clo,chro)
+            task=TASK('varincorp-'+clo+'-'+chro,[executable,script('heterogenesis_varincorp'),'-j',args.jsonfile,'-c',clo,'-x',chro]+shlex.split(args.varincorpargs),
+                [args.jsonfile,path('variants-'+chro+'.json')],outputs,[vargen],max(1,varincorpoptions.w),
+                {'kind':'varincorp','bases':fai[chro][0],'hapvariants':variants[clo][chro]/2,'haplotypes':copies[clo]})
+            task.tables=tables
+            task.command+=metricsargs
+            varincorps.append(task)
+            tasks.append(task)
+    freqcores=max(1,min(args.workers,len(chromosomes)))
+    freqcalc=TASK('freqcalc',[executable,script('freqcalc'),'-c',args.clonefile,'-d',directory,'-p',prefix,'-n',args.name],
+        [args.clonefile]+[o for t in varincorps for o in t.tables],[path(args.name+'cnv.txt'),path(args.name+'.vcf')],varincorps,freqcores,
+        {'kind':'freqcalc','records':sum([sum(variants[clo].values()) for clo in clones]),'workers':freqcores})
+    freqcalc.command+=['-w',str(freqcores)]
+    tasks.append(freqcalc)
+    for clo in clones:
+        if os.path.exists(path(clo+'cnv.txt')) or os.path.exists(path(clo+'cnv.txt.gz')):
+            warning('Combined files for '+clo+' exist in '+directory+', so freqcalc will use them rather than the per chromosome files. Remove them to mix the new files.')
+
+    #Decide which tasks are up to date: their outputs exist, they were last run with the same options, none of their inputs have changed
+    #since they last started (both recorded in the state file), and none of the tasks they depend on need running
+    statefile=path('pipeline.json')
+    state={}
+    if os.path.exists(statefile):
+        with open(statefile,'r') as file:
+            state=json.load(file)
+
+    def filetime(filename):    #modification time of a file, or its bgzip compressed version (from varincorp -i)
+        for f in (filename,filename+'.gz'):
+            if os.path.exists(f):
+                return os.path.getmtime(f)
+        return None
+
+    def uptodate(task):
+        if args.force or type(state.get(task.name))!=dict or state[task.name]['options']!=task.options:
+            return False
+        if any([filetime(o)==None for o in task.outputs]):
+            return False
+        return all([filetime(i)!=None and filetime(i)<=state[task.name]['started'] for i in task.inputs])
+
+    torun=[]
+    for task in tasks:  #(tasks are in dependency order)
+        if not uptodate(task) or any([d in torun for d in task.dependencies]):
+            torun.append(task)
+    print(str(datetime.datetime.now())+' : '+str(len(torun))+' of '+str(len(tasks))+' steps to run')
+
+    def writestate():
+        temp=statefile+'.'+str(os.getpid())+'.tmp'
+        with open(temp,'w') as file:
+            json.dump(state,file,indent=1)
+        os.replace(temp,statefile)
+
+    #a task is started once the tasks it depends on have finished, and while it fits within the cores and memory not used by running tasks
+    #(a task always starts if nothing else is running)
+    def canstart(task,pending,running,cores,memory):
+        if any([d in pending or d in running for d in task.dependencies]):
+            return False
+        return running=={} or (cores+task.cores<=args.workers and memory+task.memory<=memorylimit)
+
+    if not os.path.exists(directory):
+        os.makedirs(directory)
+
+    #Plan: estimates for the steps to run, and recommended jobs ------------------------------------------------------------------------
+    def duration(seconds):
+        if seconds<60:
+            return str(int(round(seconds)))+'s'
+        if seconds<3600:
+            return str(round(seconds/60,1))+'m'
+        return str(round(seconds/3600,1))+'h'
+
+    def size(memory):
+        if memory<1024**3:
+            return str(int(round(memory/1024**2)))+'MB'
+        return str(round(memory/1024**3,1))+'GB'
+
+    def walltime(tasks):
+        #time to run tasks on this machine as they are run below, using their estimates
+        pending=list(tasks)
+        running={}
+        now=0
+        while pending!=[] or running!={}:
+            cores=sum([t.cores for t in running])
+            memory=sum([t.memory for t in running])
+            for task in list(pending):
+                if canstart(task,pending,running,cores,memory):
+                    pending.remove(task)
+                    running[task]=now+task.seconds
+                    cores+=task.cores
+                    memory+=task.memory
+            now=min(running.values())
+            for task in [t for t in running if running[t]<=now]:
+                del running[task]
+        return now
+
+    def plan():
+        print('Estimates ('+(', '.join([kind+' calibrated from '+str(calibrated[kind])+' steps in '+args.metrics for kind in calibrated]) if calibrated!={} else 'not calibrated, give a metrics file from earlier runs with -m')+'):')
+        print('Step\tTime\tMemory\tCores')
+        for task in torun:
+            print(task.name+'\t'+duration(task.seconds)+'\t'+size(task.memory)+'\t'+str(task.cores))
+        for task in torun:
+            if task.memory>memorylimit:
+                warning(task.name+' is estimated to need '+size(task.memory)+', more than the '+size(memorylimit)+' available.')
+        print('Total: '+duration(sum([t.seconds*t.cores for t in torun]))+' of cpu time, about '+duration(walltime(torun))+' on '+str(args.workers)+' cores and '+size(memorylimit)+' here. ('+str(len(tasks)-len(torun))+' steps up to date.)')
+        #a varincorp step longer than -J minutes and than the varincorp steps' share of each core holds up freqcalc, so is split across its
+        #chromosome copies with heterogenesis_varincorp -w. Shorter steps of a clone are grouped (in chromosome order) into jobs of up to -J minutes
+        steps=[t for t in torun if t in varincorps]
+        share=sum([t.seconds for t in steps])/args.workers
+        split=[]
+        groups=[]
+        for task in steps:
+            workers=min(int(round(task.features['haplotypes'])),int(math.ceil(task.seconds/share)) if share>0 else 1)
+            if workers>1 and task.seconds>=args.jobminutes*60:
+                split.append({'step':task.name,'workers':workers,'seconds':task.seconds/workers,'memory':task.memory})
+        for clo in clones:
+            group=[]
+            for task in [t for t in steps if t.name.startswith('varincorp-'+clo+'-') and t.seconds<args.jobminutes*60]:
+                if group!=[] and sum([t.seconds for t in group])+task.seconds>args.jobminutes*60:
+                    groups.append(group)
+                    group=[]
+                group.append(task)
+            groups.append(group)
+        groups=[g for g in groups if len(g)>1]
+        if split!=[] or groups!=[]:
+            print('Recommended jobs:')
+        for s in split:
+            print('Split '+s['step']+': run heterogenesis_varincorp with -w '+str(s['workers'])+' to process its chromosome copies in parallel, for about '+duration(s['seconds'])+' on '+str(s['workers'])+' cores.')
+        for g in groups:
+            print('Group '+', '.join([t.name for t in g])+': about '+duration(sum([t.seconds for t in g]))+' in one job, with at most '+size(max([t.memory for t in g]))+'.')
+        with open(path('plan.json'),'w') as file:
+            json.dump({'calibrated':calibrated,'wallseconds':walltime(torun),'steps':[dict([('name',t.name),('seconds',t.seconds),('memory',t.memory),('cores',t.cores),('dependencies',[d.name for d in t.dependencies if d in torun])]+list(t.features.items())) for t in torun],
+                'split':split,'groups':[[t.name for t in g] for g in groups]},file,indent=1)
+        print('Written '+path('plan.json'))
+
+    if args.plan:
+        plan()
+        return
+
+    def recordmetrics(task,started,usage):
+        #append a json line with the step's counts, estimates and measured run time and peak memory, for calibrating later estimates
+        record={'phase':'task','task':task.name}
+        record.update(task.features)
+        record.update({'estimatedseconds':round(task.seconds,3),'estimatedmb':round(task.memory/1024**2,1),'seconds':round(time.time()-started,3),'maxrssmb':round(usage.ru_maxrss/1024,1)})
+        with open(args.metrics,'a') as file:
+            file.write(json.dumps(record)+'\n')
+
+    #Run tasks on a local pool of processes -------------------------------------------------------------------------------------------
+    pending=list(torun)
+    running={}
+    failed=[]
+    while (pending!=[] and failed==[]) or running!={}:
+        cores=sum([t.cores for t in running])
+        memory=sum([t.memory for t in running])
+        for task in list(pending):
+            if failed!=[]:
+                continue
+            if canstart(task,pending,running,cores,memory):
+                pending.remove(task)
+                log=open(path(task.name+'.log'),'w')
+                running[task]=(subprocess.Popen(task.command,stdout=log,stderr=subprocess.STDOUT),log,time.time())
+                cores+=task.cores
+                memory+=task.memory
+                print(str(datetime.datetime.now())+' : Started '+task.name)
+        time.sleep(0.1)
+        for task in list(running):
+            process,log,started=running[task]
+            pid,status,usage=os.wait4(process.pid,os.WNOHANG)    #(rather than polling, to get the step's peak memory)
+            if pid!=0:
+                process.returncode=os.WEXITSTATUS(status) if os.WIFEXITED(status) else -os.WTERMSIG(status)
+                log.close()
+                del running[task]
+                if process.returncode==0:
+                    state[task.name]={'started':started,'options':task.options}
+                    writestate()
+                    if args.metrics!=None:
+                        recordmetrics(task,started,usage)
+                    print(str(datetime.datetime.now())+' : Finished '+task.name)
+                else:
+                    failed.append(task)
+                    print(str(datetime.datetime.now())+' : Failed '+task.name)
+    if failed!=[]:
+        error(', '.join([t.name for t in failed])+' failed. See '+', '.join([path(t.name+'.log') for t in failed])+'.')
+    print(str(datetime.datetime.now())+' : Done')
+
+# If run as main, run main():
+if __name__ == '__main__': main()
@@ -0,0 +1,156 @@
+#! /usr/bin/env python3
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+import argparse
+from signal import signal, SIGPIPE, SIG_DFL
+import os.path
+import json
+import random
+import datetime
+import tempfile
+import re
+import socket
+import ipaddress
+import multiprocessing
+from http.server import HTTPServer, BaseHTTPRequestHandler
+from socketserver import ThreadingMixIn
+from sys import stderr, exit
+import numpy
+import heterogenesis_api
+import heterogenesis_vargen
+import heterogenesis_varincorp
+
+signal(SIGPIPE, SIG_DFL) # Handle broken pipes
+
+
+version = {}
+with open(os.path.join(os.path.abspath(os.path.dirname(__file__)), 'version.py')) as f: exec(f.read(), version)
+
+#Server that keeps the reference genome and dbSNP variants loaded, and runs simulations sent to it by http on a pool of worker processes.
+#Requests are POSTed to /simulate as json: {"parameters": parameters as in the json parameters file (or the name of the file), "seed":
+#optional random seed, "clones": optional list of clones to run heterogenesis_varincorp for, "options": heterogenesis_varincorp options}.
+#Each simulation is written to its own new directory within the directory parameter, and the response gives the seed used, that directory
+#and the output files. GET /status gives what is loaded. Requests can name any file to read or directory to write, so the server only
+#listens on loopback addresses.
+
+loaded={}   #reference and dbsnp, read in before the worker pool is started so that forked workers share them
+
+def simulate(request):
+    #run heterogenesis_vargen (and heterogenesis_varincorp for any clones in the request) in a worker, using the reference and dbsnp
+    #variants loaded if the parameters use the same files
+    parameters=dict(request['parameters'])
+    random.seed(request['seed'])
+    numpy.random.seed(request['seed']%2**32)
+    reference=loaded['reference'] if os.path.abspath(parameters.get('reference',''))==loaded['reference'].filename else None
+    dbsnp=loaded['dbsnp'] if loaded['dbsnpfile']!=None and os.path.abspath(str(parameters.get('dbsnp','none')))==loaded['dbsnpfile'] else None
+    prefix=parameters.get('prefix','')
+    if not os.path.exists(parameters.get('directory','.')):
+        os.makedirs(parameters.get('directory','.'),exist_ok=True)
+    directory=tempfile.mkdtemp(prefix=prefix+'seed'+str(request['seed'])+'-',dir=parameters.get('directory','.'))  #(so requests sharing a directory and prefix never mix outputs)
+    parameters['directory']=directory
+    try:
+        variants={}
+        heterogenesis_vargen.main([],parameters=parameters,reference=reference,dbsnp=dbsnp,results=variants)
+        for clo in request.get('clones',[]):
+            heterogenesis_varincorp.main(['-c',clo]+request.get('options',[]),parameters=parameters,variants=variants,reference=reference)
+    except SystemExit as e:    #(errors in heterogenesis_vargen and heterogenesis_varincorp exit, after printing the error)
+        return {'seed':request['seed'],'error':'Simulation exited with code '+str(e.code)+'. See the server output.'}
+    except Exception as e:
+        return {'seed':request['seed'],'error':repr(e)}
+    outputs=sorted(os.listdir(directory))
+    return {'seed':request['seed'],'directory':os.path.abspath(directory),'variants':os.path.abspath(os.path.join(directory,prefix+'variants.json')),'outputs':outputs}
+
+def main():
+    parser = argparse.ArgumentParser(description="Keep the reference genome and dbSNP loaded, and run heterogenesis simulations sent by http.")
+    parser.add_argument('-v', '--version', action='version', version='%(prog)s {0}'.format(version['__version__']))
+    parser.add_argument('-r', '--reference', dest='reference', required=True, type=str, help='Reference genome fasta file (with a .fai index)')
+    parser.add_argument('-d', '--dbsnp', dest='dbsnp', type=str, help='dbSNP vcf file')
+    parser.add_argument('-x', '--chromosomes', dest='chromosomes', type=str, help='Comma separated list of chromosomes to load (default: all)')
+    parser.add_argument('-w', '--workers', dest='workers', type=int, default=os.cpu_count(), help='Number of simulations to run at once (default: number of cores)')
+    parser.add_argument('-H', '--host', dest='host', type=str, default='127.0.0.1', help='Loopback address to listen on (default: 127.0.0.1)')
+    parser.add_argument('-p', '--port', dest='port', type=int, default=8765, help='Port to listen on (default: 8765)')
+
+    args = parser.parse_args()
+
+    def error(msg, exit_code=1):
+        print('ERROR: {}'.format(msg), file=stderr)
+        exit(exit_code)
+
+    def loopback(host):
+        try:
+            return all([ipaddress.ip_address(address[4][0].split('%')[0]).is_loopback for address in socket.getaddrinfo(host,None)])
+        except (socket.gaierror,ValueError):
+            return False
+
+    if not loopback(args.host):
+        error(args.host+' is not a loopback address. Requests can read and write any files the server can, so it only listens on this machine (use eg. an ssh tunnel to reach it from elsewhere).')
+    if not os.path.exists(args.reference + '.fai'):
+        error('No fai index file for genome.')
+    chromosomes=args.chromosomes.split(',') if args.chromosomes!=None else None
+    loaded['reference']=heterogenesis_api.REFERENCE(os.path.abspath(args.reference),chromosomes)
+    for chro in loaded['reference'].sequences:  #decode the text used by heterogenesis_vargen now, so it is shared by the workers
+        loaded['reference'].text(chro)
+    print(str(datetime.datetime.now())+' : Read in reference')
+    loaded['dbsnpfile']=os.path.abspath(args.dbsnp) if args.dbsnp!=None else None
+    loaded['dbsnp']=heterogenesis_vargen.readdbsnp(args.dbsnp,loaded['reference'].sequences) if args.dbsnp!=None else None
+    if args.dbsnp!=None:
+        print(str(datetime.datetime.now())+' : Read in '+str(len(loaded['dbsnp'][0])+len(loaded['dbsnp'][2]))+' dbSNP variants')
+    pool=multiprocessing.get_context('fork').Pool(args.workers)
+
+    class HANDLER(BaseHTTPRequestHandler):
+        def respond(self,code,data):
+            body=json.dumps(data).encode()
+            self.send_response(code)
+            self.send_header('Content-Type','application/json')
+            self.send_header('Content-Length',str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+        def do_GET(self):
+            if self.path!='/status':
+                return self.respond(404,{'error':'Not found.'})
+            self.respond(200,{'version':version['__version__'],'reference':loaded['reference'].filename,'chromosomes':list(loaded['reference'].sequences.keys()),'dbsnp':loaded['dbsnpfile'],'workers':args.workers})
+        def do_POST(self):
+            if self.path!='/simulate':
+                return self.respond(404,{'error':'Not found.'})
+            try:
+                request=json.loads(self.rfile.read(int(self.headers['Content-Length'])).decode())
+                if type(request.get('parameters'))==str:
+                    with open(request['parameters'],'r') as file:
+                        request['parameters']=json.load(file)
+                if type(request.get('parameters'))!=dict:
+                    raise ValueError('No parameters given.')
+                #simulations run in the server's worker processes, which can't start pools of their own
+                if any([o.startswith('--w') or re.match('-[bnzirVf]*w',o) for o in request.get('options',[])]):    #(-w, or -w after flags, eg. -nw)
+                    raise ValueError('heterogenesis_varincorp -w/--workers cannot be used through the server. Use the server\'s own -w to run simulations in parallel.')
+            except Exception as e:
+                return self.respond(400,{'error':repr(e)})
+            if request.get('seed')==None:
+                request['seed']=random.SystemRandom().randrange(2**63)
+            result=pool.apply(simulate,(request,))
+            self.respond(500 if 'error' in result else 200,result)
+
+    class SERVER(ThreadingMixIn,HTTPServer):    #each request is handled on its own thread, waiting for a worker
+        daemon_threads=True
+
+    server=SERVER((args.host,args.port),HANDLER)
+    print(str(datetime.datetime.now())+' : Listening on http://'+args.host+':'+str(args.port))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    server.server_close()
+    pool.terminate()
+
+# If run as main, run main():
+if __name__ == '__main__': main()
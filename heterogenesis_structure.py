@@ -0,0 +1,29 @@
+#! /usr/bin/env python3
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+import os.path
+
+#The tumour structure parameter, shared by heterogenesis_vargen, heterogenesis_varincorp and heterogenesis_run: a comma separated list of
+#clone, evolutionary distance, parent clone, ... given directly or as the first line of a file.
+DEFAULTSTRUCTURE="clone1,0.2,germline,clone2,0.8,clone1"
+
+def readstructure(structure):  #returns dictionary of clone : [evolutionary distance (as given), parent clone], in the order given
+    if os.path.exists(structure):
+        with open(structure,'r') as file:
+            structure=file.readline().strip()
+    structure=structure.split(',')
+    clones={}
+    for i in range(1,int((len(structure)/3)+1)):
+        clones[structure[i*3-3]]=[structure[i*3-2],structure[i*3-1]]
+    return clones
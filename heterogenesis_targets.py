@@ -0,0 +1,87 @@
+#! /usr/bin/env python3
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+import random
+from bisect import bisect_left, bisect_right
+
+#Target regions (eg. the exons of an exome or panel assay) from a BED file, for simulating only the targeted parts of the genome.
+#heterogenesis_vargen places variants within the targets, and heterogenesis_varincorp and freqcalc only write the sequence and records
+#that overlap them.
+
+class TARGETS(object):
+    #regions of each chromosome in lengths (a dictionary of chromosome : length, or None for all chromosomes), padded on each side by
+    #padding bases, and merged where they overlap or touch. Regions are held as sorted lists of 1 based start and end positions (BED
+    #files are 0 based, half open)
+    def __init__(self,bedfile,lengths,padding=0):
+        self.bedfile=bedfile
+        self.padding=padding
+        regions={}
+        with open(bedfile,'r') as file:
+            for line in file:
+                if line.strip()=='' or line.startswith('#') or line.startswith('track') or line.startswith('browser'):
+                    continue
+                l=line.strip().split('\t')
+                if lengths==None or l[0] in lengths:
+                    start=max(1,int(l[1])+1-padding)
+                    end=int(l[2])+padding if lengths==None else min(int(lengths[l[0]]),int(l[2])+padding)
+                    if start<=end:
+                        regions.setdefault(l[0],[]).append([start,end])
+        self.starts={}
+        self.ends={}
+        self.cumulative={}  #bases in targets up to the end of each region, for choosing positions
+        for chro in regions:
+            merged=[]
+            for start,end in sorted(regions[chro]):
+                if merged!=[] and start<=merged[-1][1]+1:
+                    merged[-1][1]=max(merged[-1][1],end)
+                else:
+                    merged.append([start,end])
+            self.starts[chro]=[r[0] for r in merged]
+            self.ends[chro]=[r[1] for r in merged]
+            self.cumulative[chro]=[]
+            total=0
+            for start,end in merged:
+                total+=end-start+1
+                self.cumulative[chro].append(total)
+    def __str__(self): return('TARGETS from {}: {} regions, {} bases'.format(self.bedfile, sum([len(s) for s in self.starts.values()]), sum([self.length(c) for c in self.starts])))
+    def length(self,chro):  #bases of chro in targets
+        return self.cumulative[chro][-1] if chro in self.cumulative else 0
+    def clip(self,chro,start,end):
+        #list of (start, end) of the parts of start-end (1 based, inclusive) within targets
+        if chro not in self.starts:
+            return []
+        starts=self.starts[chro]
+        ends=self.ends[chro]
+        parts=[]
+        i=bisect_left(ends,start)
+        while i<len(starts) and starts[i]<=end:
+            parts.append((max(start,starts[i]),min(end,ends[i])))
+            i+=1
+        return parts
+    def overlaps(self,chro,start,end):
+        if chro not in self.starts:
+            return False
+        i=bisect_left(self.ends[chro],start)
+        return i<len(self.starts[chro]) and self.starts[chro][i]<=end
+    def position(self,chro,last):
+        #random position in targets, at or before last. If no targeted base is at or before last (eg. for an indel too long to fit in
+        #targets at the end of a chromosome), any position up to last is chosen
+        last=int(last)
+        i=bisect_right(self.starts.get(chro,[]),last)
+        count=self.cumulative[chro][i-1]-max(0,self.ends[chro][i-1]-last) if i>0 else 0
+        if count<=0:
+            return random.randint(1,last)
+        n=random.randint(1,count)
+        j=bisect_left(self.cumulative[chro],n)
+        return self.starts[chro][j]+n-(self.cumulative[chro][j-1] if j>0 else 0)-1
@@ -23,6 +23,10 @@ import os.path
 import json
 from sys import stderr, exit
 from copy import deepcopy
+import heterogenesis_query
+import heterogenesis_cache
+import heterogenesis_targets
+import heterogenesis_structure
 
 
 signal(SIGPIPE, SIG_DFL) # Handle broken pipes
@@ -31,7 +35,35 @@ signal(SIGPIPE, SIG_DFL) # Handle broken pipes
 version = {}
 with open(os.path.join(os.path.abspath(os.path.dirname(__file__)), 'version.py')) as f: exec(f.read(), version)
 
-def main():
+def readdbsnp(dbsnp,chromosomes):
+    #common variants in a dbSNP vcf file on chromosomes: lists of [chromosome, position, ref, alt] and minor allele frequencies, of snvs and of indels
+    dbsnvalt=[]
+    dbindelalt=[]
+    dbsnvmaf=[]
+    dbindelmaf=[]
+    with open(dbsnp,'r') as file:
+        for line in file:
+            if "CAF=" in line:
+                l=line.split("\t")
+                if l[0] in chromosomes:
+                    ref=l[3]
+                    alt=l[4].split(',')[0]
+                    if l[7].split(';')[-2].startswith('CAF='):
+                        maf=l[7].split(';')[-2].split(',')[1]
+                        if maf!='.' and float(maf)!=0:
+                            if len(ref)+len(alt)==2: #variant is a substitution
+                                if alt.upper()!=ref.upper():
+                                    dbsnvalt.append([l[0],l[1],ref,alt])
+                                    dbsnvmaf.append(maf)
+                            elif len(ref)==1 or len(alt)==1: #variant is an indel
+                                dbindelalt.append([l[0],l[1],ref,alt])
+                                dbindelmaf.append(maf)
+    return dbsnvalt,dbsnvmaf,dbindelalt,dbindelmaf
+
+def main(argv=None,parameters=None,reference=None,dbsnp=None,results=None,write=True):
+    #argv is a list of command line options (sys.argv by default). heterogenesis_api and heterogenesis_server pass in parameters, a reference
+    #and dbSNP variants (from readdbsnp) read in already rather than reading them from files, and a dictionary for results, which is given
+    #the variants of each clone (as in variants.json). With write False no output files are written
 
     def warning(msg):
         print('WARNING: {}'.format(msg), file=stderr)
@@ -43,11 +75,15 @@ def main():
 
     parser = argparse.ArgumentParser(description="Create random SNVs, indels and CNVs for each subclone in a tumour sample.")
     parser.add_argument('-v', '--version', action='version', version='%(prog)s {0}'.format(version['__version__']))
-    parser.add_argument('-j', '--json', dest='jsonfile', required=True, type=str, help='Json file with parameters')
+    parser.add_argument('-j', '--json', dest='jsonfile', required=parameters==None, type=str, help='Json file with parameters')
+    parser.add_argument('-s', '--split', dest='split', action='store_true', help='Also write the variants of each chromosome to their own file, so that heterogenesis_varincorp -x only reads the variants it needs')
 
-    args = parser.parse_args()
-    with open(args.jsonfile,'r') as file:
-        parameters=json.load(file)
+    args = parser.parse_args(argv)
+    if parameters==None:
+        with open(args.jsonfile,'r') as file:
+            parameters=json.load(file)
+    else:
+        parameters=dict(parameters)
 
     #set default parameter values and give error/warning/info messages
     if "prefix" not in parameters:
@@ -64,8 +100,8 @@ def main():
         warning('No output directory given, using current directory.')
         parameters['directory']='.'
     if "structure" not in parameters:
-        info('No tumour structure given, using "clone1,0.2,germline,clone2,0.8,clone1"')
-        parameters['structure']="clone1,0.2,germline,clone2,0.8,clone1"
+        info('No tumour structure given, using "'+heterogenesis_structure.DEFAULTSTRUCTURE+'"')
+        parameters['structure']=heterogenesis_structure.DEFAULTSTRUCTURE
     if "snvgermline" not in parameters:
         parameters['snvgermline']=0.0014
         info('No germline SNV rate given, using '+str(parameters['snvgermline'])+'.')
@@ -141,9 +177,25 @@ def main():
         if "dbsnpindelproportion" not in parameters:
             parameters['dbsnpindelproportion']=0.97
             info('No proportion given for germline InDels taken from dbSNP, using '+str(parameters['dbsnpindelproportion'])+'.')
+    if "cache" not in parameters:
+        parameters['cache']=''
+    if "germline" in parameters:
+        if parameters['cache']=='':
+            error('A cache directory is needed to reuse germline variants.')
+        info('Germline variants taken from cache with key ' + parameters['germline'] + '.')
     if "wgdprob" not in parameters:
         parameters['wgdprob']=0
         info('No whole-genome event probability set. All aneuploid events will be single chromosome events.')
+    if "targets" not in parameters:
+        parameters['targets']='none'
+    else:
+        info('SNVs and InDels placed within targets in ' + parameters['targets'])
+    if "targetpadding" not in parameters:
+        parameters['targetpadding']=100
+        if parameters['targets']!='none':
+            info('No padding given for targets, using '+str(parameters['targetpadding'])+' bases.')
+    if "targetcnvs" not in parameters:
+        parameters['targetcnvs']=False
 
     #given germline variants
     if "givengermlinesnvsproportion" not in parameters:
@@ -184,44 +236,25 @@ def main():
     #Functions for reading in data----------------------------------------------------------------------------------
 
     def readinclones(parameters):    #formats structure parameter into dictionary
-        if os.path.exists(parameters['structure']):
-            with open(parameters['structure'],'r') as file:
-                structure=file.readline().strip().split(',')
-        else:
-            structure=parameters['structure'].split(',')
-
-        clones={}
-        for i in range(1,int((len(structure)/3)+1)):
-            clones[structure[i*3-3]]=[structure[i*3-2],structure[i*3-1]]
+        clones=heterogenesis_structure.readstructure(parameters['structure'])
         print('Inputted tumour clones: ')
         for c in clones:
             print('Clone: ',c,', evolutionary distance: ',clones[c][0],', parent clone: ',clones[c][1])
         return(clones)
 
-    def readindbsnp(dbsnp,reference,dbsnvnum,dbindnum):
-        dbsnvalt=[]
-        dbindelalt=[]
-        dbsnvmaf=[]
-        dbindelmaf=[]
-        dbsnvs=[]
-        dbindels=[]
-        with open(dbsnp,'r') as file:
-            for line in file:
-                if "CAF=" in line:
-                    l=line.split("\t")
-                    if l[0] in reference:
-                        ref=l[3]
-                        alt=l[4].split(',')[0]
-                        if l[7].split(';')[-2].startswith('CAF='):
-                            maf=l[7].split(';')[-2].split(',')[1]
-                            if maf!='.' and float(maf)!=0:
-                                if len(ref)+len(alt)==2: #variant is a substitution
-                                    if alt.upper()!=ref.upper():
-                                        dbsnvalt.append([l[0],l[1],ref,alt])
-                                        dbsnvmaf.append(maf)
-                                elif len(ref)==1 or len(alt)==1: #variant is an indel
-                                    dbindelalt.append([l[0],l[1],ref,alt])
-                                    dbindelmaf.append(maf)
+    def readindbsnp(dbsnp,reference,dbsnvnum,dbindnum,loaded=None):
+        if loaded==None:
+            dbsnvalt,dbsnvmaf,dbindelalt,dbindelmaf=readdbsnp(dbsnp,reference)
+        else:   #read in already, possibly for more chromosomes
+            snvs=[(v,m) for v,m in zip(loaded[0],loaded[1]) if v[0] in reference]
+            indels=[(v,m) for v,m in zip(loaded[2],loaded[3]) if v[0] in reference]
+            dbsnvalt,dbsnvmaf=[v for v,m in snvs],[m for v,m in snvs]
+            dbindelalt,dbindelmaf=[v for v,m in indels],[m for v,m in indels]
+        if targets!=None:   #keep variants within targets
+            snvs=[(v,m) for v,m in zip(dbsnvalt,dbsnvmaf) if targets.overlaps(v[0],int(v[1]),int(v[1]))]
+            indels=[(v,m) for v,m in zip(dbindelalt,dbindelmaf) if targets.overlaps(v[0],int(v[1]),int(v[1]))]
+            dbsnvalt,dbsnvmaf=[v for v,m in snvs],[m for v,m in snvs]
+            dbindelalt,dbindelmaf=[v for v,m in indels],[m for v,m in indels]
         info(str(len(dbsnvalt)+len(dbindelalt)) +' common variants read in from dbSNP vcf file.')
         p=[float(i) for i in dbsnvmaf]
         s=sum(p)
@@ -236,28 +269,27 @@ def main():
         dbindels=[dbindelalt[d] for d in dlist]
         return(dbsnvs,dbindels)
 
-    def readingiven(givenin,reference):
+    def readingiven(givenin,reference,intargets=False):    #with intargets, only variants within targets are kept
         givenout=[]
         with open(givenin,'r') as file:
             file.readline()
             for l in file:
                 l=l.strip().split("\t")
-                if l[0] in reference:
+                if l[0] in reference and (not intargets or targets==None or targets.overlaps(l[0],int(l[1]),int(l[1]))):
                     givenout.append(l)
         random.shuffle(givenout)
         return(givenout)
 
-    def readinfai(chromosomes,fai,referencefile): #reads in reference and fai files for required chromosomes into dictionaries
-        if chromosomes==['all']:
-            keepchromos=['chr1','chr2','chr3','chr4','chr5','chr6','chr7','chr8','chr9','chr10','chr11','chr12','chr13','chr14','chr15','chr16','chr17','chr18','chr19','chr20','chr21','chr22']
-        else:
-            keepchromos=chromosomes
+    def readinfai(chromosomes,fai,referencefile,loaded=None): #reads in reference and fai files for required chromosomes into dictionaries, or takes the sequences from a reference already read in
+        keepchromos=heterogenesis_query.chromosomelist(chromosomes)
         with open(fai,'r') as file:
                 gen = dict([(line.strip().split("\t")[0], float(line.strip().split("\t")[1])) for line in file])
         genkeys=list(gen.keys())
         for chro in genkeys:
             if chro not in (keepchromos):
                 del gen[chro]
+        if loaded!=None:
+            return(gen,dict([(chro,loaded.text(chro)) for chro in keepchromos if chro in loaded]))
         reference={}
         reflist=[]
         chromo=''
@@ -285,6 +317,11 @@ def main():
         hap=numpy.random.choice(chrohaps[chro])
         return(chro,hap)
 
+    def randomposition(chro,last,targeted=True):  #random position up to last, within targets if there are any
+        if targets==None or not targeted:
+            return random.randint(1,last)
+        return targets.position(chro,last)
+
     def createaneu (gen,chrohaps):  #create information for an aneuploid variant
         x=0
         while x==0:
@@ -318,7 +355,7 @@ def main():
                 for i in range(0,copy):
                     invert.append(int(numpy.random.choice([1,0])))
         else:
-            chro,hap=choosechromosome(gen,chrohaps)
+            chro,hap=choosechromosome(cnvlengths,chrohaps)
             startbase='N'
             endbase='N'
             while (startbase=='N' or startbase=='n') and (endbase=='N' or endbase=='n'):
@@ -327,7 +364,7 @@ def main():
                     while length<51 or length>gen[chro]/2: length=int(Decimal(numpy.random.lognormal(parameters['cnvgermlinemean'],parameters['cnvgermlinevariance'],1)[0])*parameters['cnvgermlinemultiply'])
                 else:
                     while length<51 or length>gen[chro]/2: length=int(Decimal(numpy.random.lognormal(parameters['cnvsomaticmean'],parameters['cnvsomaticvariance'],1)[0])*parameters['cnvsomaticmultiply'])
-                position=random.randint(1,gen[chro]-length+1)
+                position=randomposition(chro,gen[chro]-length+1,parameters['targetcnvs'])
                 startbase=reference[chro][position-1]
                 endbase=reference[chro][position-1+length-1]
             copy=0
@@ -365,10 +402,10 @@ def main():
             ref=l[2]
             alt=l[3]
         else:
-            chro,hap=choosechromosome(gen,chrohaps)
+            chro,hap=choosechromosome(variantlengths,chrohaps)
             ref='N'
             while ref=='n' or ref=='N' or ref=='R' or ref=='r' or ref=='M' or ref=='m':
-                position=random.randint(1,gen[chro])
+                position=randomposition(chro,gen[chro])
                 ref=reference[chro][position-1]
             substitutions={}
             substitutions['A']=['T','G','C']
@@ -421,14 +458,14 @@ def main():
                 length=len(alt)-1
                 iod='i'
         else:
-            chro,hap=choosechromosome(gen,chrohaps)
+            chro,hap=choosechromosome(variantlengths,chrohaps)
             length=101
             while length>50:
                 length=int(round((float(numpy.random.lognormal(parameters['indmean'],parameters['indvariance'],1)[0])*parameters['indmultiply'])+0.5,0))
             seq=50*'N'
             ref='N'
             while (seq.count('N')+seq.count('n')>float(length)/4) or ref[0]=='n' or ref[0]=='N':    #keep getting an indel until it doesn't contain more than 1/4 'N's or base isn't an N
-                position=random.randint(1,gen[chro]-length)
+                position=randomposition(chro,gen[chro]-length)
                 iod=numpy.random.choice(['i','d'])
                 if iod=='i':
                     ref=reference[chro][position-1]
@@ -608,14 +645,27 @@ def main():
         chromosomes=parameters['chromosomes']
     else:
         chromosomes=[parameters['chromosomes']]
-    gen,reference=readinfai(chromosomes,parameters['fai'],parameters['reference'])  #get dictionaries of genome lengths and sequences
-
-
-    #Get total number of each variant type for somatic and germline genomes
-    snvgernum=round(sum(list(gen.values()))*parameters['snvgermline'])
-    snvsomnum=round(sum(list(gen.values()))*parameters['snvsomatic'])
-    indgernum=round(sum(list(gen.values()))*parameters['indgermline'])
-    indsomnum=round(sum(list(gen.values()))*parameters['indsomatic'])
+    gen,reference=readinfai(chromosomes,parameters['fai'],parameters['reference'],reference)  #get dictionaries of genome lengths and sequences
+
+    #Read in targets if given. SNVs and InDels (and with targetcnvs, CNV start positions) are then placed within targets, with chromosomes
+    #chosen by their targeted length rather than their whole length
+    targets=None
+    variantlengths=gen
+    cnvlengths=gen
+    if parameters['targets']!='none':
+        targets=heterogenesis_targets.TARGETS(parameters['targets'],gen,int(parameters['targetpadding']))
+        variantlengths=dict([(chro,float(targets.length(chro))) for chro in gen])
+        if sum(variantlengths.values())==0:
+            error('No targets in '+parameters['targets']+' on the chromosomes being simulated.')
+        if parameters['targetcnvs']:
+            cnvlengths=variantlengths
+        info(str(targets))
+
+    #Get total number of each variant type for somatic and germline genomes (SNV and InDel rates are per targeted base with targets)
+    snvgernum=round(sum(list(variantlengths.values()))*parameters['snvgermline'])
+    snvsomnum=round(sum(list(variantlengths.values()))*parameters['snvsomatic'])
+    indgernum=round(sum(list(variantlengths.values()))*parameters['indgermline'])
+    indsomnum=round(sum(list(variantlengths.values()))*parameters['indsomatic'])
 
     print('Number of germline SNVs : ',snvgernum)
     print('Number of somatic SNVs : ',snvsomnum)
@@ -627,21 +677,21 @@ def main():
     print('Number of somatic deletion CNVs : ',parameters['cnvdelsomatic'])
     print('Number of somatic aneuploid events : ',parameters['aneuploid'])
 
-    #read in dbsnp if given
-    if parameters['dbsnp'] != 'none':
+    #read in dbsnp if given (and germline variants are being generated)
+    if parameters['dbsnp'] != 'none' and "germline" not in parameters:
         dbsnvnum=round(snvgernum*parameters['dbsnpsnvproportion']*2)
         dbindnum=round(indgernum*parameters['dbsnpindelproportion']*2)
-        dbsnvs,dbindels=readindbsnp(parameters['dbsnp'],gen,dbsnvnum,dbindnum)
+        dbsnvs,dbindels=readindbsnp(parameters['dbsnp'],gen,dbsnvnum,dbindnum,dbsnp)
     else:
         dbsnvs={}
         dbindels={}
 
     if "givengermlinesnvs" in parameters:
-        givengermlinesnvslist = readingiven(parameters["givengermlinesnvs"],reference)
+        givengermlinesnvslist = readingiven(parameters["givengermlinesnvs"],reference,True)
     else:
         givengermlinesnvslist = ''
     if "givengermlineindels" in parameters:
-        givengermlineindelslist = readingiven(parameters["givengermlineindels"],reference)
+        givengermlineindelslist = readingiven(parameters["givengermlineindels"],reference,True)
     else:
         givengermlineindelslist = ''
     if "givengermlinecnvs" in parameters:
@@ -649,11 +699,11 @@ def main():
     else:
         givengermlinecnvslist = ''
     if "givensomaticsnvs" in parameters:
-        givensomaticsnvslist = readingiven(parameters["givensomaticsnvs"],reference)
+        givensomaticsnvslist = readingiven(parameters["givensomaticsnvs"],reference,True)
     else:
         givensomaticsnvslist = ''
     if "givensomaticindels" in parameters:
-        givensomaticindelslist = readingiven(parameters["givensomaticindels"],reference)
+        givensomaticindelslist = readingiven(parameters["givensomaticindels"],reference,True)
     else:
         givensomaticindelslist = ''
     if "givensomaticcnvs" in parameters:
@@ -663,29 +713,41 @@ def main():
 
     #Get germline variants ---------------------------------------------------------------------------------------------------
 
-    #create empty lists/dictionarys
-    germlinevariants=[[],{},{},{},{}]  #variants-0, haplotypes-1, dict of SNV positions-2, dict of CNV breakpoints-3, list and dict of deleted regions-4
-
-    #get starting chromosome haplotypes
-    for chro in gen:
-        germlinevariants[1][chro]=['A','B']
-    #add empty keys for each haplotype in each list
-        for hap in germlinevariants[1][chro]:
-            for l in [2,3]:
-                germlinevariants[l][chro+hap]=[]
-            for l in [4]:
-                germlinevariants[l][chro+hap]=[[],{}] #create list of list and dictionary for deleted regions
-    #get variants
-    vartypelist=['cnvrep']*parameters['cnvrepgermline']+['cnvdel']*parameters['cnvdelgermline']+['indel']*indgernum+['snv']*snvgernum
-    if len(vartypelist)!=0:
-        vartypelist=shufflelist(vartypelist)
-    for vartype in vartypelist:
-        if vartype == 'cnvrep' or vartype == 'cnvdel':
-            germlinevariants,givengermlinecnvslist=getcnv(gen,germlinevariants,vartype,'germline',parameters['givengermlinecnvsproportion'],givengermlinecnvslist)
-        elif vartype == 'indel':
-            germlinevariants,dbindels,givengermlineindelslist=getind(gen,germlinevariants,dbindels,parameters['dbsnpindelproportion'],parameters['givengermlineindelsproportion'],givengermlineindelslist,'germline')
-        elif vartype == 'snv':
-            germlinevariants,dbsnvs,givengermlinesnvslist=getsnv(gen,germlinevariants,dbsnvs,parameters['dbsnpsnvproportion'],parameters['givengermlinesnvsproportion'],givengermlinesnvslist,'germline')
+    if "germline" in parameters:
+        #reuse germline variants from a previous run, checking they were made with the same reference and version
+        germlinevariants=heterogenesis_cache.readcache(parameters['cache'],'germline-'+parameters['germline']+'.pkl')
+        if germlinevariants==None:
+            error('Germline variants with key '+parameters['germline']+' not found in cache.')
+        if heterogenesis_cache.variantskey(parameters['reference'],germlinevariants)!=parameters['germline'] or sorted(germlinevariants[1].keys())!=sorted(gen.keys()):
+            error('Cached germline variants were made with a different reference genome, chromosomes or version.')
+    else:
+        #create empty lists/dictionarys
+        germlinevariants=[[],{},{},{},{}]  #variants-0, haplotypes-1, dict of SNV positions-2, dict of CNV breakpoints-3, list and dict of deleted regions-4
+
+        #get starting chromosome haplotypes
+        for chro in gen:
+            germlinevariants[1][chro]=['A','B']
+        #add empty keys for each haplotype in each list
+            for hap in germlinevariants[1][chro]:
+                for l in [2,3]:
+                    germlinevariants[l][chro+hap]=[]
+                for l in [4]:
+                    germlinevariants[l][chro+hap]=[[],{}] #create list of list and dictionary for deleted regions
+        #get variants
+        vartypelist=['cnvrep']*parameters['cnvrepgermline']+['cnvdel']*parameters['cnvdelgermline']+['indel']*indgernum+['snv']*snvgernum
+        if len(vartypelist)!=0:
+            vartypelist=shufflelist(vartypelist)
+        for vartype in vartypelist:
+            if vartype == 'cnvrep' or vartype == 'cnvdel':
+                germlinevariants,givengermlinecnvslist=getcnv(gen,germlinevariants,vartype,'germline',parameters['givengermlinecnvsproportion'],givengermlinecnvslist)
+            elif vartype == 'indel':
+                germlinevariants,dbindels,givengermlineindelslist=getind(gen,germlinevariants,dbindels,parameters['dbsnpindelproportion'],parameters['givengermlineindelsproportion'],givengermlineindelslist,'germline')
+            elif vartype == 'snv':
+                germlinevariants,dbsnvs,givengermlinesnvslist=getsnv(gen,germlinevariants,dbsnvs,parameters['dbsnpsnvproportion'],parameters['givengermlinesnvsproportion'],givengermlinesnvslist,'germline')
+        if parameters['cache']!='':
+            key=heterogenesis_cache.variantskey(parameters['reference'],germlinevariants)
+            heterogenesis_cache.writecache(parameters['cache'],'germline-'+key+'.pkl',germlinevariants)
+            info('Germline variants saved to cache with key '+key+'. Add "germline":"'+key+'" to the parameters file to reuse them.')
 
     #Get somatic variants ---------------------------------------------------------------------------------------------------
 
@@ -763,6 +825,10 @@ def main():
     #Write variant files------------------------------------------------------------------------------------------------------------
     variants['germline']=germlinevariants[:]
     clones['germline']=''
+    if results!=None:
+        results.update(variants)
+    if not write:
+        return
     writevariantfile(parameters['directory'],parameters['prefix'],germlinevariants,'germline')
     for clo in clones:
         writevariantfile(parameters['directory'],parameters['prefix'],variants[clo],clo)
@@ -770,6 +836,24 @@ def main():
 
     with open(parameters['directory'] + '/' + parameters['prefix'] + 'variants.json','w+') as file:
         json.dump(variants, file, indent=1)
+    #index of the chromosomes (in the order of the reference genome), as used by freqcalc to find per chromosome files, and of the haplotypes
+    #of each clone, as used by heterogenesis_run to find fasta files. With -s also write the variants of each chromosome to their own file,
+    #so heterogenesis_varincorp -x only reads the variants it needs
+    index={'chromosomes':list(gen),'haplotypes':dict([(clo,dict([(chro,variants[clo][1][chro]) for chro in gen])) for clo in variants])}
+    if args.split:
+        shards=dict([(chro,dict([(clo,[[],{chro:variants[clo][1][chro]}]) for clo in variants])) for chro in gen])
+        for clo in variants:
+            for var in variants[clo][0]:
+                if var[1] in shards:    #(whole genome duplications, on chromosome 'all', are already in the haplotypes of each chromosome)
+                    shards[var[1]][clo][0].append(var)
+        index['germlinekey']=heterogenesis_cache.variantskey(parameters['reference'],variants['germline'])
+        index['files']={}
+        for chro in gen:
+            index['files'][chro]=parameters['prefix'] + 'variants-' + chro + '.json'
+            with open(parameters['directory'] + '/' + index['files'][chro],'w+') as file:
+                json.dump(shards[chro], file)
+    with open(parameters['directory'] + '/' + parameters['prefix'] + 'variantsindex.json','w+') as file:
+        json.dump(index, file, indent=1)
 
 # If run as main, run main():
 if __name__ == '__main__': main()
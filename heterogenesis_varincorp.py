@@ -22,14 +22,37 @@ from copy import deepcopy
 import os.path
 from sys import stderr, exit
 import datetime
+import time
+import resource
 import inspect
+import multiprocessing
+import threading
+import queue
+import hashlib
+from bisect import bisect_right
+from heapq import merge
+from itertools import groupby
+import heterogenesis_query
+import heterogenesis_bgzf
+import heterogenesis_cache
+import heterogenesis_profile
+import heterogenesis_targets
+import heterogenesis_structure
 
 signal(SIGPIPE, SIG_DFL) # Handle broken pipes
 
 version = {}
 with open(os.path.join(os.path.abspath(os.path.dirname(__file__)), 'version.py')) as f: exec(f.read(), version)
 
-def main():
+workertasks={}  #functions for worker processes to run, set before the pool is started so that forked workers inherit them
+
+def runworkertask(task):
+    return workertasks[task[0]](*task[1])
+
+def main(argv=None,parameters=None,variants=None,reference=None,results=None):
+    #argv is a list of command line options (sys.argv by default). heterogenesis_api passes in parameters, variants and a reference read
+    #in already rather than reading them from files, and a dictionary for results, which is given each clone's profile instead of writing
+    #copy number, vcf and profile files
 
     def warning(msg):
         print('WARNING: {}'.format(msg), file=stderr)
@@ -40,19 +63,32 @@ def main():
 
     parser = argparse.ArgumentParser(description="Create random SNVs, indels and CNVs for each subclone in a tumour sample.")
     parser.add_argument('-v', '--version', action='version', version='%(prog)s {0}'.format(version['__version__']))
-    parser.add_argument('-j', '--json', dest='jsonfile', required=True, type=str, help='Json file with parameters')
-    parser.add_argument('-c', '--clone', dest='clone', required=True, type=str, help='Clone to be processed')
+    parser.add_argument('-j', '--json', dest='jsonfile', required=parameters==None, type=str, help='Json file with parameters')
+    parser.add_argument('-c', '--clone', dest='clone', required=True, type=str, help="Clone to be processed, a comma separated list of clones, or 'all'")
     parser.add_argument('-x', '--chromosome', dest='chromosome', type=str, help='Chromosome to be processed')
+    parser.add_argument('-b', '--blocks', dest='blocks', action='store_true', help='Write a block map file for getting haplotype sequences with heterogenesis_query')
+    parser.add_argument('-n', '--nofasta', dest='nofasta', action='store_true', help='Do not write fasta files (use with -b)')
+    parser.add_argument('-z', '--bgzip', dest='bgzip', action='store_true', help='Write all haplotypes to one bgzip compressed and indexed fasta file')
+    parser.add_argument('-t', '--threads', dest='threads', type=int, default=1, help='Threads to use for compressing with -z and -i')
+    parser.add_argument('-i', '--index', dest='index', action='store_true', help='Write vcf and copy number files bgzip compressed, with tabix indexes')
+    parser.add_argument('-w', '--workers', dest='workers', type=int, default=1, help='Number of processes to use for incorporating variants into haplotypes and writing fasta files')
+    parser.add_argument('-r', '--resume', dest='resume', action='store_true', help='Keep a manifest of complete output files, and skip outputs already completed by an earlier run with the same inputs')
+    parser.add_argument('-V', '--verify', dest='verify', action='store_true', help='With -r, check the checksums of outputs completed by the earlier run, rather than only their sizes and modification times')
+    parser.add_argument('-f', '--profile', dest='profile', action='store_true', help='Also write the copy numbers and variants to a binary profile file, which freqcalc reads instead of the text files')
+    parser.add_argument('-m', '--metrics', dest='metrics', type=str, help='File to append JSON lines of counts, wall time and peak memory for each stage of processing to')
 
-    args = parser.parse_args()
+    args = parser.parse_args(argv)
     clo=args.clone
 
     prochro=args.chromosome
     if prochro==None:
         prochro=''
 
-    with open(args.jsonfile,'r') as file:
-        parameters=json.load(file)
+    if parameters==None:
+        with open(args.jsonfile,'r') as file:
+            parameters=json.load(file)
+    else:
+        parameters=dict(parameters)
 
     #set default parameter values and give error/warning messages
     if "prefix" not in parameters:
@@ -66,6 +102,12 @@ def main():
     if "directory" not in parameters:
         warning('No output directory given, using current directory.')
         parameters['directory']='.'
+    if "cache" not in parameters:
+        parameters['cache']=''
+    if "targets" not in parameters:
+        parameters['targets']='none'
+    if "targetpadding" not in parameters:
+        parameters['targetpadding']=100
     if "chromosomes" not in parameters:
         if str(prochro)=='':
             parameters['chromosomes']='all'
@@ -76,41 +118,105 @@ def main():
             pass
         else:
             parameters['chromosomes']=prochro
+
+    class MEMORYSAMPLER(object):
+        #peak resident memory of each stage of processing, from samples of the process's resident memory (read from /proc, so only on linux)
+        #taken every few milliseconds on a separate thread, and when each stage starts and ends. (The peak kept by the kernel isn't reset for
+        #each stage, as that would also reset the peak of the whole process.) Stages within other stages (eg. 'fasta' within 'clone') are
+        #sampled for both. Worker processes start their own thread, as threads don't survive forking
+        def __init__(self,interval=0.005):
+            self.interval=interval
+            self.pid=None
+            self.pagesize=os.sysconf('SC_PAGE_SIZE')
+        def rss(self):  #resident memory in bytes, or None if it can't be read
+            try:
+                with open('/proc/self/statm','r') as file:
+                    return int(file.read().split()[1])*self.pagesize
+            except (OSError,IndexError,ValueError):
+                return None
+        def run(self):
+            while True:
+                time.sleep(self.interval)
+                self.sample()
+        def sample(self):
+            rss=self.rss()
+            if rss==None:
+                return
+            with self.lock:
+                for started in self.peaks:
+                    self.peaks[started]=max(self.peaks[started],rss)
+        def start(self,started):
+            rss=self.rss()
+            if rss==None:
+                return
+            if self.pid!=os.getpid():
+                self.pid=os.getpid()
+                self.peaks={}
+                self.lock=threading.Lock()
+                threading.Thread(target=self.run,daemon=True).start()
+            with self.lock:
+                self.peaks[started]=rss
+        def stop(self,started): #returns the peak memory in bytes of the stage started at started, or None if it wasn't sampled
+            if self.pid!=os.getpid() or started not in self.peaks:
+                return None
+            self.sample()
+            with self.lock:
+                return self.peaks.pop(started)
+
+    sampler=MEMORYSAMPLER() if args.metrics!=None else None
+
+    def startphase():   #returns the start time of a stage of processing, sampling its memory with -m
+        started=time.perf_counter()
+        if sampler!=None:
+            sampler.start(started)
+        return started
+
+    def recordmetrics(phase,started,**counts):
+        #append a json line with the counts for a stage of processing, its wall time, its peak memory (where it can be measured) and the peak
+        #memory of the process so far (workers append their own lines)
+        if args.metrics==None:
+            return
+        record={'phase':phase,'clone':clo}
+        record.update(counts)
+        record['seconds']=round(time.perf_counter()-started,6)
+        peak=sampler.stop(started)
+        if peak!=None:
+            record['maxrssmb']=round(peak/1024**2,1)
+        record.update({'processmaxrssmb':round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss/1024,1),'pid':os.getpid()})
+        with open(args.metrics,'a') as file:
+            file.write(json.dumps(record)+'\n')
+
     #Functions for reading in data----------------------------------------------------------------------------------
 
-    def readinfai(chromosomes,fai,referencefile): #reads in reference and fai files for required chromosomes into dictionaries
-        if chromosomes==['all']:
-            keepchromos=['chr1','chr2','chr3','chr4','chr5','chr6','chr7','chr8','chr9','chr10','chr11','chr12','chr13','chr14','chr15','chr16','chr17','chr18','chr19','chr20','chr21','chr22']
-        else:
-            keepchromos=chromosomes
-        with open(fai,'r') as geno:
-                gen = dict([(line.strip().split("\t")[0], float(line.strip().split("\t")[1])) for line in geno])
-        genkeys=list(gen.keys())
-        for chro in genkeys:
-            if chro not in (keepchromos):
-                del gen[chro]
-        reference={}
-        reflist=[]
-        chromo=''
-        with open(referencefile,'r') as ref:
-            for l in ref:
-                if l.startswith('>'):
-                    if chromo!='': reference[chromo]=''.join(reflist)
-                    reflist=[]
-                    chromo=l.strip().split(" ")[0][1:]
-                    reference[l.strip().split(" ")[0]]=''
-                else:
-                    reflist.append(l.strip())
-            reference[chromo]=''.join(reflist)
-        reflist=''
-        for chro in list(reference.keys()):
-            if chro not in (keepchromos): del reference[chro]
+    def readinfai(chromosomes,fai,referencefile,loaded=None): #reads in reference and fai files for required chromosomes into dictionaries, or uses a reference already read in
+        keepchromos=heterogenesis_query.chromosomelist(chromosomes)
+        faidx=heterogenesis_query.readfai(fai)
+        gen=dict([(chro,faidx[chro][0]) for chro in faidx if chro in keepchromos])
+        if loaded!=None:
+            return(gen,loaded)
+        reference=PREFETCHEDREFERENCE(referencefile,faidx,list(gen.keys()))
         return(gen,reference)
 
-    def readinvars(parameters):    #formats structure parameter into dictionary
+    def readinparents(parameters,variants):    #gets parent of each clone from structure parameter, if the clone's variants start with its parent's
+        if "structure" not in parameters:
+            parameters['structure']=heterogenesis_structure.DEFAULTSTRUCTURE
+        parents={}
+        for c,(distance,p) in heterogenesis_structure.readstructure(parameters['structure']).items():
+            if c in variants and p in variants and variants[c][0][:len(variants[p][0])]==variants[p][0]:
+                parents[c]=p
+        return parents
+
+    def readinvars(parameters,chro):    #reads in variants file, or only the variants of chro if heterogenesis_vargen wrote a file for each chromosome
+        indexfile=parameters['directory'] + '/' + parameters['prefix'] + 'variantsindex.json'
+        if chro!='' and os.path.exists(indexfile):
+            with open(indexfile,'r') as file:
+                index=json.load(file)
+            if chro in index.get('files',{}):   #(written by heterogenesis_vargen -s)
+                with open(parameters['directory'] + '/' + index['files'][chro],'r') as file:
+                    return json.load(file),index['germlinekey']
         with open(parameters['directory'] + '/' + parameters['prefix'] + 'variants.json','r') as file:
                 variants=json.load(file)
-        return variants
+        return variants,None
 
     #Functions for writing output files--------------------------------------------------------------------------------
 
@@ -122,23 +228,34 @@ def main():
                     for b in modchros[chro][hap].allblocks:
                         file.write(str(b)+'\n')
 
-    def writecnvfile(directory,prefix,clo,combcnvs,combcnvsa,combcnvsb,prochro):
-        with open(directory + '/' + prefix + clo + prochro + 'cnv.txt','w+') as file:
+    def writeblockmap(directory,prefix,clo,hapvars,modchros,prochro):
+        #binary version of writeblocksfile, for getting sequence from haplotypes without writing fasta files
+        haplotypes={}
+        for chro in hapvars:
+            for hap in hapvars[chro]:
+                haplotypes[clo+'_'+chro+'_'+hap]=[chro,modchros[chro][hap].itersegments()]
+        heterogenesis_query.writeblockmap(directory + '/' + prefix + clo + prochro + 'blocks.bin',parameters['reference'],haplotypes)
+
+    def allelecnvs(combcnvs,combcnvsa,combcnvsb,chro):
+        #yield (start, end, copy number, A allele, B allele) of each combined cnv (or with targets, each part of it within targets). All three lists are sorted and non-overlapping, so walk the A and B lists alongside the combined list
+        a=0
+        bb=0
+        for b in combcnvs:
+            while combcnvsa[a].end < b.end: a+=1
+            while combcnvsb[bb].end < b.end: bb+=1
+            for start,end in ([(b.start,b.end)] if targets==None else targets.clip(chro,b.start,b.end)):
+                yield start,end,b.content,combcnvsa[a].content,combcnvsb[bb].content
+
+    #vcf and copy number files are sorted by position within each chromosome, and with compress are bgzip compressed with tabix indexes
+    def writecnvfile(directory,prefix,clo,combcnvs,combcnvsa,combcnvsb,prochro,compress=False,threads=1):
+        with heterogenesis_bgzf.TABLEWRITER(directory + '/' + prefix + clo + prochro + 'cnv.txt',compress,threads,skip=1) as file:
             file.write('Chromosome\tStart\tEnd\tCopy Number\tA Allele\tB Allele\n')
             for chro in combcnvs:
-                for b in combcnvs[chro]:
-                    for bb in combcnvsa[chro]:
-                        if bb.includes(b):
-                            acnv=bb.content
-                            break
-                    for bb in combcnvsb[chro]:
-                        if bb.includes(b):
-                            bcnv=bb.content
-                            break
-                    file.write(chro+'\t'+str(b.start)+'\t'+str(int(b.end))+'\t'+str(b.content)+'\t'+str(acnv)+'\t'+str(bcnv)+'\n')
-
-    def writevcffile(directory,prefix,clo,combvcfs,prochro):
-        with open(directory + '/' + prefix + clo + prochro + '.vcf','w+') as file:
+                for start,end,content,aallele,ballele in allelecnvs(combcnvs[chro],combcnvsa[chro],combcnvsb[chro],chro):
+                    file.writerecord(chro+'\t'+str(start)+'\t'+str(end)+'\t'+str(content)+'\t'+str(aallele)+'\t'+str(ballele)+'\n',chro,start-1,end)
+
+    def writevcffile(directory,prefix,clo,combvcfs,prochro,compress=False,threads=1):
+        with heterogenesis_bgzf.TABLEWRITER(directory + '/' + prefix + clo + prochro + '.vcf',compress,threads,format=2,colend=0) as file:
             file.write('##fileformat=VCFv4.2\n')
             file.write('##fileDate='+str(datetime.datetime.today().strftime('%Y%m%d'))+'\n')
             file.write('##source=heterogenesis_varincorp-'+clo+'\n')
@@ -151,11 +268,22 @@ def main():
             file.write('##FORMAT=<ID=CN,Number=2,Type=Integer,Description="Copy number at position">\n')
             file.write('#CHROM\tPOS\tID\tREF\tALT\tQUAL\tFILTER\tINFO\tFORMAT\t'+clo+'\n')
             for chro in combvcfs:
-                for v in combvcfs[chro]:
+                for v in sorted(combvcfs[chro]):    #(combvcfs are keyed by position)
                     #write: chromosome, position, ., ref base, alternate base, ., ., 1, FORMAT,frequency, total copies, haplotypes, copies per haplotype, copynumber at position
                     haplotypes=','.join([h[0] for h in combvcfs[chro][v][5]])
                     counts=','.join([str(h[1]) for h in combvcfs[chro][v][5]])
-                    file.write(chro+'\t'+str(combvcfs[chro][v][0])+'\t.\t'+str(combvcfs[chro][v][1])+'\t'+str(combvcfs[chro][v][2])+'\t.\t.\tNS=1\tAF:TC:HS:HC:CN\t'+str(combvcfs[chro][v][3])+':'+str(combvcfs[chro][v][4])+':'+haplotypes+':'+counts+':'+str(combvcfs[chro][v][6])+'\n')
+                    file.writerecord(chro+'\t'+str(combvcfs[chro][v][0])+'\t.\t'+str(combvcfs[chro][v][1])+'\t'+str(combvcfs[chro][v][2])+'\t.\t.\tNS=1\tAF:TC:HS:HC:CN\t'+str(combvcfs[chro][v][3])+':'+str(combvcfs[chro][v][4])+':'+haplotypes+':'+counts+':'+str(combvcfs[chro][v][6])+'\n',chro,combvcfs[chro][v][0]-1,combvcfs[chro][v][0]-1+len(combvcfs[chro][v][1]))
+
+    def profilechromosomes(combcnvs,combcnvsa,combcnvsb,combvcfs):
+        #copy numbers and variants of each chromosome, as (start, end, copy number, A allele, B allele) and (position, ref, alt, total copies, haplotypes, copy number)
+        chromosomes={}
+        for chro in combcnvs:
+            chromosomes[chro]=[list(allelecnvs(combcnvs[chro],combcnvsa[chro],combcnvsb[chro],chro)),[(combvcfs[chro][v][0],combvcfs[chro][v][1],combvcfs[chro][v][2],combvcfs[chro][v][4],combvcfs[chro][v][5],combvcfs[chro][v][6]) for v in sorted(combvcfs[chro])]]
+        return chromosomes
+
+    def writeprofile(directory,prefix,clo,combcnvs,combcnvsa,combcnvsb,combvcfs,prochro):
+        #binary version of the cnv and vcf files, for freqcalc
+        heterogenesis_profile.writeprofile(directory + '/' + prefix + clo + prochro + 'profile.bin',parameters['reference'],clo,profilechromosomes(combcnvs,combcnvsa,combcnvsb,combvcfs))
 
     #Functions for generating output file data-------------------------------------------------------------------------------------
 
@@ -192,12 +320,15 @@ def main():
     #             var,blocksfraction=findblockend(var,blocksfraction)
     #     return var,blocksfraction
 
+    #BLOCK, VCFVAR and CNVBRANCH use __slots__ as there can be millions of them, and are copied with their copy methods instead of deepcopy
     class BLOCK(object):
+        __slots__=('start','end','content','flag')
         def __init__(self, start, end, content,flag):
             self.start = start
             self.end = end
             self.content=content
             self.flag=flag
+        def copy(self): return BLOCK(self.start,self.end,self.content,self.flag)   #content is a string or integer, so isn't shared
         def includes(self, other):  #self completely includes other
             if (other.start >= self.start) and (other.end <= self.end): return True
             return False
@@ -209,6 +340,7 @@ def main():
         def __str__(self): return('BLOCK: {}-{}, {}, {}'.format(self.start, self.end, self.content, self.flag))
 
     class VCFVAR(object):
+        __slots__=('pos','ref','alt','branches','final','haplo')
         def __init__(self, pos, ref, alt, branches,final,haplo):
             self.pos = pos
             self.ref = ref
@@ -216,21 +348,116 @@ def main():
             self.branches = branches
             self.final = final
             self.haplo = haplo
+        def copy(self): return VCFVAR(self.pos,self.ref,self.alt,copybranches(self.branches),self.final,self.haplo)
         def incnv(self,cnv):
             if (cnv.start <= self.pos) and (cnv.end >= self.pos): return True
             return False
         def __str__(self): return('VCF: {}, {}, {}, {}, {}'.format(self.pos, self.ref, self.alt, self.branches, self.final, self.haplo))
 
     class CNVBRANCH(object):
+        __slots__=('start','end','content')
         def __init__(self, start, end, content):
             self.start = start
             self.end = end
             self.content = content
+        def copy(self): return CNVBRANCH(self.start,self.end,self.content if self.content=='var' else copybranches(self.content))
         def withincnv(self,cnv):
             if (cnv.start <= self.start) and (cnv.end >= self.end): return True
             return False
         def __str__(self): return('{}, {}, {}'.format(self.start, self.end, self.content))
 
+    def copybranches(branches):
+        return [b.copy() for b in branches] if branches!=None else None
+
+    complement=bytes.maketrans(b'ATCGatcgNnRYryKMkmBVbvDHdhSsWw',b'TAGCtagcNnYRyrMKmkVBvbHDhdSsWw')  #translation table for reverse complementing inverted sequence
+
+    class PREFETCHEDREFERENCE(object):
+        #reference sequences, read in one chromosome at a time on a separate thread so that variants can be incorporated while the reference is read.
+        #Getting a chromosome's sequence waits until it has been read
+        def __init__(self,referencefile,faidx,chromosomes):
+            self.sequences={}
+            self.ready=dict([(chro,threading.Event()) for chro in chromosomes])
+            self.error=None
+            self.thread=threading.Thread(target=self.read,args=(referencefile,faidx,chromosomes),daemon=True)
+            self.thread.start()
+        def read(self,referencefile,faidx,chromosomes):
+            try:
+                with open(referencefile,'rb') as ref:    #sequences are kept as bytes for writing genome sequences
+                    for chro in chromosomes:    #read only the required chromosomes, using their positions in the fai index
+                        length,offset,linebases,linewidth=faidx[chro]
+                        ref.seek(offset)
+                        self.sequences[chro]=ref.read((length//linebases)*linewidth+length%linebases).replace(b'\n',b'').replace(b'\r',b'')
+                        self.ready[chro].set()
+            except Exception as e:
+                self.error=e
+                for chro in chromosomes:
+                    self.ready[chro].set()
+        def __getitem__(self,chro):
+            self.ready[chro].wait()
+            if self.error!=None:
+                raise self.error
+            return self.sequences[chro]
+        def wait(self): #wait for all chromosomes, eg. before forking processes
+            self.thread.join()
+            if self.error!=None:
+                raise self.error
+
+    class BACKGROUNDWRITER(object):
+        #writes to files on a separate thread, so the next part of a sequence can be rendered while the last is written.
+        #Functions put on the queue (writes, closing files and recording them in the manifest) are run in order. The queue is bounded to cap memory use
+        def __init__(self,maxsize=16):
+            self.queue=queue.Queue(maxsize)
+            self.error=None
+            self.thread=threading.Thread(target=self.run,daemon=True)
+            self.thread.start()
+        def run(self):
+            while True:
+                item=self.queue.get()
+                if item==None:
+                    break
+                function,args=item
+                if self.error==None:
+                    try:
+                        function(*args)
+                    except Exception as e:
+                        self.error=e
+        def put(self,function,*args):
+            if self.error!=None:
+                raise self.error
+            self.queue.put((function,args))
+        def close(self):    #wait for everything to be written
+            self.queue.put(None)
+            self.thread.join()
+            if self.error!=None:
+                raise self.error
+
+    class OUTPUTFILE(object):
+        #file object that counts bytes written, optionally keeping a checksum of them, and passes writes to a BACKGROUNDWRITER if one is given
+        def __init__(self,file,writer=None,checksum=False):
+            self.file=file
+            self.writer=writer
+            self.checksum=hashlib.sha256() if checksum else None
+            self.written=0
+        def write(self,data):
+            if self.writer!=None:
+                self.writer.put(self.file.write,data)
+            else:
+                self.file.write(data)
+            if self.checksum!=None:
+                self.checksum.update(data)
+            self.written+=len(data)
+        def tell(self):
+            return self.written
+        def close(self):
+            if self.writer!=None:
+                self.writer.put(self.file.close)
+            else:
+                self.file.close()
+        def __enter__(self):
+            return self
+        def __exit__(self,*args):
+            self.close()
+
     class MODCHRO(object):
         def __init__(self,chromosome,allblocks,cnblocks,vcfcounts):
             self.chromosome=chromosome
@@ -238,73 +465,111 @@ def main():
             self.cnblocks=cnblocks
             self.vcfcounts=vcfcounts
         def getbasestring(self,ref):
+            return b''.join(self.iterbasestring())
 
-            def invert(forward):
-                reverse=[]
-                substitutions={}
-                substitutions['A']='T'
-                substitutions['T']='A'
-                substitutions['C']='G'
-                substitutions['G']='C'
-                substitutions['a']='t'
-                substitutions['t']='a'
-                substitutions['c']='g'
-                substitutions['g']='c'
-                substitutions['N']='N'
-                substitutions['n']='n'
-                substitutions['R']='Y'
-                substitutions['Y']='R'
-                substitutions['y']='r'
-                substitutions['r']='y'
-                substitutions['S']='S'
-                substitutions['s']='s'
-                substitutions['W']='W'
-                substitutions['w']='w'
-                substitutions['K']='M'
-                substitutions['M']='K'
-                substitutions['k']='m'
-                substitutions['m']='k'
-                substitutions['B']='V'
-                substitutions['V']='B'
-                substitutions['b']='v'
-                substitutions['v']='b'
-       	       	substitutions['D']='H'
-       	       	substitutions['H']='D'
-       	       	substitutions['d']='h'
-       	       	substitutions['h']='d'
-                for i in forward[::-1]:
-                    reverse.append(substitutions[i])
-                return reverse
-
-            basestring=[[]]
-            for b in self.allblocks:
+        def getinversions(self):
+            #match inversion start and end flags, giving a dictionary of start block index : end block index
+            ends={}
+            starts=[]
+            for i,b in enumerate(self.allblocks):
                 if b.flag=='s':
-                    basestring.append([])
-                    if b.content=='ref':
-                        basestring[-1].extend(reference[self.chromosome][int(b.start)-1:int(b.end)])    #b.start and b.end sometimes get .0 on end so need to be converted to int
-                    else:
-                        basestring[-1].extend(b.content)
-                elif b.flag=='e':
-                    if b.content=='ref':
-                        basestring[-1].extend(reference[self.chromosome][int(b.start)-1:int(b.end)])    #b.start and b.end sometimes get .0 on end so need to be converted to int
-                    else:
-                        basestring[-1].extend(b.content)
-                    basestring[-2].extend(invert(basestring[-1]))
-                    basestring=basestring[:-1]
+                    starts.append(i)
                 elif b.flag=='se':
-                    basestring.append([])
-                    if b.content=='ref':
-                        basestring[-1].extend(reference[self.chromosome][int(b.start)-1:int(b.end)])    #b.start and b.end sometimes get .0 on end so need to be converted to int
+                    ends[i]=i
+                elif b.flag=='e' and starts!=[]:
+                    ends[starts.pop()]=i
+            for i in starts:    #close any inversions left open at the end of the chromosome
+                ends[i]=len(self.allblocks)-1
+            return ends
+
+        def iterblocks(self):
+            #yield (block, inverted) for each block in the order its sequence appears in the haplotype
+            #inverted regions are walked from their last block to their first, instead of being held until the end flag
+            ends=self.getinversions()
+
+            def pieces(lo,hi):  #single blocks (end index None) and inverted regions between block indices lo and hi
+                k=lo
+                while k<=hi:
+                    if k in ends:
+                        yield k,ends[k]
+                        k=ends[k]+1
                     else:
-                        basestring[-1].extend(b.content)
-                    basestring[-2].extend(invert(basestring[-1]))
-                    basestring=basestring[:-1]
-                else:
-                    if b.content=='ref':
-                        basestring[-1].extend(reference[self.chromosome][int(b.start)-1:int(b.end)])    #b.start and b.end sometimes get .0 on end so need to be converted to int
+                        yield k,None
+                        k+=1
+
+            def render(parts,inverted):
+                if inverted:
+                    parts=list(parts)[::-1]
+                for a,b in parts:
+                    if b is None:
+                        yield self.allblocks[a],inverted
+                    else:   #an inverted region is its start block followed by everything up to its end block, in the opposite direction
+                        yield from render([(a,None)]+list(pieces(a+1,b)),not inverted)
+
+            yield from render(pieces(0,len(self.allblocks)-1),False)
+
+        def iterbasestring(self,window=1048576):
+            #yield the sequence in chunks of at most window bases, so the whole haplotype never has to be held in memory
+            refseq=reference[self.chromosome]
+            for b,inverted in self.iterblocks():
+                if b.content=='ref':
+                    start=b.start-1
+                    end=b.end
+                    if inverted:    #reverse complement each piece, starting from the end of the block
+                        for i in range(end,start,-window):
+                            yield refseq[max(start,i-window):i].translate(complement)[::-1]
                     else:
-                        basestring[-1].extend(b.content)
-            return basestring[-1]
+                        for i in range(start,end,window):
+                            yield refseq[i:min(end,i+window)]
+                elif inverted:
+                    yield b.content.encode().translate(complement)[::-1]
+                else:
+                    yield b.content.encode()
+
+        def itertargetstrings(self,window=1048576):
+            #yield (stretch number, reference position of its first base, chunk of sequence) for each stretch of the haplotype within targets,
+            #in output order. A stretch ends wherever the haplotype leaves the targets, so sequence from separate targets is never joined
+            refseq=reference[self.chromosome]
+            n=0
+            first=None
+            joined=False    #whether the next block continues the current stretch
+            for b,inverted in self.iterblocks():
+                if b.content=='ref':
+                    end=min(b.end,len(refseq))
+                    parts=targets.clip(self.chromosome,b.start,end)
+                    entry,leave=(end,b.start) if inverted else (b.start,end)
+                    if inverted:    #(parts are given as their first and last base in output order)
+                        parts=[(e,s) for s,e in parts[::-1]]
+                    for i,(s,e) in enumerate(parts):
+                        if not joined or i>0 or s!=entry:
+                            n+=1
+                            first=s
+                        if inverted:
+                            for j in range(s,e-1,-window):
+                                yield n,first,refseq[max(e,j-window+1)-1:j].translate(complement)[::-1]
+                        else:
+                            for j in range(s,e+1,window):
+                                yield n,first,refseq[j-1:min(e,j+window-1)]
+                        joined=True
+                    joined=parts!=[] and parts[-1][1]==leave
+                elif targets.overlaps(self.chromosome,b.start,b.end):
+                    if not joined:
+                        n+=1
+                        first=b.start
+                    yield n,first,b.content.encode().translate(complement)[::-1] if inverted else b.content.encode()
+                    joined=True
+                else:
+                    joined=False
+
+        def itersegments(self):
+            #yield (reference start, reference end, alternate sequence or None, inverted) for each block in output order, for block map files
+            for b,inverted in self.iterblocks():
+                if b.content=='ref':
+                    end=min(b.end,len(reference[self.chromosome]))
+                    if end>=b.start:
+                        yield b.start,end,None,inverted
+                else:
+                    yield b.start,b.end,b.content.encode(),inverted
 
         def __str__(self): return('MODCHRO from {}: {} allblocks, {} cnblocks'.format(self.chromosome, len(self.allblocks), len(self.cnblocks)))
 
@@ -358,7 +623,7 @@ def main():
                             elif copy!=[]: #if there are blocks recorded to copy
                                 if var.content!=0:
                                     for o in var.flag[::-1]: #for direction of each copy in reverse order
-                                        insert=deepcopy(copy)
+                                        insert=[b.copy() for b in copy]
                                         if o==1:
                                             insert[0].flag='s' #start flag
                                             insert[-1].flag='e' #end flag
@@ -377,7 +642,7 @@ def main():
         def updatevcf(self,var):
             #if var is a vcfvar (ie. snp or indel) then add to modchro vcfcounts list
             if type(var)==VCFVAR:
-                self.vcfcounts.append(deepcopy(var))
+                self.vcfcounts.append(var.copy())
             #if var is a cnv then adjust numbers of copies of snvs/indels that are located within it
             elif type(var)==BLOCK:
                 for v in self.vcfcounts:    #for each VCFVAR object in MODCHRO.vcfcounts
@@ -391,10 +656,10 @@ def main():
         if level==[]:   #if copy has been deleted
             return level    #do nothing
         elif level[0].withincnv(var):
-            level=[CNVBRANCH(var.start,var.end,deepcopy(level)) for i in range(0,var.content)] #insert new level. need to create new instances of object instead of just copying pointer to the existing instance
+            level=[CNVBRANCH(var.start,var.end,copybranches(level)) for i in range(0,var.content)] #insert new level. need to create new instances of object instead of just copying pointer to the existing instance
             return level
         else:
-            level[0].content=adjustbranches(deepcopy(level[0].content),var)  #go to next level down
+            level[0].content=adjustbranches(copybranches(level[0].content),var)  #go to next level down
         return level
 
     def splitblocks(blocks,spblock,newblock):
@@ -433,14 +698,14 @@ def main():
                 newblock.flag='s'
                 rightblock.flag='e'
             idx=blocks.index(spblock)
-            blocks[idx:idx+1]=deepcopy([newblock,rightblock])
+            blocks[idx:idx+1]=[b.copy() for b in [newblock,rightblock]]
         elif spblock.end==newblock.end:  #if newblock ends on same base as existing, don't include rightblock
             if spblock.flag=='e':newblock.flag='e'
             if spblock.flag=='se':
                 leftblock.flag='s'
                 newblock.flag='e'
             idx=blocks.index(spblock)
-            blocks[idx:idx+1]=deepcopy([leftblock,newblock])
+            blocks[idx:idx+1]=[b.copy() for b in [leftblock,newblock]]
         else:
             if spblock.flag=='s':leftblock.flag='s'
             if spblock.flag=='e':rightblock.flag='e'
@@ -448,10 +713,10 @@ def main():
                 leftblock.flag='s'
                 rightblock.flag='e'
             idx=blocks.index(spblock)
-            blocks[idx:idx+1]=deepcopy([leftblock,newblock,rightblock])
+            blocks[idx:idx+1]=[b.copy() for b in [leftblock,newblock,rightblock]]
         return blocks
 
-    def combinecnvs(modchro,gen):
+    def combinecnvs(modchro,gen,chro):
         #put all cnv blocks into one list
         #start with empty block to fill in regions that have been deleted in all copies of a chromosome
         allcnvs=[BLOCK(1,gen[chro],0,'')]
@@ -494,7 +759,7 @@ def main():
             outs[p]=sorted(outs[p],key=getstart)
         return combined,combineda,combinedb
 
-    def combinevcfs(modchro,combcnvs):
+    def combinevcfs(modchro,combcnvs,chro):
         #put all vars in dictionaries referenced by position
         allvcfs={}
         for hap in modchro:
@@ -510,18 +775,17 @@ def main():
                 else:
                     combined[v][5].append([allvcfs[hap][v].haplo,allvcfs[hap][v].final])
         #Fill in the missing data
+        cnvstarts=[cnv.start for cnv in combcnvs]   #combcnvs is sorted and non-overlapping so can be searched by start position
         needtodel=[]
         for v in combined:
             #get total number of variant copies
             total=sum([i[1] for i in combined[v][5]])
-            if total==0:
+            if total==0 or (targets!=None and not targets.overlaps(chro,combined[v][0],combined[v][0]+len(combined[v][1])-1)):   #(with targets, only variants within them are kept)
                 needtodel.append(v)
             else:
                 combined[v][4]=total
-                #get copy number
-                for cnv in combcnvs:
-                    if VCFVAR(combined[v][0],'','','','','').incnv(cnv):
-                        cn=cnv.content
+                #get copy number from the last cnv block starting at or before the variant
+                cn=combcnvs[bisect_right(cnvstarts,combined[v][0])-1].content
                 combined[v][6]=cn
                 #get frequencies
                 combined[v][3]=round(total/cn,5)
@@ -529,32 +793,73 @@ def main():
             del combined[v]
         return combined
 
-    def writebasestringtofile(parameters,clo,chro,hap,basestring):
-        with open(parameters['directory'] + '/' + parameters['prefix'] + clo+chro+hap+'.fasta','w') as file:
-            count=0
-            file.write('>'+clo+'_'+chro+'_'+hap+'\n')
-            for x in basestring:
-                if count==80:   #write 80 bases per line
-                    file.write('\n')
-                    count=0
-                file.write(x)
-                count+=1
-            file.write('\n')
-
-    def createhapvars(clones,gen,variants):
-    #create lists of variants by haplotype
+    def writefasta(file,basestring):
+        #basestring is an iterable of sequence chunks, which are written 80 bases per line as they arrive. Returns the sequence length
+        carry=b''
+        written=0
+        for chunk in basestring:
+            chunk=carry+chunk
+            full=len(chunk)-len(chunk)%80
+            if full:
+                file.write(b'\n'.join([chunk[j:j+80] for j in range(0,full,80)])+b'\n')
+                written+=full
+            carry=chunk[full:]
+        if carry or written==0:
+            file.write(carry+b'\n')
+        return written+len(carry)
+
+    def fastaname(parameters,clo,chro,hap):
+        return parameters['prefix'] + clo+chro+hap+'.fasta'
+
+    def haprecords(clo,chro,hap,modchro):
+        #(name, sequence chunks) of each fasta record of a haplotype: the whole haplotype, or with targets each stretch of it within targets,
+        #named by its number and the reference position it starts from
+        name=clo+'_'+chro+'_'+hap
+        if targets==None:
+            yield name,modchro.iterbasestring()
+        else:
+            for (n,first),chunks in groupby(modchro.itertargetstrings(),key=lambda c:(c[0],c[1])):
+                yield name+'_'+str(n)+' '+chro+':'+str(first),(c[2] for c in chunks)
+
+    def writebasestringtofile(parameters,clo,chro,hap,records,writer=None,checksum=False):
+        #returns the file name, bytes written and checksum (if wanted). If a BACKGROUNDWRITER is given, the file is written by its thread and may still be open on returning
+        with OUTPUTFILE(open(parameters['directory'] + '/' + fastaname(parameters,clo,chro,hap),'wb'),writer,checksum) as file:
+            for name,basestring in records:
+                file.write(('>'+name+'\n').encode())
+                writefasta(file,basestring)
+        return fastaname(parameters,clo,chro,hap),file.tell(),file.checksum.hexdigest() if checksum else None
+
+    def writebgzipfasta(parameters,clo,hapvars,modchros,prochro,threads):
+        #write all haplotypes of the clone to one bgzip compressed fasta, with .fai and .gzi indexes as from samtools faidx
+        filename=parameters['directory'] + '/' + parameters['prefix'] + clo + prochro + '.fasta.gz'
+        with heterogenesis_bgzf.BGZFWRITER(filename,threads=threads,gzi=True) as file, open(filename+'.fai','w') as fai:
+            for chro in hapvars:
+                for hap in hapvars[chro]:
+                    for name,basestring in haprecords(clo,chro,hap,modchros[chro][hap]):
+                        file.write(('>'+name+'\n').encode())
+                        offset=file.tell()
+                        length=writefasta(file,basestring)
+                        fai.write(name.split(' ')[0]+'\t'+str(length)+'\t'+str(offset)+'\t80\t81\n')
+                    print(str(datetime.datetime.now())+' : Written fasta sequence for '+chro+hap)
+
+    def createhapvars(clo,gen,variants,start=0):
+    #create lists of variants by haplotype, leaving out the first start variants (when they are already incorporated)
+        #group variants by chromosome and haplotype in one pass, keeping their position in the variants list
+        grouped={}
+        for i,var in enumerate(variants[clo][0]):
+            if var[1] in gen and i>=start:
+                grouped.setdefault(var[1],{}).setdefault(var[2],[]).append((i,var))
         hapvars={}
         for chro in gen:
             hapvars[chro]={}
             for hap in variants[clo][1][chro]:
-                hapvars[chro][hap]=[]
-                for var in variants[clo][0]:
-                    if var[1]==chro:
-                        if var[2] in hap:   #if variant haplotype is parent chromosome of or equals the current haplotype, then add var to list
-                            hapvars[chro][hap].append(var)
+                #haplotypes from aneuploid events are named after their parent (eg. A-2-1 comes from A-2, which comes from A), so include the variants of each parent haplotype as well
+                parts=hap.split('-')
+                lineage=['-'.join(parts[:i]) for i in range(1,len(parts)+1)]
+                hapvars[chro][hap]=[var for i,var in merge(*[grouped.get(chro,{}).get(h,[]) for h in lineage])]   #merge keeps the original order of variants
         return hapvars
 
-    def createmodchros(clones,gen,variants):
+    def createmodchros(clo,gen,variants):
     #create starting modchros
         modchros={}
         for chro in gen:
@@ -564,66 +869,321 @@ def main():
         return modchros
 
 
+    def startfromparent(modchros,parentmodchros):
+        #copy the parent clone's haplotypes as the starting point for each haplotype descending from them. Returns False if any haplotype has no parent haplotype
+        for chro in modchros:
+            for hap in modchros[chro]:
+                parts=hap.split('-')
+                lineage=['-'.join(parts[:i]) for i in range(len(parts),0,-1)]
+                found=[h for h in lineage if h in parentmodchros[chro]]
+                if found==[]:
+                    return False
+                modchros[chro][hap]=deepcopy(parentmodchros[chro][found[0]])
+                for v in modchros[chro][hap].vcfcounts:
+                    v.haplo=hap
+        return True
+
     #Read in variant_dict file and reference genomes------------------------------------------------------------------------------------------------------------
 
-    variants=readinvars(parameters)
+    if variants==None:
+        variants,germlinekey=readinvars(parameters,prochro)
+    else:
+        germlinekey=None
 
-    if clo not in variants:
-        print(clo + ' not listed in heterogenesis_vargen.py output. Exiting.')
-        exit()
+    if clo=='all':
+        clones=list(variants.keys())
+    else:
+        clones=clo.split(',')
+    for clo in clones:
+        if clo not in variants:
+            print(clo + ' not listed in heterogenesis_vargen.py output. Exiting.')
+            exit()
 
     if type(parameters['chromosomes'])==list:
         chromosomes=parameters['chromosomes']
     else:
         chromosomes=[parameters['chromosomes']]
 
-    gen,reference=readinfai(chromosomes,parameters['fai'],parameters['reference'])  #get dictionaries of genome lengths and sequences
+    gen,reference=readinfai(chromosomes,parameters['fai'],parameters['reference'],reference)  #get dictionaries of genome lengths and sequences
+    #with targets (as given to heterogenesis_vargen), only the sequence, copy numbers and variants within targets are written
+    targets=heterogenesis_targets.TARGETS(parameters['targets'],gen,int(parameters['targetpadding'])) if parameters['targets']!='none' else None
 
 
-    #Generate vcf and cnv output data and write to files-------------------------------------------------------------------------------------------------
-    #convert variants to objects and use to update modchros, and then calculate combined vcfs and cnvs
-    modchros=createmodchros(clo,gen,variants)
-    hapvars=createhapvars(clo,gen,variants)
-    combcnvs={}    #dictionary of combined copy numbers for each chromosome
-    combcnvsa={}
-    combcnvsb={}
-    combvcfs={}    #dictionary of combined vcfs for each chromosome
-    for chro in hapvars:
-        for hap in hapvars[chro]:
-            for var in hapvars[chro][hap]:
-                if var[0]=='cnv':
-                    modchros[chro][hap].updateblocks(BLOCK(var[3],var[3]+var[4]-1,var[5],var[6]))
-                    modchros[chro][hap].updatevcf(BLOCK(var[3],var[3]+var[4]-1,var[5],''))
-                elif var[0]=='indel':
-                    if var[7]=='i':
-                        modchros[chro][hap].updateblocks(BLOCK(var[3],var[3],var[6],''))
-                    else:
-                        modchros[chro][hap].updateblocks(BLOCK(var[3]+1,var[3]+1+var[4]-1,0,''))
-                    modchros[chro][hap].updatevcf(VCFVAR(var[3],var[5],var[6],[CNVBRANCH(var[3],var[3],'var')],'',hap)) #VCFVAR object starts with a single CNVBRANCH which contains the variant instead of a CNV
-                elif var[0]=='snv':
-                    modchros[chro][hap].updateblocks(BLOCK(var[3],var[3],var[5],''))
-                    modchros[chro][hap].updatevcf(VCFVAR(var[3],var[4],var[5],[CNVBRANCH(var[3],var[3],'var')],'',hap)) #VCFVAR object starts with a single CNVBRANCH which contains the variant instead of a CNV
-                elif var[0]=='aneu':
-                    pass    #no need to do anything
-            modchros[chro][hap].addupfinalvcfs()
-            print(str(datetime.datetime.now())+' : Processed mutations for '+chro+hap)
-        combcnvs[chro],combcnvsa[chro],combcnvsb[chro]=combinecnvs(modchros[chro],gen)
+    def variantupdates(var,hap):
+        #the block and the vcf variant a variant adds to its haplotype, or None for aneuploid events (which need nothing doing)
+        if var[0]=='cnv':
+            return BLOCK(var[3],var[3]+var[4]-1,var[5],var[6]),BLOCK(var[3],var[3]+var[4]-1,var[5],'')
+        elif var[0]=='indel':
+            block=BLOCK(var[3],var[3],var[6],'') if var[7]=='i' else BLOCK(var[3]+1,var[3]+1+var[4]-1,0,'')
+            return block,VCFVAR(var[3],var[5],var[6],[CNVBRANCH(var[3],var[3],'var')],'',hap) #VCFVAR object starts with a single CNVBRANCH which contains the variant instead of a CNV
+        elif var[0]=='snv':
+            return BLOCK(var[3],var[3],var[5],''),VCFVAR(var[3],var[4],var[5],[CNVBRANCH(var[3],var[3],'var')],'',hap)
+        return None
+
+    def incorporatevariants(modchro,hapvariants,hap):
+        #returns the time spent updating blocks and updating vcfs, which is only measured with -m
+        if args.metrics==None:
+            for var in hapvariants:
+                updates=variantupdates(var,hap)
+                if updates!=None:
+                    modchro.updateblocks(updates[0])
+                    modchro.updatevcf(updates[1])
+            modchro.addupfinalvcfs()
+            return 0,0
+        blockstime=0
+        vcftime=0
+        for var in hapvariants:
+            updates=variantupdates(var,hap)
+            if updates!=None:
+                started=time.perf_counter()
+                modchro.updateblocks(updates[0])
+                blocksdone=time.perf_counter()
+                modchro.updatevcf(updates[1])
+                blockstime+=blocksdone-started
+                vcftime+=time.perf_counter()-blocksdone
+        started=time.perf_counter()
+        modchro.addupfinalvcfs()
+        return blockstime,vcftime+time.perf_counter()-started
+
+    def branchdepth(branches):  #number of cnv levels above a variant in its tree of copies
+        return max([0]+[1+branchdepth(b.content) for b in branches if b.content!='var'])
+
+    def processhap(chro,hap):
+        started=startphase()
+        blockstime,vcftime=incorporatevariants(modchros[chro][hap],hapvars[chro][hap],hap)
+        print(str(datetime.datetime.now())+' : Processed mutations for '+chro+hap)
+        if args.metrics!=None:
+            modchro=modchros[chro][hap]
+            recordmetrics('incorporate',started,chromosome=chro,haplotype=hap,variants=len(hapvars[chro][hap]),allblocks=len(modchro.allblocks),cnblocks=len(modchro.cnblocks),vcfs=len(modchro.vcfcounts),
+                maxbranchdepth=max([0]+[branchdepth(v.branches) for v in modchro.vcfcounts]),updateblocksseconds=round(blockstime,6),updatevcfseconds=round(vcftime,6))
+
+    def combinechro(chro):
+        started=startphase()
+        combcnvs[chro],combcnvsa[chro],combcnvsb[chro]=combinecnvs(modchros[chro],gen,chro)
         print(str(datetime.datetime.now())+' : Calculated copy numbers for '+chro)
-        combvcfs[chro]=combinevcfs(modchros[chro],combcnvs[chro])
+        recordmetrics('combinecnvs',started,chromosome=chro,cnvs=len(combcnvs[chro]))
+        started=startphase()
+        combvcfs[chro]=combinevcfs(modchros[chro],combcnvs[chro],chro)
         print(str(datetime.datetime.now())+' : Calculated variant allele frequencies for '+chro)
+        recordmetrics('combinevcfs',started,chromosome=chro,vcfs=len(combvcfs[chro]))
+
+    def writehapfasta(chro,hap,writer=None):
+        #returns the file name, size and checksum for the manifest
+        started=startphase()
+        output=writebasestringtofile(parameters,clo,chro,hap,haprecords(clo,chro,hap,modchros[chro][hap]),writer,args.resume)
+        recordmetrics('fasta',started,chromosome=chro,haplotype=hap,byteswritten=output[1])
+        return output
 
-    #write output files ------------------------------------------------------------------------------------------------------
-    #write variant files
-    #writeblocksfile(parameters['directory'],parameters['prefix'],clo,hapvars,modchros)   #This can be uncommented and used for testing if needed
-    writecnvfile(parameters['directory'],parameters['prefix'],clo,combcnvs,combcnvsa,combcnvsb,prochro)
-    print(str(datetime.datetime.now())+' : Written copy numbers file')
-    writevcffile(parameters['directory'],parameters['prefix'],clo,combvcfs,prochro)
-    print(str(datetime.datetime.now())+' : Written vcf file')
-    #Generate genome sequences and write to files
-    for chro in hapvars:
-        for hap in hapvars[chro]:
-            writestring=modchros[chro][hap].getbasestring(gen[chro])
-            writebasestringtofile(parameters,clo,chro,hap,writestring)
+    #objects are passed between processes as tuples, as classes defined within main() can't be pickled
+    def packbranches(branches):
+        return [(b.start,b.end,b.content if b.content=='var' else packbranches(b.content)) for b in branches]
+
+    def unpackbranches(branches):
+        return [CNVBRANCH(start,end,content if content=='var' else unpackbranches(content)) for start,end,content in branches]
+
+    def packmodchro(modchro,withblocks):
+        #allblocks and the cnv branches of vcfs are only included if needed after the haplotype is processed
+        allblocks=[(b.start,b.end,b.content,b.flag) for b in modchro.allblocks] if withblocks else None
+        return allblocks,[(b.start,b.end,b.content,b.flag) for b in modchro.cnblocks],[(v.pos,v.ref,v.alt,v.final,v.haplo,packbranches(v.branches) if withblocks else None) for v in modchro.vcfcounts]
+
+    def unpackmodchro(chro,packed):
+        allblocks,cnblocks,vcfcounts=packed
+        return MODCHRO(chro,[BLOCK(*b) for b in allblocks] if allblocks!=None else [],[BLOCK(*b) for b in cnblocks],[VCFVAR(pos,ref,alt,unpackbranches(branches) if branches!=None else None,final,haplo) for pos,ref,alt,final,haplo,branches in vcfcounts])
+
+    def hapworker(chro,hap):
+        #returns the packed haplotype, and the fasta file written for the manifest (the manifest is only written by the main process)
+        processhap(chro,hap)
+        output=None
+        if not fastadone[(chro,hap)]:   #write fasta file here while the haplotype is in memory
+            output=writehapfasta(chro,hap)
             print(str(datetime.datetime.now())+' : Written fasta sequence for '+chro+hap)
+        return packmodchro(modchros[chro][hap],args.blocks or (args.bgzip and not args.nofasta) or children.get(clo,[])!=[] or (clo=='germline' and parameters['cache']!='')),output
+
+    def chroworker(chro,packed):
+        for hap in packed:
+            modchros[chro][hap]=unpackmodchro(chro,packed[hap])
+        combinechro(chro)
+        return [[(b.start,b.end,b.content,b.flag) for b in c[chro]] for c in (combcnvs,combcnvsa,combcnvsb)],combvcfs[chro]
+
+    def cachename(chro):
+        return 'haplotypes-'+germlinekey+'-'+chro+'.pkl'
+
+    def writegermlinecache(germline):
+        for chro in germline:
+            if heterogenesis_cache.readcache(parameters['cache'],cachename(chro))==None:
+                heterogenesis_cache.writecache(parameters['cache'],cachename(chro),dict([(hap,packmodchro(germline[chro][hap],True)) for hap in germline[chro]]))
+                print(str(datetime.datetime.now())+' : Added germline haplotypes for '+chro+' to cache')
+
+    def readgermlinecache():
+        #get germline haplotypes from the cache, incorporating the germline variants for any chromosomes not yet in it
+        germline={}
+        germlinehapvars=createhapvars('germline',gen,variants)
+        for chro in gen:
+            packed=heterogenesis_cache.readcache(parameters['cache'],cachename(chro))
+            if packed==None:
+                germline[chro]=createmodchros('germline',gen,variants)[chro]
+                for hap in germline[chro]:
+                    incorporatevariants(germline[chro][hap],germlinehapvars[chro][hap],hap)
+                writegermlinecache({chro:germline[chro]})
+            else:
+                germline[chro]=dict([(hap,unpackmodchro(chro,packed[hap])) for hap in packed])
+                print(str(datetime.datetime.now())+' : Read germline haplotypes for '+chro+' from cache')
+        return germline
+
+    #clones descending from another clone being processed start from copies of its parent's haplotypes, so only their new variants need to be incorporated
+    parents=readinparents(parameters,variants)
+    snapshots={}    #processed haplotypes of clones with children still to be processed
+    if parameters['cache']!='' and 'germline' in variants:
+        #clones without a parent being processed can start from cached germline haplotypes
+        if germlinekey==None:   #the key is in the variants index when only one chromosome's variants are read
+            germlinekey=heterogenesis_cache.variantskey(parameters['reference'],variants['germline'])
+        for c in clones:
+            if c!='germline' and parents.get(c) not in clones and variants[c][0][:len(variants['germline'][0])]==variants['germline'][0]:
+                parents[c]='germline'
+        if 'germline' not in clones and 'germline' in parents.values():
+            snapshots['germline']=readgermlinecache()
+    order=[]
+    while len(order)<len(clones):
+        added=[c for c in clones if c not in order and (parents.get(c) not in clones or parents.get(c) in order)]
+        order.extend(added if added!=[] else [c for c in clones if c not in order])
+    children={}
+    for c in order:
+        if parents.get(c) in snapshots or (parents.get(c) in order and order.index(parents[c])<order.index(c)):
+            children.setdefault(parents[c],[]).append(c)
+
+    def outputcomplete(output):
+        return manifest!=None and manifest.complete(output)
+
+    def recordoutput(output):
+        if manifest!=None:
+            manifest.addfile(output)
+
+    #Generate vcf and cnv output data and write to files-------------------------------------------------------------------------------------------------
+    for clo in order:
+        clonestarted=startphase()
+        #convert variants to objects and use to update modchros, and then calculate combined vcfs and cnvs
+        modchros=createmodchros(clo,gen,variants)
+        start=0
+        if parents.get(clo) in snapshots and startfromparent(modchros,snapshots[parents[clo]]):
+            start=len(variants[parents[clo]][0])
+            print(str(datetime.datetime.now())+' : Starting '+clo+' from haplotypes of '+parents[clo])
+        hapvars=createhapvars(clo,gen,variants,start)
+        combcnvs={}    #dictionary of combined copy numbers for each chromosome
+        combcnvsa={}
+        combcnvsb={}
+        combvcfs={}    #dictionary of combined vcfs for each chromosome
+
+        #with -r, outputs recorded as complete in the clone's manifest by an earlier run with the same inputs are not made again
+        manifest=None
+        if args.resume:
+            options=''.join([o for o,given in (('z',args.bgzip),('i',args.index),('b',args.blocks),('f',args.profile)) if given])    #options that change the outputs written
+            manifest=heterogenesis_cache.MANIFEST(parameters['directory'],parameters['prefix']+clo+prochro+'manifest.json',heterogenesis_cache.variantskey(parameters['reference'],variants[clo])+','+','.join(gen)+(','+str(targets) if targets!=None else '')+',-'+options,args.verify)
+        outputs=dict([(o,parameters['prefix']+clo+prochro+o+('.gz' if args.index and o in ('cnv.txt','.vcf') else '')) for o in ('cnv.txt','.vcf','profile.bin','blocks.bin','.fasta.gz')])
+        combined=results==None and outputcomplete(outputs['cnv.txt']) and outputcomplete(outputs['.vcf']) and (not args.profile or outputcomplete(outputs['profile.bin']))
+        fastadone=dict([((chro,hap),args.nofasta or args.bgzip or outputcomplete(fastaname(parameters,clo,chro,hap))) for chro in hapvars for hap in hapvars[chro]])
+        if not combined or (args.blocks and not outputcomplete(outputs['blocks.bin'])) or (args.bgzip and not args.nofasta and not outputcomplete(outputs['.fasta.gz'])) or children.get(clo,[])!=[] or (clo=='germline' and parameters['cache']!=''):
+            todo=[(chro,hap) for chro in hapvars for hap in hapvars[chro]]
+        else:   #only haplotypes with fasta files still to write are needed
+            todo=[(chro,hap) for chro in hapvars for hap in hapvars[chro] if not fastadone[(chro,hap)]]
+        if manifest!=None and len(manifest.outputs)>0:
+            print(str(datetime.datetime.now())+' : Resuming '+clo+' with '+str(len(manifest.outputs))+' outputs already complete and '+str(len(todo))+' haplotypes to process')
+
+        if args.workers<=1:
+            for chro in hapvars:
+                for hap in hapvars[chro]:
+                    if (chro,hap) in todo:
+                        processhap(chro,hap)
+                if not combined:
+                    combinechro(chro)
+        elif todo!=[]:
+            #haplotypes are processed on a pool of forked processes, which share the reference already read in. Each chromosome's copy numbers and vcfs are combined once all of its haplotypes are done
+            workertasks['hap']=hapworker
+            workertasks['chro']=chroworker
+            reference.wait()    #the reference must be fully read before forking
+            haptasks=[('hap',(chro,hap)) for chro,hap in todo]
+            with multiprocessing.get_context('fork').Pool(args.workers) as pool:
+                packed={}
+                chrotasks={}
+                for task,(result,output) in zip(haptasks,pool.imap(runworkertask,haptasks)):
+                    chro,hap=task[1]
+                    packed.setdefault(chro,{})[hap]=result
+                    if output!=None and manifest!=None:
+                        manifest.add(*output)
+                    if not combined and len(packed[chro])==len(hapvars[chro]):
+                        chrotasks[chro]=pool.apply_async(runworkertask,[('chro',(chro,packed[chro]))])
+                for chro in chrotasks:
+                    cnvs,combvcfs[chro]=chrotasks[chro].get()
+                    combcnvs[chro],combcnvsa[chro],combcnvsb[chro]=[[BLOCK(*b) for b in c] for c in cnvs]
+                for chro in packed:
+                    for hap in packed[chro]:
+                        modchros[chro][hap]=unpackmodchro(chro,packed[chro][hap])
+                packed={}
+
+        #write output files ------------------------------------------------------------------------------------------------------
+        #write variant files
+        #writeblocksfile(parameters['directory'],parameters['prefix'],clo,hapvars,modchros)   #This can be uncommented and used for testing if needed
+        if results!=None:
+            results[clo]=heterogenesis_profile.MEMORYPROFILE(clo,parameters['reference'],profilechromosomes(combcnvs,combcnvsa,combcnvsb,combvcfs))
+        elif not combined:
+            started=startphase()
+            writecnvfile(parameters['directory'],parameters['prefix'],clo,combcnvs,combcnvsa,combcnvsb,prochro,args.index,args.threads)
+            print(str(datetime.datetime.now())+' : Written copy numbers file')
+            if args.index:
+                recordoutput(outputs['cnv.txt']+'.tbi')
+            recordoutput(outputs['cnv.txt'])
+            recordmetrics('cnvfile',started)
+            started=startphase()
+            writevcffile(parameters['directory'],parameters['prefix'],clo,combvcfs,prochro,args.index,args.threads)
+            print(str(datetime.datetime.now())+' : Written vcf file')
+            if args.index:
+                recordoutput(outputs['.vcf']+'.tbi')
+            recordoutput(outputs['.vcf'])
+            recordmetrics('vcffile',started)
+            if args.profile:
+                started=startphase()
+                writeprofile(parameters['directory'],parameters['prefix'],clo,combcnvs,combcnvsa,combcnvsb,combvcfs,prochro)
+                print(str(datetime.datetime.now())+' : Written profile file')
+                recordoutput(outputs['profile.bin'])
+                recordmetrics('profile',started)
+        if args.blocks and not outputcomplete(outputs['blocks.bin']):
+            started=startphase()
+            writeblockmap(parameters['directory'],parameters['prefix'],clo,hapvars,modchros,prochro)
+            print(str(datetime.datetime.now())+' : Written block map file')
+            recordoutput(outputs['blocks.bin'])
+            recordmetrics('blockmap',started)
+        #Generate genome sequences and write to files
+        started=startphase()
+        if args.nofasta:
+            pass
+        elif args.bgzip:
+            if not outputcomplete(outputs['.fasta.gz']):
+                writebgzipfasta(parameters,clo,hapvars,modchros,prochro,args.threads)
+                for o in ('.fasta.gz.fai','.fasta.gz.gzi','.fasta.gz'):
+                    recordoutput(outputs['.fasta.gz'][:-len('.fasta.gz')]+o)
+                recordmetrics('bgzipfasta',started,byteswritten=os.path.getsize(parameters['directory'] + '/' + outputs['.fasta.gz']))
+        elif args.workers<=1:   #(fasta files are written by the worker processes otherwise)
+            writer=BACKGROUNDWRITER()
+            for chro in hapvars:
+                for hap in hapvars[chro]:
+                    if not fastadone[(chro,hap)]:
+                        output=writehapfasta(chro,hap,writer)  #(the time recorded for each haplotype is for rendering, as files are written on the writer's thread)
+                        if manifest!=None:
+                            writer.put(manifest.add,*output)    #recorded once the writer has closed the file
+                        print(str(datetime.datetime.now())+' : Rendered fasta sequence for '+chro+hap)
+            writer.close()
+            print(str(datetime.datetime.now())+' : Written fasta sequences')
+            recordmetrics('fastafiles',started)
+
+        if clo=='germline' and parameters['cache']!='':
+            writegermlinecache(modchros)
+        #keep haplotypes for child clones, and drop them once all children have been started
+        if parents.get(clo) in snapshots:
+            children[parents[clo]].remove(clo)
+            if children[parents[clo]]==[]:
+                del snapshots[parents[clo]]
+        if children.get(clo,[])!=[]:
+            snapshots[clo]=modchros
+        recordmetrics('clone',clonestarted,chromosomes=len(hapvars),haplotypes=sum([len(hapvars[chro]) for chro in hapvars]))
+
 # If run as main, run main():
 if __name__ == '__main__': main()
@@ -17,7 +17,7 @@ setup(
         'License :: OSI Approved :: GNU Lesser General Public License v3 (LGPLv3)',
         'Programming Language :: Python :: 3'
     ],
-    py_modules = ['heterogenesis_vargen','heterogenesis_varincorp','freqcalc','version'],
+    py_modules = ['heterogenesis_vargen','heterogenesis_varincorp','heterogenesis_query','heterogenesis_bgzf','heterogenesis_cache','heterogenesis_profile','heterogenesis_targets','heterogenesis_structure','heterogenesis_run','heterogenesis_api','heterogenesis_server','freqcalc','version'],
     install_requires = [
     'numpy>=1.12.0'
     ],
@@ -26,7 +26,10 @@ setup(
         'console_scripts': [
             'heterogenesis_vargen=heterogenesis_vargen:main',
             'heterogenesis_varincorp=heterogenesis_varincorp:main',
-            'freqcalc=freqcalc:main'
+            'heterogenesis_query=heterogenesis_query:main',
+            'freqcalc=freqcalc:main',
+            'heterogenesis_run=heterogenesis_run:main',
+            'heterogenesis_server=heterogenesis_server:main'
         ]
     }
 )
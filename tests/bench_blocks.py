@@ -0,0 +1,37 @@
+#Memory and copying time per block of heterogenesis_varincorp's slotted BLOCK with integer coordinates, against blocks as they were before
+#(with a __dict__ and float coordinates, copied with deepcopy). Run with: python tests/bench_blocks.py [number of blocks]
+import sys
+import time
+import tracemalloc
+from copy import deepcopy
+import toy
+
+class DICTBLOCK(object):
+    def __init__(self, start, end, content,flag):
+        self.start = start
+        self.end = end
+        self.content=content
+        self.flag=flag
+
+def measure(make,copy,n):
+    #returns bytes allocated per block, and microseconds per block to copy them
+    tracemalloc.start()
+    before=tracemalloc.get_traced_memory()[0]
+    blocks=[make(i*10+1,i*10+10,'ref' if i%2==0 else 'A','n') for i in range(n)]
+    size=tracemalloc.get_traced_memory()[0]-before
+    tracemalloc.stop()
+    start=time.perf_counter()
+    copy(blocks)
+    return size/n,(time.perf_counter()-start)*1e6/n
+
+def main():
+    n=int(sys.argv[1]) if len(sys.argv)>1 else 200000
+    BLOCK=toy.definitions('heterogenesis_varincorp',('BLOCK',))['BLOCK']
+    print('Blocks: '+str(n)+', Python '+sys.version.split()[0])
+    for name,make,copy in (('before (dict, float coordinates, deepcopy)',lambda s,e,c,f: DICTBLOCK(float(s),float(e),c,f),deepcopy),
+            ('after (slots, int coordinates, copy)',BLOCK,lambda blocks: [b.copy() for b in blocks])):
+        size,copytime=measure(make,copy,n)
+        print('{}: {:.0f} bytes/block, {:.2f} us/block to copy'.format(name,size,copytime))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,5 @@
+import os.path
+import sys
+
+#the modules are installed as top level py_modules, so run the tests against the ones in the repository
+sys.path.insert(0,os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,83 @@
+import gzip
+import random
+import struct
+import zlib
+import pytest
+import heterogenesis_bgzf
+
+def readblocks(data):
+    #list of (compressed offset, uncompressed offset, uncompressed data) of each bgzf block, checking each block's header and trailer
+    blocks=[]
+    coffset=0
+    uoffset=0
+    while coffset<len(data):
+        id1,id2,cm,flg,mtime,xfl,os_,xlen,si1,si2,slen,bsize=struct.unpack('<BBBBIBBHBBHH',data[coffset:coffset+18])
+        assert (id1,id2,cm,flg,xlen,si1,si2,slen)==(31,139,8,4,6,66,67,2)
+        block=data[coffset:coffset+bsize+1]
+        content=zlib.decompress(block[18:-8],-15)
+        crc,size=struct.unpack('<II',block[-8:])
+        assert crc==zlib.crc32(content) and size==len(content)
+        assert len(content)<=heterogenesis_bgzf.BLOCKSIZE
+        blocks.append((coffset,uoffset,content))
+        coffset+=bsize+1
+        uoffset+=len(content)
+    return blocks
+
+def sequence(length,seed=1):
+    generator=random.Random(seed)
+    return ''.join(generator.choice('ACGTN') for i in range(length)).encode()
+
+@pytest.mark.parametrize('threads',[1,3])
+def test_roundtrip(tmp_path,threads):
+    data=sequence(400000)
+    filename=str(tmp_path/'test.fa.gz')
+    with heterogenesis_bgzf.BGZFWRITER(filename,threads=threads,gzi=True) as file:
+        for i in range(0,len(data),7919):   #writes that don't line up with blocks
+            file.write(data[i:i+7919])
+        assert file.tell()==len(data)
+    with open(filename,'rb') as file:
+        compressed=file.read()
+    assert gzip.decompress(compressed)==data
+    assert compressed.endswith(heterogenesis_bgzf.EOF)
+    blocks=readblocks(compressed)
+    assert b''.join(b[2] for b in blocks)==data
+    assert blocks[-1][2]==b''   #the empty eof block
+    #the gzi index lists the compressed and uncompressed start of each block after the first, as from bgzip -i
+    with open(filename+'.gzi','rb') as file:
+        gzi=file.read()
+    count=struct.unpack('<Q',gzi[:8])[0]
+    entries=[struct.unpack('<QQ',gzi[8+16*i:24+16*i]) for i in range(count)]
+    assert len(gzi)==8+16*count
+    assert entries==[(c,u) for c,u,content in blocks[1:-1]]
+
+def test_threads_match(tmp_path):
+    data=sequence(300000,2)
+    outputs=[]
+    for threads in (1,4):
+        filename=str(tmp_path/('test'+str(threads)+'.gz'))
+        with heterogenesis_bgzf.BGZFWRITER(filename,threads=threads) as file:
+            file.write(data)
+        with open(filename,'rb') as file:
+            outputs.append(file.read())
+    assert outputs[0]==outputs[1]
+
+def test_virtualoffset(tmp_path):
+    data=sequence(200000,3)
+    filename=str(tmp_path/'test.gz')
+    file=heterogenesis_bgzf.BGZFWRITER(filename)
+    file.write(data)
+    file.close()
+    with open(filename,'rb') as f:
+        blocks=dict((c,content) for c,u,content in readblocks(f.read()))
+    for offset in [0,1,heterogenesis_bgzf.BLOCKSIZE-1,heterogenesis_bgzf.BLOCKSIZE,150001,len(data)-1]:
+        virtual=file.virtualoffset(offset)
+        assert blocks[virtual>>16][virtual&0xffff]==data[offset]
+
+def test_empty(tmp_path):
+    filename=str(tmp_path/'empty.gz')
+    with heterogenesis_bgzf.BGZFWRITER(filename,gzi=True):
+        pass
+    with open(filename,'rb') as file:
+        assert file.read()==heterogenesis_bgzf.EOF
+    with open(filename+'.gzi','rb') as file:
+        assert file.read()==struct.pack('<Q',0)
@@ -0,0 +1,42 @@
+import json
+import os
+import hashlib
+import heterogenesis_cache
+import toy
+
+VARIANTS=[[['snv','chr1','A',10,'A','G']],{'chr1':['A','B'],'chr2':['A','B']}]
+
+def test_sequencechecksums(tmp_path):
+    reference=str(tmp_path/'ref.fa')
+    toy.writereference(reference,[('chr1',1000),('chr2',130),('chr3',50)])
+    checksums=heterogenesis_cache.sequencechecksums(reference)
+    sequences={}
+    with open(reference,'r') as file:
+        for line in file:
+            if line.startswith('>'):
+                chro=line[1:].strip()
+                sequences[chro]=''
+            else:
+                sequences[chro]+=line.strip()
+    assert checksums==dict([(chro,hashlib.sha256(sequences[chro].encode()).hexdigest()) for chro in sequences])
+    with open(reference+'.checksums','r') as file:
+        assert json.load(file)['checksums']==checksums
+    #kept checksums are used while the reference is unchanged
+    with open(reference+'.checksums','w') as file:
+        json.dump({'size':os.path.getsize(reference),'mtime':os.stat(reference).st_mtime_ns,'checksums':{'chr1':'kept'}},file)
+    assert heterogenesis_cache.sequencechecksums(reference)=={'chr1':'kept'}
+
+def test_variantskey(tmp_path):
+    #changing a base of a simulated chromosome changes the key, though the fai index and size of the reference are the same
+    reference=str(tmp_path/'ref.fa')
+    toy.writereference(reference,[('chr1',1000),('chr2',130),('chr3',50)])
+    key=heterogenesis_cache.variantskey(reference,VARIANTS)
+    assert heterogenesis_cache.variantskey(reference,VARIANTS)==key
+    with open(reference,'r') as file:
+        lines=file.readlines()
+    for i,simulated in ((len(lines)-1,False),(3,True)):    #(the last line is of chr3, which isn't simulated, and line 3 of chr1)
+        lines[i]=('C' if lines[i][0]!='C' else 'G')+lines[i][1:]
+        with open(reference,'w') as file:
+            file.writelines(lines)
+        os.utime(reference,ns=(0,os.stat(reference).st_mtime_ns+1000))
+        assert (heterogenesis_cache.variantskey(reference,VARIANTS)!=key)==simulated
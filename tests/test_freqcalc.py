@@ -0,0 +1,92 @@
+import os
+import subprocess
+import sys
+import pytest
+import toy
+
+DATA=os.path.join(os.path.dirname(os.path.abspath(__file__)),'data','freqcalc')
+
+#copy numbers and vcf records of three clones, with breakpoints shared between clones, single base segments, and variants in them
+CNVS={
+    'c1':[('chr1',1,100,2,1,1),('chr1',101,101,3,2,1),('chr1',102,500,2,1,1),('chr1',501,1000,1,1,0),('chr2',1,500,2,1,1)],
+    'c2':[('chr1',1,100,2,1,1),('chr1',101,300,4,2,2),('chr1',301,500,2,1,1),('chr1',501,1000,3,2,1),('chr2',1,250,3,2,1),('chr2',251,500,2,1,1)],
+    'c3':[('chr1',1,699,2,1,1),('chr1',700,700,0,0,0),('chr1',701,1000,2,1,1),('chr2',1,499,2,1,1),('chr2',500,500,1,0,1)],
+}
+VARIANTS={
+    'c1':[('chr1',50,'A','G',1,'A'),('chr1',101,'C','T',2,'A'),('chr1',600,'G','A',1,'A'),('chr2',250,'T','C',1,'B')],
+    'c2':[('chr1',50,'A','G',1,'A'),('chr1',101,'C','T',1,'B'),('chr1',300,'G','GA',2,'A'),('chr1',501,'T','C',3,'A'),('chr2',251,'A','T',1,'A')],
+    'c3':[('chr1',50,'A','G',1,'A'),('chr1',699,'C','G',1,'B'),('chr1',701,'AT','A',1,'A'),('chr2',500,'G','C',1,'B')],
+}
+#proportions of the clones in each sample, including samples without some clones
+SAMPLES=[('s1',[0.3,0.3,0.4]),('s2',[0,0.45,0.55]),('s3',[1,0,0])]
+
+def writeclones(directory):
+    for clo in CNVS:
+        with open(os.path.join(directory,'t'+clo+'cnv.txt'),'w') as file:
+            file.write('Chromosome\tStart\tEnd\tCopy Number\tA Allele\tB Allele\n')
+            file.write(''.join('\t'.join([str(x) for x in c])+'\n' for c in CNVS[clo]))
+        with open(os.path.join(directory,'t'+clo+'.vcf'),'w') as file:
+            file.write('##fileformat=VCFv4.2\n##reference=file:ref.fa\n#CHROM\tPOS\tID\tREF\tALT\tQUAL\tFILTER\tINFO\tFORMAT\t'+clo+'\n')
+            for chro,pos,ref,alt,copies,hap in VARIANTS[clo]:
+                file.write('\t'.join([chro,str(pos),'.',ref,alt,'.','.','NS=1','AF:TC:HS:HC:CN','0.5:'+str(copies)+':'+hap+':'+str(copies)+':2'])+'\n')
+
+def records(filename):
+    #the lines of an output file, with records sorted (freqcalc before the vcfs were merged wrote variants in the order they were read) and without the date
+    with open(filename,'r') as file:
+        lines=[l for l in file if not l.startswith('##fileDate')]
+    header=[l for l in lines if l.startswith('#') or l.startswith('Chromosome')]
+    return header+sorted(l for l in lines if l not in header)
+
+def expected(sample,suffix):  #output of freqcalc before copy numbers were combined with a sweep, kept in tests/data/freqcalc
+    return records(os.path.join(DATA,'t'+sample+suffix))
+
+def test_mix(tmp_path):
+    #copy numbers and variant frequencies match those of freqcalc before the sweep and merge, for each sample mixed on its own
+    writeclones(str(tmp_path))
+    for sample,proportions in SAMPLES:
+        clonefile=toy.writeclones(str(tmp_path/(sample+'.txt')),zip(CNVS,proportions))
+        toy.run('freqcalc','-c',clonefile,'-d',str(tmp_path),'-p','t','-n',sample)
+        for suffix in ('cnv.txt','.vcf'):
+            assert records(str(tmp_path/('t'+sample+suffix)))==expected(sample,suffix)
+
+def test_emptysegment(tmp_path):
+    #a segment ending before it starts covers no positions, so doesn't change the copy numbers of the segments next to it
+    writeclones(str(tmp_path))
+    with open(str(tmp_path/'tc1cnv.txt'),'r') as file:
+        lines=file.readlines()
+    with open(str(tmp_path/'tc1cnv.txt'),'w') as file:
+        file.writelines(lines[:3]+['chr1\t102\t101\t5\t3\t2\n']+lines[3:])
+    toy.run('freqcalc','-c',toy.writeclones(str(tmp_path/'s1.txt'),zip(CNVS,SAMPLES[0][1])),'-d',str(tmp_path),'-p','t','-n','s1')
+    for suffix in ('cnv.txt','.vcf'):
+        assert records(str(tmp_path/('ts1'+suffix)))==expected('s1',suffix)
+
+def test_series(tmp_path):
+    #samples mixed together with -s are the same as each mixed on its own
+    writeclones(str(tmp_path))
+    with open(str(tmp_path/'series.txt'),'w') as file:
+        file.write('Sample\t'+'\t'.join(CNVS)+'\n'+''.join(sample+'\t'+'\t'.join([str(p) for p in proportions])+'\n' for sample,proportions in SAMPLES))
+    toy.run('freqcalc','-s',str(tmp_path/'series.txt'),'-d',str(tmp_path),'-p','t')
+    for sample,proportions in SAMPLES:
+        for suffix in ('cnv.txt','.vcf'):
+            assert records(str(tmp_path/('t'+sample+suffix)))==expected(sample,suffix)
+
+def test_repeatedpositions(tmp_path):
+    #records of a clone at the same position are combined with those of other clones there, as by freqcalc before the merge
+    writeclones(str(tmp_path))
+    with open(str(tmp_path/'tc2.vcf'),'a') as file:
+        file.write('chr2\t251\t.\tA\tG\t.\t.\tNS=1\tAF:TC:HS:HC:CN\t0.5:1:B:1:2\n')
+    toy.run('freqcalc','-c',toy.writeclones(str(tmp_path/'s1.txt'),zip(CNVS,SAMPLES[0][1])),'-d',str(tmp_path),'-p','t','-n','s1')
+    assert records(str(tmp_path/'ts1.vcf'))==expected('repeated','.vcf')
+
+@pytest.mark.parametrize('move',[(3,4),(7,3)])
+def test_unsorted(tmp_path,move):
+    #records are merged in order, so a vcf with a position before the one above it, or a chromosome before one it follows, is an error
+    writeclones(str(tmp_path))
+    with open(str(tmp_path/'tc2.vcf'),'r') as file:
+        lines=file.readlines()
+    lines.insert(move[1],lines.pop(move[0]))    #(chr1 50 after chr1 101, or chr2 251 before the chr1 records)
+    with open(str(tmp_path/'tc2.vcf'),'w') as file:
+        file.writelines(lines)
+    process=subprocess.Popen([sys.executable,os.path.join(toy.ROOT,'freqcalc.py'),'-c',toy.writeclones(str(tmp_path/'s1.txt'),zip(CNVS,SAMPLES[0][1])),'-d',str(tmp_path),'-p','t','-n','s1'],stdout=subprocess.PIPE,stderr=subprocess.STDOUT)
+    output=process.communicate()[0].decode()
+    assert process.returncode!=0 and 'vcf file for c2 is not sorted by position' in output
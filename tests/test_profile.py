@@ -0,0 +1,34 @@
+import pytest
+import heterogenesis_profile
+
+CHROMOSOMES={
+    'chr1':[[(1,1000,2,1,1),(1001,5000,3,2,1),(5001,9000,0,0,0)],
+        [(15,'A','G',1,[['A',1]],2),(2000,'C','CTT',2,[['A-1',1],['B',1]],3),(2500,'GAT','G',3,[['A-1',2],['B',1]],3)]],
+    'chr2':[[(1,400,2,1,1)],[]],   #no variants
+    'chr3':[[],[(7,'T','A',1,[['B-10',1]],1)]],   #no cnvs
+}
+
+def test_roundtrip(tmp_path):
+    filename=str(tmp_path/'profile.bin')
+    heterogenesis_profile.writeprofile(filename,'ref.fa','clone1',CHROMOSOMES)
+    profile=heterogenesis_profile.PROFILE(filename)
+    assert profile.index['clone']=='clone1' and profile.index['reference']=='ref.fa'
+    assert profile.chromosomes()==list(CHROMOSOMES)
+    for chro in reversed(list(CHROMOSOMES)):    #(arrays are mapped when first used, in any order)
+        cnvs,variants=CHROMOSOMES[chro]
+        assert profile.cnvs(chro)==[tuple(c) for c in cnvs]
+        assert list(profile.variants(chro))==[tuple(v) for v in variants]
+
+def test_memoryprofile():
+    profile=heterogenesis_profile.MEMORYPROFILE('clone1','ref.fa',CHROMOSOMES)
+    assert profile.chromosomes()==list(CHROMOSOMES)
+    for chro in CHROMOSOMES:
+        assert profile.cnvs(chro)==CHROMOSOMES[chro][0]
+        assert list(profile.variants(chro))==CHROMOSOMES[chro][1]
+
+def test_notprofile(tmp_path):
+    filename=str(tmp_path/'other.bin')
+    with open(filename,'wb') as file:
+        file.write(b'HGBLOCK1'+b'\0'*16)
+    with pytest.raises(ValueError):
+        heterogenesis_profile.PROFILE(filename)
@@ -0,0 +1,36 @@
+import glob
+import os
+import toy
+
+def simulate(tmp_path,chromosomes,lengths,*args):
+    toy.writereference(str(tmp_path/'ref.fa'),lengths)
+    jsonfile=toy.writeparameters(str(tmp_path),str(tmp_path/'ref.fa'),chromosomes=chromosomes)
+    clonefile=toy.writeclones(str(tmp_path/'clones.txt'),[('clone2',1.0)])
+    return jsonfile,clonefile,toy.run('heterogenesis_run','-j',jsonfile,'-c',clonefile,'-n','sample','-w','4',*args)
+
+def test_defaultchromosomes(tmp_path):
+    #without the chromosomes parameter, chr1 to chr22 are simulated (not other contigs of the reference), as by heterogenesis_vargen
+    lengths=[('chr'+str(i),1500) for i in range(1,23)]+[('chrX',1500),('chrM',500)]
+    simulate(tmp_path,None,lengths)
+    assert os.path.exists(str(tmp_path/'toyclone2chr22cnv.txt')) and os.path.exists(str(tmp_path/'toysamplecnv.txt'))
+    assert glob.glob(str(tmp_path/'*chrX*'))==[] and glob.glob(str(tmp_path/'*chrM*'))==[]
+
+def test_rerun(tmp_path):
+    jsonfile,clonefile,output=simulate(tmp_path,['chr21','chr22'],[('chr21',20000),('chr22',10000)])
+    assert '4 of 4 steps to run' in output
+    rerun=lambda *args: toy.run('heterogenesis_run','-j',jsonfile,'-c',clonefile,'-n','sample','-w','4',*args)
+    assert '0 of 4 steps to run' in rerun()
+    #a missing fasta file is written again (as are the outputs of the steps after it)
+    fasta=sorted(glob.glob(str(tmp_path/'toyclone2chr21*.fasta')))
+    assert fasta!=[]
+    os.remove(fasta[-1])
+    output=rerun()
+    assert '2 of 4 steps to run' in output and 'Started varincorp-clone2-chr21' in output and os.path.exists(fasta[-1])
+    #as are the bgzip compressed fasta files and indexes, when heterogenesis_varincorp writes them
+    assert '3 of 4 steps to run' in rerun('--varincorpargs=-z')
+    os.remove(str(tmp_path/'toyclone2chr22.fasta.gz.gzi'))
+    output=rerun('--varincorpargs=-z')
+    assert '2 of 4 steps to run' in output and 'Started varincorp-clone2-chr22' in output
+    #varincorp steps given -w use that many cores
+    plan=rerun('--varincorpargs=-z -w 2','-P')
+    assert 'varincorp-clone2-chr21\t' in plan and all(l.split('\t')[3]=='2' for l in plan.splitlines() if l.startswith('varincorp-'))
@@ -0,0 +1,127 @@
+import gzip
+import random
+import struct
+import zlib
+import pytest
+import heterogenesis_bgzf
+
+def reg2bins(beg,end):  #all bins that may overlap 0 based region beg to end (not included), as in the SAM specification
+    end-=1
+    bins=[0]
+    for shift,first in ((26,1),(23,9),(20,73),(17,585),(14,4681)):
+        bins+=list(range(first+(beg>>shift),first+(end>>shift)+1))
+    return bins
+
+def readtbi(filename):
+    data=gzip.open(filename,'rb').read()
+    assert data[:4]==b'TBI\x01'
+    n,format,colseq,colbeg,colend,meta,skip,lnm=struct.unpack('<8i',data[4:36])
+    names=data[36:36+lnm].split(b'\0')[:-1]
+    pos=36+lnm
+    indexes={}
+    for name in names:
+        bins={}
+        nbin=struct.unpack('<i',data[pos:pos+4])[0]
+        pos+=4
+        for i in range(nbin):
+            b,nchunk=struct.unpack('<Ii',data[pos:pos+8])
+            pos+=8
+            bins[b]=[struct.unpack('<QQ',data[pos+16*j:pos+16*j+16]) for j in range(nchunk)]
+            pos+=16*nchunk
+        nintv=struct.unpack('<i',data[pos:pos+4])[0]
+        linear=list(struct.unpack('<'+str(nintv)+'Q',data[pos+4:pos+4+8*nintv]))
+        pos+=4+8*nintv
+        indexes[name.decode()]=(bins,linear)
+    assert pos==len(data)
+    return (format,colseq,colbeg,colend,chr(meta),skip),indexes
+
+def uncompressedoffsets(filename):
+    #dictionary of compressed block offset : uncompressed offset, and the uncompressed data, to resolve virtual offsets
+    data=open(filename,'rb').read()
+    starts={}
+    content=bytearray()
+    coffset=0
+    while coffset<len(data):
+        bsize=struct.unpack('<H',data[coffset+16:coffset+18])[0]
+        starts[coffset]=len(content)
+        content+=zlib.decompress(data[coffset+18:coffset+bsize-7],-15)
+        coffset+=bsize+1
+    return starts,bytes(content)
+
+def query(filename,indexes,chro,beg,end):
+    #lines of records overlapping 0 based beg to end, found using only the index, as tabix does
+    starts,content=uncompressedoffsets(filename)
+    resolve=lambda v: starts[v>>16]+(v&0xffff)
+    bins,linear=indexes[chro]
+    minimum=linear[min(beg>>14,len(linear)-1)] if linear!=[] else 0
+    lines=set()
+    for b in reg2bins(beg,end):
+        for start,stop in bins.get(b,[]):
+            if stop<=minimum:
+                continue
+            for line in content[resolve(start):resolve(stop)].decode().splitlines():
+                lines.add(line)
+    return sorted(l for l in lines if overlaps(l,chro,beg,end))
+
+def overlaps(line,chro,beg,end):
+    fields=line.split('\t')
+    return fields[0]==chro and int(fields[1])-1<end and int(fields[2])>beg
+
+def records(seed=1):
+    #cnv table style records (chromosome, 1 based start and end), sorted by position, with some long enough to span many bins
+    generator=random.Random(seed)
+    lines=[]
+    for chro in ('chr1','chr2'):
+        pos=1
+        for i in range(3000):
+            pos+=generator.randint(0,200)
+            end=pos+(generator.randint(0,300) if generator.random()<0.95 else generator.randint(20000,3000000))
+            lines.append((chro,pos,end,chro+'\t'+str(pos)+'\t'+str(end)+'\t'+str(i)+'\n'))
+    return lines
+
+def test_reg2bin():
+    assert heterogenesis_bgzf.reg2bin(0,1)==4681
+    assert heterogenesis_bgzf.reg2bin(16384,16385)==4682
+    assert heterogenesis_bgzf.reg2bin(0,16385)==585
+    assert heterogenesis_bgzf.reg2bin(0,1<<29)==0
+    for beg,end in ((0,1),(5000,70000),(1<<20,(1<<20)+5),(123456789,123999999)):
+        assert heterogenesis_bgzf.reg2bin(beg,end) in reg2bins(beg,end)
+
+def test_roundtrip(tmp_path):
+    filename=str(tmp_path/'test.txt')
+    lines=records()
+    with heterogenesis_bgzf.TABLEWRITER(filename,True,skip=1) as file:
+        file.write('chromosome\tstart\tend\tname\n')
+        for chro,beg,end,line in lines:
+            file.writerecord(line,chro,beg-1,end)
+    assert gzip.open(filename+'.gz','rt').read()=='chromosome\tstart\tend\tname\n'+''.join(l[3] for l in lines)
+    header,indexes=readtbi(filename+'.gz.tbi')
+    assert header==(0,1,2,3,'#',1)
+    assert list(indexes)==['chr1','chr2']
+    generator=random.Random(2)
+    regions=[('chr1',0,1),('chr2',0,1<<29),('chr1',300000,300001)]+[(generator.choice(['chr1','chr2']),generator.randint(0,700000),0) for i in range(50)]
+    for chro,beg,end in regions:
+        end=end if end>0 else beg+generator.randint(1,50000)
+        expected=sorted(l[3].rstrip('\n') for l in lines if overlaps(l[3],chro,beg,end))
+        assert query(filename+'.gz',indexes,chro,beg,end)==expected
+
+def test_pysam(tmp_path):
+    #check against tabix itself when pysam is installed
+    pysam=pytest.importorskip('pysam')
+    filename=str(tmp_path/'test.txt')
+    lines=records(3)
+    with heterogenesis_bgzf.TABLEWRITER(filename,True,skip=1) as file:
+        file.write('chromosome\tstart\tend\tname\n')
+        for chro,beg,end,line in lines:
+            file.writerecord(line,chro,beg-1,end)
+    tabix=pysam.TabixFile(filename+'.gz')
+    for chro,beg,end in (('chr1',0,1000),('chr1',50000,90000),('chr2',250000,260000)):
+        expected=sorted(l[3].rstrip('\n') for l in lines if overlaps(l[3],chro,beg,end))
+        assert sorted(tabix.fetch(chro,beg,end))==expected
+
+def test_unsorted(tmp_path):
+    index=heterogenesis_bgzf.TABIXINDEX()
+    index.add('chr1',0,10,0,10)
+    index.add('chr2',0,10,10,20)
+    with pytest.raises(ValueError):
+        index.add('chr1',20,30,20,30)
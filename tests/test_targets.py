@@ -0,0 +1,56 @@
+import random
+import heterogenesis_targets
+
+BED='''track name=targets
+#chromosome\tstart\tend
+chr1\t99\t110
+chr1\t300\t320
+chr1\t115\t130
+chr1\t325\t340
+chr2\t0\t10
+chr2\t990\t1200
+chr3\t50\t60
+'''
+
+def targets(tmp_path,lengths,padding):
+    with open(str(tmp_path/'targets.bed'),'w') as file:
+        file.write(BED)
+    return heterogenesis_targets.TARGETS(str(tmp_path/'targets.bed'),lengths,padding)
+
+def test_regions(tmp_path):
+    #bed regions are 0 based and half open, sorted, and merged where they overlap or touch once padded
+    t=targets(tmp_path,{'chr1':1000,'chr2':1000},0)
+    assert t.starts=={'chr1':[100,116,301,326],'chr2':[1,991]} and t.ends=={'chr1':[110,130,320,340],'chr2':[10,1000]}   #(chr2 is clipped to its length, chr3 isn't simulated)
+    assert [t.length(c) for c in ('chr1','chr2','chr3')]==[11+15+20+15,10+10,0]
+    t=targets(tmp_path,{'chr1':1000,'chr2':1000},3)
+    assert t.starts['chr1']==[97,298] and t.ends['chr1']==[133,343]     #(110+3 and 116-3 overlap, 320+3 and 326-3 touch)
+    assert t.starts['chr2']==[1,988] and t.ends['chr2']==[13,1000]  #(padding doesn't go past either end of the chromosome)
+    t=targets(tmp_path,None,0)  #(all chromosomes, as lengths aren't known)
+    assert t.ends['chr2']==[10,1200] and t.starts['chr3']==[51]
+
+def test_clip(tmp_path):
+    t=targets(tmp_path,{'chr1':1000,'chr2':1000},0)
+    assert t.clip('chr1',1,99)==[] and t.clip('chr3',1,1000)==[]
+    assert t.clip('chr1',1,1000)==[(100,110),(116,130),(301,320),(326,340)]
+    assert t.clip('chr1',105,120)==[(105,110),(116,120)]
+    assert t.clip('chr1',110,116)==[(110,110),(116,116)]
+    assert t.clip('chr1',111,115)==[]
+    assert t.clip('chr2',995,1500)==[(995,1000)]
+    #clipping agrees with overlaps and with the targeted bases counted by length
+    generator=random.Random(1)
+    for i in range(500):
+        start=generator.randint(1,1000)
+        end=start+generator.randint(0,200)
+        parts=t.clip('chr1',start,end)
+        assert t.overlaps('chr1',start,end)==(parts!=[])
+        assert sum(e-s+1 for s,e in parts)==len([p for p in range(start,end+1) if any(s<=p<=e for s,e in zip(t.starts['chr1'],t.ends['chr1']))])
+    assert sum(e-s+1 for s,e in t.clip('chr1',1,1000))==t.length('chr1')
+
+def test_position(tmp_path):
+    #random positions are in targets, at or before the last position allowed
+    t=targets(tmp_path,{'chr1':1000,'chr2':1000},0)
+    random.seed(1)
+    positions=[t.position('chr1',1000) for i in range(2000)]
+    assert all(t.overlaps('chr1',p,p) for p in positions) and set(positions)==set(p for s,e in t.clip('chr1',1,1000) for p in range(s,e+1))
+    assert all(100<=t.position('chr1',105)<=105 for i in range(200))
+    assert all(1<=t.position('chr1',50)<=50 for i in range(200))   #(no targeted base at or before 50)
@@ -0,0 +1,243 @@
+import gzip
+import json
+import os
+import shutil
+from copy import deepcopy
+import pytest
+import heterogenesis_query
+import heterogenesis_targets
+import toy
+
+DATA=os.path.join(os.path.dirname(os.path.abspath(__file__)),'data')
+
+def simulate(tmp_path,lengths=(('chr21',20000),('chr22',10000)),**changes):
+    toy.writereference(str(tmp_path/'ref.fa'),list(lengths))
+    jsonfile=toy.writeparameters(str(tmp_path),str(tmp_path/'ref.fa'),chromosomes=[c for c,l in lengths],**changes)
+    toy.run('heterogenesis_vargen','-j',jsonfile)
+    return jsonfile
+
+def copyvariants(tmp_path,name,lengths=(('chr21',20000),('chr22',10000)),**changes):
+    #returns parameters for a run in directory name, with the variants simulated in tmp_path
+    os.mkdir(str(tmp_path/name))
+    shutil.copy(str(tmp_path/'toyvariants.json'),str(tmp_path/name))
+    return toy.writeparameters(str(tmp_path/name),str(tmp_path/'ref.fa'),chromosomes=[c for c,l in lengths],**changes)
+
+def outputs(directory):  #dictionary of name : contents of the output files in directory
+    return dict([(name,toy.read(os.path.join(directory,name))) for name in os.listdir(directory) if name not in ('parameters.json','toyvariants.json')])
+
+def test_metrics(tmp_path):
+    #each stage's peak memory is sampled (where /proc can be read) for the stage itself, so is within the peak of the clone enclosing it
+    jsonfile=simulate(tmp_path)
+    toy.run('heterogenesis_varincorp','-j',jsonfile,'-c','clone1','-m',str(tmp_path/'metrics.jsonl'))
+    with open(str(tmp_path/'metrics.jsonl'),'r') as file:
+        records=[json.loads(line) for line in file]
+    assert set(r['phase'] for r in records)>={'incorporate','combinecnvs','combinevcfs','fasta','cnvfile','vcffile','fastafiles','clone'}
+    assert all(r['processmaxrssmb']>0 for r in records)
+    if not os.path.exists('/proc/self/statm'):
+        assert all('maxrssmb' not in r for r in records)
+        return
+    clone=[r for r in records if r['phase']=='clone'][0]
+    for record in records:
+        assert record['maxrssmb']>0
+        assert record['maxrssmb']<=clone['maxrssmb']
+
+def test_copies():
+    #copy methods of the slotted classes give copies that share nothing that can be changed, as deepcopy did
+    d=toy.definitions('heterogenesis_varincorp',('BLOCK','VCFVAR','CNVBRANCH','copybranches'))
+    block=d['BLOCK'](10,20,'ref','s')
+    copy=block.copy()
+    assert not hasattr(block,'__dict__') and copy is not block and (copy.start,copy.end,copy.content,copy.flag)==(10,20,'ref','s')
+    copy.start,copy.end,copy.content,copy.flag=11,12,2,'e'
+    assert (block.start,block.end,block.content,block.flag)==(10,20,'ref','s')
+    tree=lambda branches: [(b.start,b.end,b.content if b.content=='var' else tree(b.content)) for b in branches]
+    var=d['VCFVAR'](30,'A','G',[d['CNVBRANCH'](1,100,[d['CNVBRANCH'](25,50,'var'),d['CNVBRANCH'](25,50,[d['CNVBRANCH'](25,50,'var')])])],1,'A')
+    expected=tree(var.branches)
+    copy=var.copy()
+    assert tree(copy.branches)==tree(deepcopy(var).branches)==expected
+    copy.branches[0].content[1].content[0].content=[]
+    copy.branches[0].content.append(d['CNVBRANCH'](25,50,'var'))
+    copy.branches.append(d['CNVBRANCH'](1,100,'var'))
+    copy.pos,copy.final=31,2
+    assert tree(var.branches)==expected and (var.pos,var.final)==(30,1)
+    assert d['VCFVAR'](30,'A','G',None,1,'A').copy().branches==None
+
+def readsequences(filename):   #dictionary of name : sequence of a fasta file, or a bgzip compressed one
+    sequences={}
+    with (gzip.open(filename,'rt') if filename.endswith('.gz') else open(filename,'r')) as file:
+        for line in file:
+            if line.startswith('>'):
+                name=line[1:].strip()
+                sequences[name]=[]
+            else:
+                sequences[name].append(line.strip())
+    return dict([(name,''.join(sequences[name])) for name in sequences])
+
+def writevariants(tmp_path,lengths,haplotypes,clonevariants,**changes):
+    #writes a reference, parameters and a variants file with the variants given for clone1 (a function of the reference sequences),
+    #and returns the parameters file
+    toy.writereference(str(tmp_path/'ref.fa'),lengths)
+    sequences=readsequences(str(tmp_path/'ref.fa'))
+    jsonfile=toy.writeparameters(str(tmp_path),str(tmp_path/'ref.fa'),chromosomes=[c for c,l in lengths],**changes)
+    with open(str(tmp_path/'toyvariants.json'),'w') as file:
+        json.dump({'germline':[[],dict([(c,['A','B']) for c,l in lengths])],'clone1':[clonevariants(sequences),haplotypes]},file)
+    return jsonfile
+
+def snv(sequences,chro,hap,pos):
+    ref=sequences[chro][pos-1]
+    return ['snv',chro,hap,pos,ref,'A' if ref!='A' else 'C']
+
+def inversions(sequences):
+    s=sequences
+    return [['cnv','chr1','A',200,400,2,[0,1]],    #a duplication with its second copy inverted, and an inverted triplication within it
+        ['cnv','chr1','A',300,100,3,[1,0,1]],
+        snv(s,'chr1','A',350),['indel','chr1','A',250,1,s['chr1'][249],s['chr1'][249]+'G','i'],snv(s,'chr1','A',599),
+        ['cnv','chr1','B',1,100,2,[1,1]],['cnv','chr1','B',1100,100,2,[0,1]],   #inversions at the start and next to the end of the chromosome
+        snv(s,'chr1','B',1),snv(s,'chr1','B',1150),snv(s,'chr1','B',1200),
+        ['cnv','chr2','A',500,100,0,[]],['cnv','chr2','A',400,100,2,[1,0]],   #an inversion ending where a deletion starts
+        ['indel','chr2','A',450,2,s['chr2'][449:452],s['chr2'][449],'d'],
+        ['cnv','chr2','B',300,200,2,[0,1]],['cnv','chr2','B',450,100,0,[]],   #an inversion whose end is then deleted
+        ['cnv','chr3','A',501,100,2,[1,1]],snv(s,'chr3','A',550)]   #inversions ending at the end of the chromosome
+
+def test_inversions(tmp_path):
+    #the sequences of haplotypes with inverted copies match those from heterogenesis_varincorp before sequences were streamed (in tests/data/inversions),
+    #written as fasta files, to one bgzip compressed file, and from block maps
+    haplotypes={'chr1':['A','B'],'chr2':['A','B'],'chr3':['A','B']}
+    jsonfile=writevariants(tmp_path,[('chr1',1200),('chr2',900),('chr3',600)],haplotypes,inversions)
+    toy.run('heterogenesis_varincorp','-j',jsonfile,'-c','clone1','-b')
+    toy.run('heterogenesis_varincorp','-j',jsonfile,'-c','clone1','-z')
+    compressed=readsequences(str(tmp_path/'toyclone1.fasta.gz'))
+    blocks=heterogenesis_query.BLOCKMAP(str(tmp_path/'toyclone1blocks.bin'),str(tmp_path/'ref.fa'))
+    for chro in haplotypes:
+        for hap in haplotypes[chro]:
+            expected=os.path.join(DATA,'inversions','toyclone1'+chro+hap+'.fasta')
+            assert toy.read(str(tmp_path/os.path.basename(expected)))==toy.read(expected)
+            name='clone1_'+chro+'_'+hap
+            sequence=readsequences(expected)[name]
+            assert compressed[name]==sequence
+            assert blocks.length(name)==len(sequence) and blocks.getsequence(name,1,len(sequence)).decode()==sequence
+
+def targetrecords(blocks,targets,name):
+    #records expected in the fasta file of a haplotype with targets, from its block map: each segment clipped to targets (or an alternate
+    #segment overlapping them) in output order, with parts next to each other in the output joined into one stretch
+    chro=blocks.index['haplotypes'][name]['chromosome']
+    seg=blocks.getsegments(name)
+    stretches=[]    #[reference position of first base, first output position, last output position]
+    for i in range(len(seg['outstart'])):
+        out,start,end=seg['outstart'][i],seg['refstart'][i],seg['refend'][i]
+        if seg['altoffset'][i]!=-1:
+            parts=[(start,out+1,out+seg['length'][i])] if targets.overlaps(chro,start,end) else []
+        elif seg['strand'][i]==1:
+            parts=[(e,out+end-e+1,out+end-s+1) for s,e in targets.clip(chro,start,end)[::-1]]
+        else:
+            parts=[(s,out+s-start+1,out+e-start+1) for s,e in targets.clip(chro,start,end)]
+        for first,outstart,outend in parts:
+            if stretches!=[] and stretches[-1][2]==outstart-1:
+                stretches[-1][2]=outend
+            else:
+                stretches.append([first,outstart,outend])
+    return dict([(name+'_'+str(n+1)+' '+chro+':'+str(first),blocks.getsequence(name,outstart,outend).decode()) for n,(first,outstart,outend) in enumerate(stretches)])
+
+BED='''chr1\t150\t260
+chr1\t340\t360
+chr1\t590\t640
+chr1\t1090\t1300
+chr2\t0\t20
+chr2\t420\t520
+chr3\t540\t600
+chr21\t1000\t3000
+chr21\t8000\t8400
+chr21\t12000\t19000
+chr22\t0\t9900
+'''
+
+@pytest.mark.parametrize('source',['inversions','vargen'])
+def test_targets(tmp_path,source):
+    #with targets, each fasta record is the sequence of a haplotype's block map within targets, so clipped to targets in the same way,
+    #including within inverted and duplicated copies
+    with open(str(tmp_path/'targets.bed'),'w') as file:
+        file.write(BED)
+    if source=='inversions':
+        lengths=[('chr1',1200),('chr2',900),('chr3',600)]
+        jsonfile=writevariants(tmp_path,lengths,{'chr1':['A','B'],'chr2':['A','B'],'chr3':['A','B']},inversions,targets=str(tmp_path/'targets.bed'),targetpadding=5)
+        clones=['clone1']
+    else:
+        lengths=[('chr21',20000),('chr22',10000)]
+        jsonfile=simulate(tmp_path,lengths,targets=str(tmp_path/'targets.bed'),targetpadding=5)
+        clones=['clone1','clone2','clone3']
+    toy.run('heterogenesis_varincorp','-j',jsonfile,'-c',','.join(clones),'-b')
+    targets=heterogenesis_targets.TARGETS(str(tmp_path/'targets.bed'),dict(lengths),5)
+    written=[]
+    for clo in clones:
+        blocks=heterogenesis_query.BLOCKMAP(str(tmp_path/('toy'+clo+'blocks.bin')),str(tmp_path/'ref.fa'))
+        for name in blocks.haplotypes():
+            records=readsequences(str(tmp_path/('toy'+clo+name[len(clo)+1:].replace('_','')+'.fasta')))
+            assert records==targetrecords(blocks,targets,name)
+            written.append(len(records))
+        blocks.close()
+    assert sum(written)>len(written)    #(a haplotype can have no records, eg. chr3 A of the inversions, whose duplication at the end is lost)
+
+def test_lineages(tmp_path):
+    #each haplotype has the variants of the haplotypes it descends from (eg. A-1-2 from A-1 and A), and not those of others with similar names
+    haplotypes={'chr1':['A-1','A-10','A-1-2','B']}
+    positions={'A':100,'A-1':200,'A-10':300,'A-1-2':400,'B':500,'A-2':600}
+    jsonfile=writevariants(tmp_path,[('chr1',1000)],haplotypes,lambda s: [snv(s,'chr1',hap,pos) for hap,pos in positions.items()])
+    toy.run('heterogenesis_varincorp','-j',jsonfile,'-c','clone1')
+    reference=readsequences(str(tmp_path/'ref.fa'))['chr1']
+    for hap,lineage in (('A-1',['A','A-1']),('A-10',['A','A-10']),('A-1-2',['A','A-1','A-1-2']),('B',['B'])):
+        sequence=readsequences(str(tmp_path/('toyclone1chr1'+hap+'.fasta')))['clone1_chr1_'+hap]
+        assert [h for h,pos in positions.items() if sequence[pos-1]!=reference[pos-1]]==lineage
+
+@pytest.mark.parametrize('options',[['-b'],['-z','-i']])
+def test_workers(tmp_path,options):
+    #outputs of all clones are the same whether haplotypes are processed in one process or on a pool of workers
+    simulate(tmp_path,wgdprob=1)
+    for workers in ('1','3'):
+        toy.run('heterogenesis_varincorp','-j',copyvariants(tmp_path,'w'+workers),'-c','all','-w',workers,*options)
+    with open(str(tmp_path/'toyvariants.json'),'r') as file:
+        variants=json.load(file)
+    assert any('-' in hap for clo in variants for hap in variants[clo][1]['chr21'])  #(copies from whole genome duplications, as each aneuploid event is one)
+    assert outputs(str(tmp_path/'w1'))==outputs(str(tmp_path/'w3'))
+
+def test_clonetree(tmp_path):
+    #clones processed in one run, each starting from its parent clone's haplotypes, are the same as each clone processed on its own
+    structure='clone1,0.3,germline,clone2,0.3,clone1,clone3,0.3,clone2,clone4,0.1,clone1'
+    simulate(tmp_path,structure=structure)
+    jsonfile=copyvariants(tmp_path,'together',structure=structure)
+    output=toy.run('heterogenesis_varincorp','-j',jsonfile,'-c','clone1,clone2,clone3,clone4','-b')
+    for clo,parent in (('clone2','clone1'),('clone3','clone2'),('clone4','clone1')):
+        assert 'Starting '+clo+' from haplotypes of '+parent in output
+    together=outputs(str(tmp_path/'together'))
+    for clo in ('clone1','clone2','clone3','clone4'):
+        toy.run('heterogenesis_varincorp','-j',copyvariants(tmp_path,clo,structure=structure),'-c',clo,'-b')
+        alone=outputs(str(tmp_path/clo))
+        assert alone!={} and all(together[name]==alone[name] for name in alone)
+
+def test_resume(tmp_path):
+    #with -r, outputs completed by an earlier run are kept, unless their size or modification time has changed, or they were written with
+    #other output options
+    jsonfile=simulate(tmp_path,aneuploid=0)
+    resume=lambda *options: toy.run('heterogenesis_varincorp','-j',jsonfile,'-c','clone1','-r',*options)
+    assert 'Resuming' not in resume()
+    names=['toyclone1cnv.txt','toyclone1.vcf']+['toyclone1'+chro+hap+'.fasta' for chro in ('chr21','chr22') for hap in ('A','B')]
+    contents=dict([(name,toy.read(str(tmp_path/name))) for name in names])
+    times=lambda: dict([(name,os.stat(str(tmp_path/name)).st_mtime_ns) for name in names])
+    written=times()
+    assert 'Resuming clone1 with 6 outputs already complete and 0 haplotypes to process' in resume()
+    assert times()==written
+    #a fasta file with a new modification time is written again, and only that one
+    os.utime(str(tmp_path/names[2]),ns=(written[names[2]],written[names[2]]+10**9))
+    assert 'with 5 outputs already complete and 1 haplotypes to process' in resume()
+    assert [name for name,time in times().items() if time!=written[name]]==[names[2]]
+    #as is a truncated vcf, with the copy number file (both are written from every haplotype processed again), but not the fasta files
+    written=times()
+    with open(str(tmp_path/names[1]),'r+') as file:
+        file.truncate(100)
+    assert 'with 5 outputs already complete and 4 haplotypes to process' in resume()
+    assert [name for name,time in times().items() if time!=written[name]]==names[:2]
+    assert dict([(name,toy.read(str(tmp_path/name))) for name in names])==contents
+    #with other output options, everything is written again
+    for options in (['-b'],['-b','-z']):
+        written=times()
+        assert 'Resuming' not in resume(*options)
+        assert all(times()[name]!=written[name] for name in (names if '-z' not in options else names[:2]))   #(fasta files aren't written with -z)
+    assert 'with 6 outputs already complete' in resume('-b','-z')
@@ -0,0 +1,61 @@
+import ast
+import json
+import os
+import random
+import subprocess
+import sys
+
+#A small reference genome and parameters for running the scripts end to end
+ROOT=os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def writereference(filename,lengths,seed=1,width=60):
+    #writes a random sequence for each (chromosome, length) to a fasta file, with its fai index
+    generator=random.Random(seed)
+    offset=0
+    with open(filename,'w') as file, open(filename+'.fai','w') as fai:
+        for chro,length in lengths:
+            sequence=''.join(generator.choice('ACGT') for i in range(length))
+            lines=[sequence[i:i+width] for i in range(0,length,width)]
+            file.write('>'+chro+'\n'+''.join(l+'\n' for l in lines))
+            offset+=len(chro)+2
+            fai.write('\t'.join([chro,str(length),str(offset),str(width),str(width+1)])+'\n')
+            offset+=length+len(lines)
+
+def writeparameters(directory,reference,**changes):
+    #writes the parameters of a small simulation to directory/parameters.json, and returns its name
+    parameters={'prefix':'toy','reference':reference,'directory':directory,'structure':'clone1,0.2,germline,clone2,0.8,clone1,clone3,0.5,clone1',
+        'snvgermline':0.002,'indgermline':0.0004,'snvsomatic':0.001,'indsomatic':0.0002,'aneuploid':2,'wgdprob':0.5,
+        'cnvrepgermline':4,'cnvdelgermline':4,'cnvrepsomatic':6,'cnvdelsomatic':6,'cnvgermlinemean':-5,'cnvgermlinevariance':1,
+        'cnvgermlinemultiply':100000,'cnvsomaticmean':-5,'cnvsomaticvariance':1,'cnvsomaticmultiply':100000}
+    parameters.update(changes)
+    parameters=dict([(p,v) for p,v in parameters.items() if v!=None])
+    filename=os.path.join(directory,'parameters.json')
+    with open(filename,'w') as file:
+        json.dump(parameters,file,indent=1)
+    return filename
+
+def writeclones(filename,proportions):
+    with open(filename,'w') as file:
+        file.write(''.join(clo+'\t'+str(p)+'\n' for clo,p in proportions))
+    return filename
+
+def run(script,*args):
+    #runs one of the scripts, failing with its output if it fails, and returns its output
+    process=subprocess.Popen([sys.executable,os.path.join(ROOT,script+'.py')]+list(args),stdout=subprocess.PIPE,stderr=subprocess.STDOUT)
+    output=process.communicate()[0].decode()
+    assert process.returncode==0, output
+    return output
+
+def read(filename):
+    with open(filename,'rb') as file:
+        return file.read()
+
+def definitions(script,names):
+    #classes and functions defined inside a script's main(), by name, for using them on their own
+    with open(os.path.join(ROOT,script+'.py'),'r') as file:
+        tree=ast.parse(file.read())
+    main=[node for node in tree.body if isinstance(node,ast.FunctionDef) and node.name=='main'][0]
+    module=ast.Module(body=[node for node in main.body if getattr(node,'name',None) in names],type_ignores=[])
+    namespace={}
+    exec(compile(module,script+'.py','exec'),namespace)
+    return namespace